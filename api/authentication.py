@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from backend.models import User
+
+# Time the claims were read from the database, copied into every access token made from the refresh token
+CLAIMS_ISSUED_AT = 'claims_iat'
+
+
+def get_revocation_window():
+    """
+    Seconds after which deactivating a user or changing is_staff takes effect at the latest
+    """
+    return getattr(settings, 'API_AUTH_REVOCATION_WINDOW', 300)
+
+
+class UserCache:
+    """
+    Per-process cache of user rows. Holds at most API_AUTH_USER_CACHE_SIZE users, each for
+    at most the revocation window, and hands out a new User instance on every call.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, pk):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(pk)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(pk)
+                return self._instance(entry[1])
+
+        row = User.objects.filter(pk=pk).values_list(*self.field_names()).first()
+        with self.lock:
+            self.entries[pk] = (now + get_revocation_window(), row)
+            self.entries.move_to_end(pk)
+            while len(self.entries) > getattr(settings, 'API_AUTH_USER_CACHE_SIZE', 10000):
+                self.entries.popitem(last=False)
+        return self._instance(row)
+
+    @staticmethod
+    def field_names():
+        return [field.attname for field in User._meta.concrete_fields]
+
+    def _instance(self, row):
+        if row is None:
+            return None
+        return User.from_db(User.objects.db, self.field_names(), row)
+
+    def invalidate(self, pk):
+        with self.lock:
+            self.entries.pop(pk, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+user_cache = UserCache()
+
+
+def load_user(pk):
+    user = user_cache.get(pk)
+    if user is None:
+        raise AuthenticationFailed('User not found', code='user_not_found')
+    return user
+
+
+class LazyUser(SimpleLazyObject):
+    """
+    The authenticated user as far as the token tells: id, is_staff and is_active are answered
+    from the claims, everything else loads the User row through the user cache
+    """
+    def __init__(self, pk, is_staff, is_active):
+        super().__init__(lambda: load_user(pk))
+        self.__dict__.update(claims={'pk': pk, 'is_staff': is_staff, 'is_active': is_active})
+
+    pk = property(lambda self: self.claims['pk'])
+    id = pk
+    is_staff = property(lambda self: self.claims['is_staff'])
+    is_active = property(lambda self: self.claims['is_active'])
+    is_authenticated = True
+    is_anonymous = False
+
+    def __bool__(self):
+        return True
+
+    def __repr__(self):
+        return '<LazyUser: {}>'.format(self.pk)
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['is_staff'] = user.is_staff
+        token['is_active'] = user.is_active
+        token[CLAIMS_ISSUED_AT] = int(time.time())
+        return token
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication without a user query per request. Claims younger than the revocation
+    window are trusted; older ones, and tokens issued without them, are checked against the
+    user cache.
+    """
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        issued_at = validated_token.get(CLAIMS_ISSUED_AT)
+        if issued_at is not None and time.time() - issued_at <= get_revocation_window():
+            is_staff, is_active = validated_token.get('is_staff', False), validated_token.get('is_active', False)
+        else:
+            user = load_user(user_id)
+            is_staff, is_active = user.is_staff, user.is_active
+
+        if not is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return LazyUser(user_id, is_staff, is_active)
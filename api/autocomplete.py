@@ -0,0 +1,177 @@
+import bisect
+import logging
+import threading
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from backend.models import Article, ArticleTombstone, Topic
+from .cache import tag_versions
+
+logger = logging.getLogger(__name__)
+
+# Writes this long before a sync may still have been committing while it ran
+SYNC_MARGIN = timedelta(seconds=60)
+
+
+def normalize(title):
+    return ' '.join(title.casefold().split())
+
+
+class PrefixIndex:
+    """
+    Normalized titles in sorted order, next to the ids they belong to. Finding the titles that
+    start with a prefix is a binary search; adding or removing one shifts the tail of the arrays.
+    """
+    def __init__(self):
+        self.keys = []
+        self.ids = array('q')
+        self.key_of = {}
+
+    def load(self, rows):
+        pairs = sorted((normalize(title), pk) for pk, title in rows)
+        self.keys = [key for key, pk in pairs]
+        self.ids = array('q', (pk for key, pk in pairs))
+        self.key_of = {pk: key for key, pk in pairs}
+
+    def add(self, pk, title):
+        self.remove(pk)
+        key = normalize(title)
+        index = bisect.bisect_right(self.keys, key)
+        self.keys.insert(index, key)
+        self.ids.insert(index, pk)
+        self.key_of[pk] = key
+
+    def remove(self, pk):
+        key = self.key_of.pop(pk, None)
+        if key is None:
+            return
+        index = bisect.bisect_left(self.keys, key)
+        while self.ids[index] != pk:
+            index += 1
+        del self.keys[index]
+        del self.ids[index]
+
+    def search(self, prefix, limit):
+        """
+        Ids of the first `limit` titles starting with `prefix`, in alphabetical order
+        """
+        prefix = normalize(prefix)
+        start = bisect.bisect_left(self.keys, prefix)
+        found = []
+        for index in range(start, min(start + limit, len(self.keys))):
+            if not self.keys[index].startswith(prefix):
+                break
+            found.append(self.ids[index])
+        return found
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def get_sync_interval():
+    return getattr(settings, 'AUTOCOMPLETE_SYNC_INTERVAL', 60)
+
+
+class TitleIndex:
+    """
+    Per-process autocomplete index of the titles of a model, loaded from the database on first use
+    (or by warm_up()). The signals of api.signals change the version of `tag` in the shared API
+    cache on every write, and lookups then sync the index first; so do the lookups that come
+    AUTOCOMPLETE_SYNC_INTERVAL seconds after the last sync, for the writes that didn't reach this
+    process's cache. A single thread syncs at a time, without holding up the lookups of the others.
+    """
+    def __init__(self, model, tag):
+        self.model = model
+        self.tag = tag
+        # Held while the index is read or changed, which syncing only does once it has the rows
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.index = None
+        self.version = None
+        self.synced_at = None
+
+    def build(self):
+        index = PrefixIndex()
+        index.load(self.model.objects.values_list('pk', 'title').iterator(chunk_size=10000))
+        with self.lock:
+            self.index = index
+
+    def sync(self):
+        self.build()
+
+    def is_stale(self, version, now):
+        return (version != self.version or self.synced_at is None
+                or now - self.synced_at >= timedelta(seconds=get_sync_interval()))
+
+    def ensure_synced(self):
+        # Writes made while syncing change the version again
+        version = tag_versions([self.tag])[0]
+        now = timezone.now()
+        if self.index is not None and not self.is_stale(version, now):
+            return
+        # The others keep using the index as it is, unless there is none yet
+        if not self.sync_lock.acquire(blocking=self.index is None):
+            return
+        try:
+            if self.index is None:
+                self.build()
+            elif self.is_stale(version, now):
+                self.sync()
+            else:
+                return
+            self.version, self.synced_at = version, now
+        finally:
+            self.sync_lock.release()
+
+    def search(self, prefix, limit):
+        self.ensure_synced()
+        with self.lock:
+            return self.index.search(prefix, limit)
+
+    def clear(self):
+        with self.sync_lock, self.lock:
+            self.index = self.version = self.synced_at = None
+
+
+class ArticleTitleIndex(TitleIndex):
+    """
+    Syncs with the articles modified or deleted since the last sync, through the (modified, id)
+    indexes of the changes feed, instead of loading every title again
+    """
+    def sync(self):
+        since = self.synced_at - SYNC_MARGIN
+        changed = list(Article.objects.filter(modified__gte=since).values_list('pk', 'title'))
+        deleted = list(ArticleTombstone.objects.filter(modified__gte=since).values_list('pk', flat=True))
+        with self.lock:
+            for pk, title in changed:
+                self.index.add(pk, title)
+            for pk in deleted:
+                self.index.remove(pk)
+
+
+# Topics are few, they are loaded again on every change
+article_titles = ArticleTitleIndex(Article, 'articles')
+topic_titles = TitleIndex(Topic, 'topics')
+
+
+def warm_up():
+    """
+    Builds the indexes of this process in the background, so that the first lookups don't wait
+    """
+    if not getattr(settings, 'AUTOCOMPLETE_WARM_UP', True):
+        return
+
+    def build():
+        try:
+            for titles in (article_titles, topic_titles):
+                titles.ensure_synced()
+        except Exception:
+            logger.exception("Could not build the autocomplete indexes, they will be built on first use")
+        finally:
+            connections.close_all()
+
+    threading.Thread(target=build, name='autocomplete-warm-up', daemon=True).start()
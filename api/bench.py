@@ -0,0 +1,113 @@
+import json
+import math
+import platform
+import subprocess
+import time
+from datetime import datetime, timezone
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, int(math.ceil(fraction * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def summarize(durations, elapsed, queries=None, statuses=None):
+    """
+    Latencies in milliseconds, throughput in requests per second
+    """
+    ordered = sorted(durations)
+    summary = {
+        'requests': len(ordered),
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'throughput_rps': round(len(ordered) / elapsed, 2) if elapsed else None,
+    }
+    if queries is not None:
+        summary['queries_mean'] = round(sum(queries) / len(queries), 2)
+        summary['queries_max'] = max(queries)
+    if statuses is not None:
+        summary['statuses'] = {str(code): statuses.count(code) for code in sorted(set(statuses))}
+    return summary
+
+
+def time_calls(call, repeat, count_queries=False, using='default'):
+    """
+    Calls `call()` `repeat` times and summarizes how long each call took. `call` may
+    return a response, whose status code is then part of the summary.
+    """
+    durations, queries, statuses = [], [], []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        with CaptureQueriesContext(connections[using]) as context:
+            call_started = time.perf_counter()
+            result = call()
+            durations.append(time.perf_counter() - call_started)
+        if count_queries:
+            queries.append(len(context.captured_queries))
+        status_code = getattr(result, 'status_code', None)
+        if status_code is not None:
+            statuses.append(status_code)
+    elapsed = time.perf_counter() - started
+    return summarize(durations, elapsed, queries if count_queries else None, statuses or None)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path, kind, results, **meta):
+    document = {
+        'kind': kind,
+        'meta': dict(
+            meta, timestamp=datetime.now(timezone.utc).isoformat(), revision=git_revision(),
+            python=platform.python_version(),
+        ),
+        'results': results,
+    }
+    with open(path, 'w') as results_file:
+        json.dump(document, results_file, indent=2, sort_keys=True)
+    return document
+
+
+def load_results(path):
+    with open(path) as results_file:
+        return json.load(results_file)
+
+
+def compare(baseline, current, metric='p95_ms', threshold=0.1):
+    """
+    Compares a metric between two result documents. Returns (name, before, after, change, regressed) rows.
+    """
+    rows = []
+    for name, result in sorted(current['results'].items()):
+        before = baseline['results'].get(name, {}).get(metric)
+        after = result.get(metric)
+        if before is None or after is None:
+            rows.append((name, before, after, None, False))
+            continue
+        change = (after - before) / before if before else 0.0
+        rows.append((name, before, after, change, change > threshold))
+    return rows
+
+
+def format_comparison(rows, metric):
+    lines = ['{:<28} {:>12} {:>12} {:>9}'.format('endpoint', 'before', 'after', 'change')]
+    for name, before, after, change, regressed in rows:
+        lines.append('{:<28} {:>12} {:>12} {:>9}{}'.format(
+            name, '-' if before is None else before, '-' if after is None else after,
+            '-' if change is None else '{:+.1%}'.format(change), '  REGRESSION' if regressed else ''
+        ))
+    return '\n'.join(['Comparing {}'.format(metric)] + lines)
@@ -0,0 +1,199 @@
+import hashlib
+from functools import wraps
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from rest_framework.response import Response
+
+from . import coalescing, replicas
+
+TAG_KEY_PREFIX = 'api-tag:'
+RESPONSE_KEY_PREFIX = 'api-response:'
+
+
+def get_cache():
+    return caches[getattr(settings, 'API_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'API_CACHE_TIMEOUT', 300)
+
+
+def bump(tags):
+    get_cache().set_many({TAG_KEY_PREFIX + tag: uuid4().hex for tag in tags}, timeout=None)
+
+
+def invalidate(*tags):
+    """
+    Expires every cached response that depends on one of the given tags: right away, so that the
+    writer's own reads miss the cache, and again once the current transaction commits, as concurrent
+    requests may have cached what they read before the commit under the new versions
+    """
+    if not tags:
+        return
+    bump(tags)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: bump(tags))
+
+
+def tag_versions(tags):
+    """
+    Returns the current version of every tag, creating the missing ones
+    """
+    cache = get_cache()
+    keys = [TAG_KEY_PREFIX + tag for tag in tags]
+    versions = cache.get_many(keys)
+    missing = {key: uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def response_key(request):
+    """
+    Cache key of a response: scheme, host, URL, query string, authenticated user and negotiated
+    media type. The responses contain absolute hyperlinks built from the scheme and the Host header.
+    """
+    user = request.user
+    auth_context = 'user:{}'.format(user.pk) if user and user.is_authenticated else 'anonymous'
+    query = '&'.join(sorted(request.GET.urlencode().split('&')))
+    raw = '|'.join([
+        request.scheme, request.get_host(), request.path, query, auth_context, request.accepted_media_type or ''
+    ])
+    return RESPONSE_KEY_PREFIX + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def compute_etag(content):
+    return '"{}"'.format(hashlib.sha1(content).hexdigest())
+
+
+def not_modified(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    # Weak comparison, as RFC 7232 prescribes for If-None-Match
+    return '*' in etags or etag in etags or 'W/' + etag in etags
+
+
+def conditional_response(request, content, content_type, etag):
+    if not_modified(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type=content_type)
+    response['ETag'] = etag
+    return response
+
+
+def cached_entry(cache, key, versions):
+    entry = cache.get(key)
+    return entry if entry is not None and entry['versions'] == versions else None
+
+
+def render_and_store(handler, view, request, args, kwargs, key, versions, done=None):
+    """
+    Runs the handler and caches its output once rendered. `done` gets the cache entry, or None if
+    the response isn't one to cache.
+    """
+    timeout = get_timeout()
+    if replicas.reading_from_replica():
+        timeout = min(timeout, replicas.get_sticky_window())
+    try:
+        response = handler(view, request, *args, **kwargs)
+    except BaseException:
+        if done is not None:
+            done(None)
+        raise
+    if not isinstance(response, Response) or response.status_code != 200:
+        if done is not None:
+            done(None)
+        return response
+
+    def store(rendered):
+        etag = compute_etag(rendered.content)
+        entry = {
+            'versions': versions,
+            'content': rendered.content,
+            'content_type': rendered['Content-Type'],
+            'etag': etag,
+        }
+        get_cache().set(key, entry, timeout)
+        if done is not None:
+            done(entry)
+        if not_modified(request, etag):
+            rendered = HttpResponseNotModified()
+        rendered['ETag'] = etag
+        return rendered
+
+    response.add_post_render_callback(store)
+    return response
+
+
+def lead_flight(handler, view, request, args, kwargs, key, versions, flight_key, flight):
+    """
+    Renders a response for the requests waiting on `flight`, after the other processes that render
+    it too with API_SINGLE_FLIGHT_SHARED
+    """
+    cache = get_cache()
+    lock = None
+    if coalescing.is_shared():
+        try:
+            entry, lock = coalescing.take_turn(
+                coalescing.lock_key(key, versions), lambda: cached_entry(cache, key, versions)
+            )
+        except BaseException:
+            coalescing.flights.finish(flight_key, flight, None)
+            raise
+        if entry is not None:
+            coalescing.flights.finish(flight_key, flight, entry)
+            return conditional_response(request, entry['content'], entry['content_type'], entry['etag'])
+
+    def done(entry):
+        coalescing.flights.finish(flight_key, flight, entry)
+        if lock is not None:
+            coalescing.release(lock)
+
+    return render_and_store(handler, view, request, args, kwargs, key, versions, done)
+
+
+def cache_response(*tags):
+    """
+    Caches the rendered JSON output of a DRF GET handler until one of its tags is
+    invalidated. Tags are formatted with the URL kwargs, e.g. 'topic:{pk}'.
+    Responses carry a strong ETag, and requests with a matching If-None-Match get a 304.
+    With API_SINGLE_FLIGHT, concurrent requests missing the same entry wait for the first one
+    to render it instead of all running the handler.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            if (request.method != 'GET' or request.accepted_renderer.format != 'json'
+                    or not getattr(settings, 'API_CACHE_ENABLED', True)):
+                return handler(view, request, *args, **kwargs)
+
+            cache = get_cache()
+            key = response_key(request)
+            versions = tag_versions([tag.format(**kwargs) for tag in tags])
+            if replicas.is_sticky():
+                # Clients that just wrote skip the entries (and the renderings of other requests)
+                # that may come from a lagging replica
+                return render_and_store(handler, view, request, args, kwargs, key, versions)
+
+            entry = cached_entry(cache, key, versions)
+            if entry is None and coalescing.is_enabled():
+                flight_key = (key, tuple(versions))
+                flight, leading = coalescing.flights.join(flight_key)
+                if leading:
+                    return lead_flight(handler, view, request, args, kwargs, key, versions, flight_key, flight)
+                # Rendered by the leader, unless it failed or gave a response that isn't cached
+                entry = flight.wait(coalescing.get_wait_timeout())
+            if entry is not None:
+                return conditional_response(request, entry['content'], entry['content_type'], entry['etag'])
+            return render_and_store(handler, view, request, args, kwargs, key, versions)
+        return wrapper
+    return decorator
@@ -0,0 +1,145 @@
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+# Seconds between looks at the shared cache while another process renders a response
+POLL_INTERVAL = 0.05
+
+
+def is_enabled():
+    return getattr(settings, 'API_SINGLE_FLIGHT', True)
+
+
+def is_shared():
+    return getattr(settings, 'API_SINGLE_FLIGHT_SHARED', False)
+
+
+def get_wait_timeout():
+    return getattr(settings, 'API_SINGLE_FLIGHT_TIMEOUT', 10)
+
+
+def get_lock_dir():
+    return getattr(settings, 'API_SINGLE_FLIGHT_LOCK_DIR', None) or os.path.join(tempfile.gettempdir(), 'bloggyblog-api-locks')
+
+
+class Flight:
+    """
+    A computation in progress, and its result once the leader finishes it
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.started = time.monotonic()
+
+    def wait(self, timeout):
+        """
+        The result of the leader, None if it had none to share or took longer than `timeout`
+        """
+        self.done.wait(timeout)
+        return self.result
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent computations of the same key within a process (the requests on its
+    threads): the first caller leads and computes, the ones that come while it does wait for its
+    result instead of repeating the work.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def join(self, key):
+        """
+        Returns (flight, True) when the caller leads a new flight, (flight, False) when it should
+        wait for the one in progress
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            # A leader that hasn't finished in time no longer holds anyone up
+            if flight is not None and time.monotonic() - flight.started < get_wait_timeout():
+                return flight, False
+            flight = self.flights[key] = Flight()
+            return flight, True
+
+    def finish(self, key, flight, result):
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        flight.result = result
+        flight.done.set()
+
+    def clear(self):
+        with self.lock:
+            self.flights.clear()
+
+
+flights = SingleFlight()
+
+
+def lock_key(key, versions):
+    return hashlib.sha1('|'.join([key] + list(versions)).encode('utf-8')).hexdigest()
+
+
+def take_turn(key, lookup):
+    """
+    Waits for the turn of this process to compute what `key` stands for, as long as another process
+    holds it. Returns (result, None) when `lookup()` finds the other process's result meanwhile,
+    otherwise (None, lock) with the lock to release() once done, or (None, None) when waiting timed out.
+    The turns are flock()s on a file per key in API_SINGLE_FLIGHT_LOCK_DIR, exclusive between all the
+    processes (and threads) of a host; the kernel releases them if the process dies.
+    """
+    os.makedirs(get_lock_dir(), exist_ok=True)
+    path = os.path.join(get_lock_dir(), key + '.lock')
+    deadline = time.monotonic() + get_wait_timeout()
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            while not try_lock(fd):
+                time.sleep(POLL_INTERVAL)
+                result = lookup()
+                if result is not None:
+                    os.close(fd)
+                    return result, None
+                if time.monotonic() >= deadline:
+                    os.close(fd)
+                    return None, None
+        except BaseException:
+            os.close(fd)
+            raise
+        try:
+            current = os.stat(path).st_ino == os.fstat(fd).st_ino
+        except FileNotFoundError:
+            current = False
+        if not current:
+            # Locked the file of a turn that is over, which release() removed
+            os.close(fd)
+            continue
+        lock = (path, fd)
+        # The previous turn may have just computed it
+        result = lookup()
+        if result is not None:
+            release(lock)
+            return result, None
+        return None, lock
+
+
+def try_lock(fd):
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def release(lock):
+    path, fd = lock
+    # Removed while locked, so that the lock files don't pile up: the processes waiting on it
+    # notice and lock a new one
+    os.unlink(path)
+    os.close(fd)
@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.db.models.functions import Substr
+from rest_framework import serializers
+
+# Fields of an article that are only sent when asked for with ?fields=
+OPTIONAL_ARTICLE_FIELDS = ('excerpt',)
+
+
+def get_excerpt_length():
+    return getattr(settings, 'ARTICLE_EXCERPT_LENGTH', 200)
+
+
+def make_excerpt(text):
+    """
+    Start of the text, cut at a word boundary. Only reads the first ARTICLE_EXCERPT_LENGTH + 1
+    characters, which is all that excerpt_annotation() loads.
+    """
+    length = get_excerpt_length()
+    if len(text) <= length:
+        return text
+    words = text[:length + 1].split()
+    if not text[length].isspace():
+        # The last word doesn't fit
+        words = words[:-1]
+    return (' '.join(words) or text[:length]) + '…'
+
+
+def excerpt_annotation():
+    return Substr('text', 1, get_excerpt_length() + 1)
+
+
+def parse_names(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def get_article_fields(request, default):
+    """
+    The article fields asked for with ?fields= and ?omit=, in their usual order, or None
+    for the default fields
+    """
+    fields, omit = request.GET.get('fields'), request.GET.get('omit')
+    if not fields and not omit:
+        return None
+
+    available = tuple(default) + OPTIONAL_ARTICLE_FIELDS
+    errors = {}
+    for param, value in (('fields', fields), ('omit', omit)):
+        unknown = [name for name in parse_names(value or '') if name not in available]
+        if unknown:
+            errors[param] = ["Unknown field(s): {}. Choose from: {}.".format(', '.join(unknown), ', '.join(available))]
+    if errors:
+        raise serializers.ValidationError(errors)
+
+    selected = set(parse_names(fields)) if fields else set(default)
+    selected.difference_update(parse_names(omit or ''))
+    return tuple(name for name in available if name in selected)
+
+
+def trim_article_queryset(queryset, fields):
+    """
+    Leaves the text out of the query unless it is asked for, and loads the start of it for the excerpt
+    """
+    if fields is None:
+        return queryset
+    if 'text' not in fields:
+        queryset = queryset.defer('text')
+    if 'excerpt' in fields:
+        queryset = queryset.annotate(excerpt_text=excerpt_annotation())
+    return queryset
+
+
+class ExcerptField(serializers.Field):
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        # Articles from trim_article_queryset() come with just the start of the text
+        if hasattr(instance, 'excerpt_text'):
+            return instance.excerpt_text
+        return instance.text
+
+    def to_representation(self, text):
+        return make_excerpt(text)
+
+
+class SparseFieldsMixin:
+    """
+    Serializer mixin that only outputs the fields in context['fields'], as returned by
+    get_article_fields()
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = self.context.get('fields')
+        if selected is None:
+            return
+        for name in list(self.fields):
+            if name not in selected:
+                self.fields.pop(name)
+        if 'excerpt' in selected:
+            self.fields['excerpt'] = ExcerptField()
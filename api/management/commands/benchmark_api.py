@@ -0,0 +1,173 @@
+import itertools
+import json
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api import bench
+from backend.models import User, Topic, Article
+
+
+class Scenario:
+    def __init__(self, name, method, path, data=None, auth=False):
+        self.name = name
+        self.method = method
+        self.path = path
+        # Either a dict or a callable returning one, for requests that must differ every time
+        self.data = data
+        self.auth = auth
+
+    def payload(self):
+        data = self.data() if callable(self.data) else self.data
+        return None if data is None else json.dumps(data)
+
+
+class Command(BaseCommand):
+    help = "Benchmarks every API endpoint and saves p50/p95/p99 latency, throughput and query counts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint")
+        parser.add_argument('--url', help="Benchmark a running server (e.g. http://localhost:8000) instead of in-process")
+        parser.add_argument('--concurrency', type=int, default=1, help="Concurrent clients, only with --url")
+        parser.add_argument('--endpoints', nargs='*', help="Only run these scenarios")
+        parser.add_argument('--read-only', action='store_true', help="Skip the scenarios that write")
+        parser.add_argument('--cache', action='store_true',
+                            help="Let the response cache answer the repeated reads (in-process they all render otherwise)")
+        parser.add_argument('--password', default='password', help="Password of the staff user, for the token endpoint")
+        parser.add_argument('--output', default='benchmark-{}.json'.format(time.strftime('%Y%m%d-%H%M%S')))
+        parser.add_argument('--compare', help="Earlier result file to compare with")
+        parser.add_argument('--metric', default='p95_ms')
+        parser.add_argument('--threshold', type=float, default=0.1, help="Relative slowdown reported as a regression")
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        scenarios = self.build_scenarios(options['password'], options['read_only'])
+        if options['endpoints']:
+            scenarios = [scenario for scenario in scenarios if scenario.name in options['endpoints']]
+
+        staff = User.objects.filter(is_staff=True, is_active=True).order_by('pk').first()
+        token = str(RefreshToken.for_user(staff).access_token)
+
+        # Every scenario repeats its requests, which the throttles would mostly answer with a 429 and the
+        # response cache with a stored copy: run without rates (and so without throttling), and without
+        # the cache unless asked to. A server benchmarked with --url keeps its own settings.
+        overrides = {'REST_FRAMEWORK': dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={})}
+        if not options['cache']:
+            overrides['API_CACHE_ENABLED'] = False
+        results = {}
+        with override_settings(**overrides):
+            for scenario in scenarios:
+                if options['url']:
+                    result = self.run_http(scenario, options['url'], token, options['requests'], options['concurrency'])
+                else:
+                    result = self.run_in_process(scenario, token, options['requests'])
+                results[scenario.name] = result
+                self.stdout.write('{:<28} p50 {p50_ms:>9.3f} ms  p95 {p95_ms:>9.3f} ms  p99 {p99_ms:>9.3f} ms  '
+                                  '{throughput_rps:>9} req/s  {queries}'.format(
+                                      scenario.name, queries='queries {}'.format(result['queries_mean'])
+                                      if 'queries_mean' in result else '', **result))
+
+        bench.save_results(
+            options['output'], 'api', results, requests=options['requests'], concurrency=options['concurrency'],
+            target=options['url'] or 'in-process', cache=None if options['url'] else options['cache'],
+            articles=Article.objects.count(),
+            topics=Topic.objects.count(), users=User.objects.count(),
+        )
+        self.stdout.write(self.style.SUCCESS("Results saved to {}".format(options['output'])))
+
+        if options['compare']:
+            rows = bench.compare(
+                bench.load_results(options['compare']), bench.load_results(options['output']),
+                options['metric'], options['threshold']
+            )
+            self.stdout.write(bench.format_comparison(rows, options['metric']))
+            if options['fail_on_regression'] and any(row[4] for row in rows):
+                raise CommandError("Performance regressions found.")
+
+    def build_scenarios(self, password, read_only):
+        staff = User.objects.filter(is_staff=True, is_active=True).order_by('pk').first()
+        article = Article.objects.order_by('pk').first()
+        if staff is None or article is None:
+            raise CommandError("Needs a staff user and some articles, run `generate_data` first.")
+        word = article.title.split()[0]
+
+        scenarios = [
+            Scenario('user-detail', 'GET', reverse('user-detail', kwargs={'pk': article.user_id})),
+            Scenario('topic-list', 'GET', reverse('topic-list')),
+            Scenario('topic-detail', 'GET', reverse('topic-detail', kwargs={'pk': article.topic_id})),
+            Scenario('article-list', 'GET', reverse('article-list')),
+            Scenario('article-search', 'GET', '{}?search={}'.format(reverse('article-list'), word)),
+            Scenario('article-detail', 'GET', reverse('article-detail', kwargs={'pk': article.pk})),
+            Scenario('metrics', 'GET', reverse('metrics'), auth=True),
+        ]
+        if read_only:
+            return scenarios
+
+        counter = itertools.count()
+        run = uuid.uuid4().hex[:8]
+        topic_url = 'http://testserver' + reverse('topic-detail', kwargs={'pk': article.topic_id})
+        drafts = iter(Article.objects.filter(status='draft').values_list('pk', flat=True)[:10000])
+        refresh = str(RefreshToken.for_user(staff))
+        scenarios += [
+            Scenario('article-create', 'POST', reverse('article-list'), auth=True, data=lambda: {
+                'title': 'Benchmark article {}-{}'.format(run, next(counter)),
+                'text': 'Created by benchmark_api', 'topic': topic_url,
+            }),
+            # Every request publishes another draft, as long as there are any
+            Scenario('article-publish', 'GET', lambda: reverse('article-publish', kwargs={'pk': next(drafts, article.pk)}),
+                     auth=True),
+            Scenario('token_obtain_pair', 'POST', reverse('token_obtain_pair'),
+                     data={'username': staff.username, 'password': password}),
+            Scenario('token_refresh', 'POST', reverse('token_refresh'), data={'refresh': refresh}),
+        ]
+        return scenarios
+
+    @staticmethod
+    def path(scenario):
+        return scenario.path() if callable(scenario.path) else scenario.path
+
+    def run_in_process(self, scenario, token, requests):
+        client = Client()
+        headers = {'HTTP_AUTHORIZATION': 'Bearer {}'.format(token)} if scenario.auth else {}
+
+        def call():
+            if scenario.method == 'GET':
+                return client.get(self.path(scenario), **headers)
+            return client.post(self.path(scenario), scenario.payload(), content_type='application/json', **headers)
+
+        return bench.time_calls(call, requests, count_queries=True)
+
+    def run_http(self, scenario, base_url, token, requests, concurrency):
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        if scenario.auth:
+            headers['Authorization'] = 'Bearer {}'.format(token)
+
+        def call(_):
+            payload = scenario.payload()
+            request = urllib.request.Request(
+                base_url.rstrip('/') + self.path(scenario), method=scenario.method, headers=headers,
+                data=payload.encode('utf-8') if payload is not None else None,
+            )
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                    status_code = response.status
+            except urllib.error.HTTPError as error:
+                status_code = error.code
+            return time.perf_counter() - started, status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(call, range(requests)))
+        elapsed = time.perf_counter() - started
+        return bench.summarize([duration for duration, _ in outcomes], elapsed,
+                               statuses=[status_code for _, status_code in outcomes])
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api import bench
+from api.serializers import ArticleSerializer, CompiledArticleSerializer
+from backend.models import Article
+
+
+class Command(BaseCommand):
+    help = "Compares ArticleSerializer with CompiledArticleSerializer on the same rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help="Articles serialized per call")
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--output', help="Save the results to this file")
+        parser.add_argument('--compare', help="Earlier result file to compare with")
+
+    def handle(self, *args, **options):
+        request = Request(APIRequestFactory().get('/api/articles/'))
+        queryset = Article.objects.order_by('created', 'id')[:options['rows']]
+        articles = list(queryset)
+        if not articles:
+            raise CommandError("There are no articles, run `generate_data` first.")
+        compiled = CompiledArticleSerializer(request)
+        rows = list(compiled.values(queryset))
+
+        regular = JSONRenderer().render(ArticleSerializer(articles, many=True, context={'request': request}).data)
+        if JSONRenderer().render(compiled.serialize(rows)) != regular:
+            raise CommandError("CompiledArticleSerializer output differs from ArticleSerializer.")
+
+        repeat = options['repeat']
+        results = {
+            'drf': bench.time_calls(
+                lambda: ArticleSerializer(articles, many=True, context={'request': request}).data, repeat),
+            'compiled': bench.time_calls(lambda: CompiledArticleSerializer(request).serialize(rows), repeat),
+            # Including the query, since the fast path reads plain .values() rows
+            'drf-with-query': bench.time_calls(
+                lambda: ArticleSerializer(list(queryset), many=True, context={'request': request}).data, repeat),
+            'compiled-with-query': bench.time_calls(
+                lambda: compiled.serialize(compiled.values(queryset)), repeat),
+        }
+        for name, result in results.items():
+            self.stdout.write('{:<20} p50 {p50_ms:>9.3f} ms  p95 {p95_ms:>9.3f} ms'.format(name, **result))
+        self.stdout.write("Speed-up (p50): {:.1f}x".format(results['drf']['p50_ms'] / max(results['compiled']['p50_ms'], 0.001)))
+
+        if options['output']:
+            bench.save_results(options['output'], 'serializers', results, rows=len(rows), repeat=repeat)
+            if options['compare']:
+                rows = bench.compare(bench.load_results(options['compare']), bench.load_results(options['output']))
+                self.stdout.write(bench.format_comparison(rows, 'p95_ms'))
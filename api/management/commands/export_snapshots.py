@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.snapshots import SnapshotWriter, get_snapshot_dir
+
+
+class Command(BaseCommand):
+    help = ("Pre-renders the JSON of published articles, topic details and the topic list into API_SNAPSHOT_DIR, "
+            "by default only the ones touched by saves since the last run")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Export every snapshot and remove the stale ones")
+        parser.add_argument('--base-url', help="Origin of the hyperlinks, API_SNAPSHOT_BASE_URL by default")
+        parser.add_argument('--loop', action='store_true', help="Keep running, exporting changes every --interval")
+        parser.add_argument('--interval', type=float, default=5, help="Seconds between exports with --loop")
+
+    def handle(self, *args, **options):
+        if not get_snapshot_dir():
+            raise CommandError("Set API_SNAPSHOT_DIR to export snapshots.")
+        writer = SnapshotWriter(base_url=options['base_url'])
+        if options['all']:
+            topics, articles = writer.export_all()
+            self.stdout.write("Exported {} topics and {} articles.".format(topics, articles))
+        while True:
+            exported = writer.export_pending()
+            self.stdout.write("Exported {} changed snapshots.".format(exported))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
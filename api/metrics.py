@@ -0,0 +1,238 @@
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from rest_framework import permissions, renderers, views
+from rest_framework.response import Response
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def get_metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None) or os.path.join(tempfile.gettempdir(), 'bloggyblog-metrics')
+
+
+class MetricsRegistry:
+    """
+    Per-process request metrics, periodically written to a file of their own in METRICS_DIR
+    so that the endpoint can add up the numbers of every gunicorn worker
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.pid = None
+        self.last_flush = 0
+
+    def _ensure_process(self):
+        # Workers are forked after the module is imported, so start over in every new process
+        pid = os.getpid()
+        if self.pid != pid:
+            self.pid = pid
+            self.views = self._read(self.path())
+            self.last_flush = 0
+
+    def path(self, pid=None):
+        return os.path.join(get_metrics_dir(), 'metrics-{}.json'.format(pid or os.getpid()))
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as metrics_file:
+                return json.load(metrics_file)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _empty():
+        return {
+            'requests': 0, 'duration_sum': 0.0, 'buckets': [0] * len(LATENCY_BUCKETS),
+            'queries': 0, 'sql_duration': 0.0, 'response_bytes': 0,
+        }
+
+    def observe(self, view, duration, queries, sql_duration, response_bytes):
+        with self.lock:
+            self._ensure_process()
+            metrics = self.views.setdefault(view, self._empty())
+            metrics['requests'] += 1
+            metrics['duration_sum'] += duration
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    metrics['buckets'][index] += 1
+            metrics['queries'] += queries
+            metrics['sql_duration'] += sql_duration
+            metrics['response_bytes'] += response_bytes
+            if time.monotonic() - self.last_flush >= getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0):
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._ensure_process()
+            self._flush()
+
+    def _flush(self):
+        os.makedirs(get_metrics_dir(), exist_ok=True)
+        path = self.path()
+        temporary = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(temporary, 'w') as metrics_file:
+            json.dump(self.views, metrics_file)
+        os.replace(temporary, path)
+        self.last_flush = time.monotonic()
+
+    def collect(self):
+        """
+        Adds up the metrics of all worker processes, including the ones that exited
+        """
+        self.flush()
+        total = {}
+        for path in glob.glob(os.path.join(get_metrics_dir(), 'metrics-*.json')):
+            for view, metrics in self._read(path).items():
+                merged = total.setdefault(view, self._empty())
+                for name, value in metrics.items():
+                    if name == 'buckets':
+                        merged[name] = [a + b for a, b in zip(merged[name], value)]
+                    else:
+                        merged[name] += value
+        return total
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+            self.pid = None
+            for path in glob.glob(os.path.join(get_metrics_dir(), 'metrics-*.json')):
+                os.remove(path)
+
+
+registry = MetricsRegistry()
+atexit.register(lambda: registry.pid and registry.flush())
+
+
+def render_prometheus(metrics):
+    lines = [
+        '# HELP bloggyblog_request_duration_seconds Request latency by URL name.',
+        '# TYPE bloggyblog_request_duration_seconds histogram',
+    ]
+    for view in sorted(metrics):
+        data = metrics[view]
+        for bound, count in zip(LATENCY_BUCKETS, data['buckets']):
+            lines.append('bloggyblog_request_duration_seconds_bucket{{view="{}",le="{}"}} {}'.format(view, bound, count))
+        lines.append('bloggyblog_request_duration_seconds_bucket{{view="{}",le="+Inf"}} {}'.format(view, data['requests']))
+        lines.append('bloggyblog_request_duration_seconds_sum{{view="{}"}} {}'.format(view, data['duration_sum']))
+        lines.append('bloggyblog_request_duration_seconds_count{{view="{}"}} {}'.format(view, data['requests']))
+
+    counters = (
+        ('bloggyblog_sql_queries_total', 'SQL queries executed while serving requests.', 'queries'),
+        ('bloggyblog_sql_duration_seconds_total', 'Time spent in SQL queries while serving requests.', 'sql_duration'),
+        ('bloggyblog_response_bytes_total', 'Size of the response bodies.', 'response_bytes'),
+    )
+    for name, description, key in counters:
+        lines.append('# HELP {} {}'.format(name, description))
+        lines.append('# TYPE {} counter'.format(name))
+        for view in sorted(metrics):
+            lines.append('{}{{view="{}"}} {}'.format(name, view, metrics[view][key]))
+    return '\n'.join(lines) + '\n'
+
+
+def counting_queries(count_query):
+    """
+    Context manager that runs every query of this thread's connections through count_query
+    """
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(count_query))
+    return stack
+
+
+class StreamedContent:
+    """
+    Wraps the content of a streamed response to count its bytes, and the queries run to produce
+    them, as it is sent. The server closes the response once it is done sending it, which calls
+    `on_close` with the byte count.
+    """
+    def __init__(self, content, count_query, on_close):
+        self.content = content
+        self.count_query = count_query
+        self.on_close = on_close
+        self.size = 0
+        self.closed = False
+
+    def __iter__(self):
+        iterator = iter(self.content)
+        while True:
+            with counting_queries(self.count_query):
+                chunk = next(iterator, None)
+            if chunk is None:
+                return
+            self.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.on_close(self.size)
+
+
+class MetricsMiddleware:
+    """
+    Records latency, SQL query count/time and response size for every resolved URL name. Streamed
+    responses are recorded when they have been sent.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sql = {'queries': 0, 'duration': 0.0}
+
+        def count_query(execute, sql_text, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql_text, params, many, context)
+            finally:
+                sql['queries'] += 1
+                sql['duration'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        with counting_queries(count_query):
+            response = self.get_response(request)
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is None or not resolver_match.url_name:
+            return response
+
+        def observe(size):
+            duration = time.perf_counter() - started
+            registry.observe(resolver_match.url_name, duration, sql['queries'], sql['duration'], size)
+
+        if response.streaming:
+            response.streaming_content = StreamedContent(response.streaming_content, count_query, observe)
+        else:
+            observe(len(response.content))
+        return response
+
+
+class PrometheusRenderer(renderers.BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        return renderers.JSONRenderer().render(data)
+
+
+class MetricsView(views.APIView):
+    """
+    Request metrics of all workers in the Prometheus text format. Staff only.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    renderer_classes = [PrometheusRenderer]
+
+    def get(self, request):
+        return Response(render_prometheus(registry.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,225 @@
+import heapq
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+Cursor = namedtuple('Cursor', ['reverse', 'position'])
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination over a composite, unique ordering, (created, id) by default.
+
+    Each page is fetched with a `WHERE (created, id) > (...)` condition instead of an
+    OFFSET, so every page costs the same no matter how deep it is. If the queryset is
+    already ordered (e.g. search results by rank) that ordering is used instead; it
+    must end with a unique field.
+    """
+    ordering = ('created', 'id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+
+        if reverse:
+            queryset = queryset.order_by(*self._reversed(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if self.cursor is not None:
+            queryset = queryset.filter(self._after(self.parse_position(queryset, self.cursor.position), reverse))
+
+        # Fetch one extra item to find out whether there is a following page
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_following
+        else:
+            self.has_next, self.has_previous = has_following, self.cursor is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_ordering(self, request, queryset, view):
+        if queryset.query.order_by:
+            return tuple(queryset.query.order_by)
+        return tuple(self.ordering)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # Walked backwards past the first item, start again from the top
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(Cursor(reverse=False, position=self._position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return self.encode_cursor(Cursor(reverse=True, position=self.cursor.position))
+        return self.encode_cursor(Cursor(reverse=True, position=self._position(self.page[0])))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            tokens = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position = tokens['p']
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+            return Cursor(reverse=bool(tokens.get('r')), position=position)
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def parse_position(self, queryset, position):
+        """
+        The values of a cursor position as the ordering fields of `queryset` take them. Cursors are
+        only encoded, a client may have edited one: values that don't fit raise NotFound.
+        """
+        parsed = []
+        for order, value in zip(self.ordering, position):
+            field = self._field(queryset, order.lstrip('-'))
+            try:
+                if value is None:
+                    raise ValueError
+                value = field.to_python(value)
+                # The range of the 64-bit integers of the databases
+                if isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63:
+                    raise ValueError
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+            parsed.append(value)
+        return parsed
+
+    @staticmethod
+    def _field(queryset, name):
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.pk if name == 'pk' else queryset.model._meta.get_field(name)
+
+    def encode_cursor(self, cursor):
+        tokens = {'p': cursor.position}
+        if cursor.reverse:
+            tokens['r'] = 1
+        encoded = urlsafe_b64encode(json.dumps(tokens, separators=(',', ':')).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def _position(self, instance):
+        position = []
+        for order in self.ordering:
+            field_name = order.lstrip('-')
+            value = instance[field_name] if isinstance(instance, dict) else getattr(instance, field_name)
+            if isinstance(value, (datetime, date)):
+                value = value.isoformat()
+            position.append(value)
+        return position
+
+    def _after(self, position, reverse):
+        """
+        Builds the keyset condition `(a, b, ...) > (x, y, ...)`, honouring the
+        direction of every field in the ordering
+        """
+        condition = Q()
+        for index in reversed(range(len(self.ordering))):
+            order = self.ordering[index]
+            field_name = order.lstrip('-')
+            descending = order.startswith('-') != reverse
+            lookup = '{}__{}'.format(field_name, 'lt' if descending else 'gt')
+            strictly_after = Q(**{lookup: position[index]})
+            if index == len(self.ordering) - 1:
+                condition = strictly_after
+            else:
+                condition = strictly_after | (Q(**{field_name: position[index]}) & condition)
+        # Repeat a non-strict bound on the leading field so the database can use an index range scan
+        order = self.ordering[0]
+        lookup = '{}__{}'.format(order.lstrip('-'), 'lte' if order.startswith('-') != reverse else 'gte')
+        return Q(**{lookup: position[0]}) & condition
+
+    @staticmethod
+    def _reversed(ordering):
+        return tuple(order[1:] if order.startswith('-') else '-' + order for order in ordering)
+
+
+class ChangesGone(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = "Deletions this old are no longer kept, fetch the whole article list again."
+    default_code = 'changes_gone'
+
+
+class ChangesFeedPagination(KeysetCursorPagination):
+    """
+    Forward-only keyset pagination of a changes feed that merges several querysets (e.g. articles
+    and their tombstones) by (modified, pk). Every page links to the next one, the last page too:
+    clients keep that link and poll it for the changes that come after.
+    """
+    ordering = ('modified', 'pk')
+
+    def paginate_changes(self, querysets, request, start=None, horizon=None):
+        """
+        Returns the next page as (index of the queryset, row) pairs. The querysets must give dicts
+        with `modified` and `pk`. Without a cursor the feed begins at `start` (inclusive), or at the
+        very beginning; a feed beginning before `horizon` raises ChangesGone.
+        """
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is not None:
+            position = self.cursor.position
+            after = self.parse_position(querysets[0], position)
+            modified = after[0]
+            if timezone.is_naive(modified):
+                raise NotFound(self.invalid_cursor_message)
+        elif start is not None:
+            position, modified = [start.isoformat(), 0], start
+            after = [start, 0]
+        else:
+            position = after = modified = None
+        if horizon is not None and modified is not None and modified < horizon:
+            raise ChangesGone()
+
+        rows = []
+        for index, queryset in enumerate(querysets):
+            queryset = queryset.order_by(*self.ordering)
+            if after is not None:
+                queryset = queryset.filter(self._after(after, reverse=False))
+            # One extra row to find out whether there is a following page
+            rows.append([(index, row) for row in queryset[:self.page_size + 1]])
+        merged = list(heapq.merge(*rows, key=lambda item: (item[1]['modified'], item[1]['pk'])))
+        self.page = merged[:self.page_size]
+        self.has_next = len(merged) > self.page_size
+        self.position = self._position(self.page[-1][1]) if self.page else position
+        return self.page
+
+    def get_next_link(self):
+        if self.position is None:
+            return self.base_url
+        return self.encode_cursor(Cursor(reverse=False, position=self.position))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('has_more', self.has_next),
+            ('results', data),
+        ]))
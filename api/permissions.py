@@ -5,5 +5,5 @@ class IsOwnerOrAdmin(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
-        return obj.user == request.user or request.user.is_staff
+        return obj.user_id == request.user.pk or request.user.is_staff
 
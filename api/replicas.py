@@ -0,0 +1,138 @@
+import hashlib
+import random
+import threading
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+STICKY_KEY_PREFIX = 'replicas-sticky:'
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def get_sticky_window():
+    return getattr(settings, 'REPLICA_STICKY_WINDOW', 5)
+
+
+class RoutingState(threading.local):
+    """
+    What the request handled by the current thread may read from. Outside of requests
+    (management commands, shells, tests) everything goes to the primary.
+    """
+    use_replica = False
+    sticky = False
+    wrote = False
+
+    def reset(self, use_replica=False, sticky=False):
+        self.use_replica = use_replica
+        self.sticky = sticky
+        self.wrote = False
+
+
+state = RoutingState()
+
+
+def reading_from_replica():
+    return bool(state.use_replica and not state.wrote and get_replicas())
+
+
+def is_sticky():
+    return state.sticky
+
+
+def record_writes(execute, sql, params, many, context):
+    """
+    Execute wrapper of the primary: once a request wrote something, it reads its own writes from
+    the primary as well
+    """
+    if sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+        state.wrote = True
+    return execute(sql, params, many, context)
+
+
+class ReplicaRouter:
+    """
+    Sends reads of safe requests to a random replica and everything else to the primary
+    """
+    def db_for_read(self, model, **hints):
+        if reading_from_replica() and not connections['default'].in_atomic_block:
+            return random.choice(get_replicas())
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same data as the primary
+        return True
+
+
+class ReplicaMiddleware:
+    """
+    Lets safe requests read from the replicas, unless the client wrote something during the
+    last REPLICA_STICKY_WINDOW seconds. Clients are recognized by a cookie, and API clients
+    that don't keep cookies by their Authorization header, in the API cache (which the processes
+    must share, see check_shared_cache()).
+    """
+    cookie_name = 'use_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    @staticmethod
+    def sticky_key(request):
+        authorization = request.META.get('HTTP_AUTHORIZATION')
+        if authorization:
+            return STICKY_KEY_PREFIX + hashlib.sha1(authorization.encode('utf-8')).hexdigest()
+        return None
+
+    def is_sticky(self, request):
+        from .cache import get_cache
+
+        if request.COOKIES.get(self.cookie_name):
+            return True
+        key = self.sticky_key(request)
+        return key is not None and get_cache().get(key) is not None
+
+    def __call__(self, request):
+        sticky = bool(get_replicas()) and self.is_sticky(request)
+        state.reset(use_replica=request.method in SAFE_METHODS and not sticky, sticky=sticky)
+        try:
+            with connections['default'].execute_wrapper(record_writes):
+                response = self.get_response(request)
+            wrote = state.wrote
+        finally:
+            state.reset()
+
+        if wrote and get_replicas():
+            from .cache import get_cache
+
+            window = get_sticky_window()
+            response.set_cookie(self.cookie_name, '1', max_age=window, httponly=True)
+            key = self.sticky_key(request)
+            if key is not None:
+                get_cache().set(key, True, window)
+        return response
+
+
+def check_shared_cache(app_configs, **kwargs):
+    """
+    System check: with replicas, the Authorization headers of the clients that just wrote are kept
+    in the API cache, where all the processes must find them
+    """
+    from .cache import get_cache
+
+    if get_replicas() and isinstance(get_cache(), (LocMemCache, DummyCache)):
+        return [checks.Error(
+            "DATABASE_REPLICAS needs an API cache that the server processes share.",
+            hint="Set API_CACHE_DIR, or point API_CACHE_ALIAS at a shared cache such as memcached.",
+            id='api.E001',
+        )]
+    return []
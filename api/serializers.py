@@ -1,11 +1,23 @@
+from collections import OrderedDict
+from urllib import parse
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Max
+from django.urls import Resolver404, resolve
 from rest_framework import serializers
 from rest_framework import fields
+from rest_framework.reverse import reverse
 
 from backend.models import User, Article, Topic
+from backend.search import index_articles
+from backend.utils import BATCH_SIZE, MAX_PK, chunks
+from .fieldsets import SparseFieldsMixin, make_excerpt, trim_article_queryset
 
 
 # USER-related serializers
-class UserArticleSerializer(serializers.ModelSerializer):
+class UserArticleSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     topic = serializers.CharField()
 
     class Meta:
@@ -19,21 +31,19 @@ class UserArticleSerializer(serializers.ModelSerializer):
 class UserSerializer(serializers.ModelSerializer):
     email = serializers.EmailField()
     articles = fields.SerializerMethodField()
-    articles_count = fields.SerializerMethodField()
+    articles_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
         fields = ('first_name', 'last_name', 'username', 'email', 'articles_count', 'articles')
 
     def get_articles(self, user):
-        return UserArticleSerializer(user.articles.all(), many=True).data
-
-    def get_articles_count(self, user):
-        return user.articles.all().count()
+        context = {'fields': self.context.get('article_fields')}
+        return UserArticleSerializer(user.articles.all(), many=True, context=context).data
 
 
 # ARTICLE-related serializers
-class ArticleSerializer(serializers.HyperlinkedModelSerializer):
+class ArticleSerializer(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
     user = serializers.HyperlinkedRelatedField(view_name='user-detail', read_only=True)
     created = serializers.SerializerMethodField()
 
@@ -59,20 +69,217 @@ class ArticleSerializer(serializers.HyperlinkedModelSerializer):
         return title
 
     def create(self, validated_data):
-        validated_data['user'] = self.user
+        validated_data['user_id'] = self.user.pk
         post = Article.objects.create(**validated_data)
         return post
 
 
+class CompiledArticleSerializer:
+    """
+    Read-only fast path with exactly the output of ArticleSerializer, for list and retrieve.
+    It works on `.values()` rows, and builds the hyperlinks from URL templates reversed
+    once per request instead of once per row. `fields` is a selection from get_article_fields().
+    """
+    values_fields = ('id', 'title', 'text', 'topic_id', 'status', 'user_id', 'created')
+    # Stands in for the primary key while reversing the URL templates
+    PK_PLACEHOLDER = 987654321
+
+    def __init__(self, request, fields=None):
+        self.topic_url = self.url_template('topic-detail', request)
+        self.user_url = self.url_template('user-detail', request)
+        self.fields = fields
+        self.getters = None
+        if fields is not None:
+            getters = {
+                'title': lambda row: row['title'],
+                'text': lambda row: row['text'],
+                'topic': lambda row: self.topic_url.format(row['topic_id']),
+                'status': lambda row: row['status'],
+                'user': lambda row: self.user_url.format(row['user_id']),
+                'created': lambda row: self.format_created(row['created']),
+                'excerpt': lambda row: make_excerpt(row['excerpt_text']),
+            }
+            self.getters = [(name, getters[name]) for name in fields]
+
+    def url_template(self, view_name, request):
+        url = reverse(view_name, kwargs={'pk': self.PK_PLACEHOLDER}, request=request)
+        prefix, suffix = url.rsplit(str(self.PK_PLACEHOLDER), 1)
+        return prefix.replace('{', '{{').replace('}', '}}') + '{}' + suffix.replace('{', '{{').replace('}', '}}')
+
+    def values(self, queryset, *extra):
+        """
+        The rows the serializer needs and the `extra` fields, keeping any search rank for the pagination
+        """
+        fields = list(self.values_fields) + list(extra)
+        if self.fields is not None:
+            queryset = trim_article_queryset(queryset, self.fields)
+            if 'text' not in self.fields:
+                fields.remove('text')
+            if 'excerpt' in self.fields:
+                fields.append('excerpt_text')
+        if 'search_rank' in queryset.query.annotations:
+            fields.append('search_rank')
+        return queryset.values(*fields)
+
+    @staticmethod
+    def format_created(created):
+        # Same as strftime("%Y-%d-%m %H:%M"), without parsing the format for every row
+        return '%04d-%02d-%02d %02d:%02d' % (created.year, created.day, created.month, created.hour, created.minute)
+
+    def to_representation(self, row):
+        if self.getters is not None:
+            return {name: getter(row) for name, getter in self.getters}
+        return {
+            'title': row['title'],
+            'text': row['text'],
+            'topic': self.topic_url.format(row['topic_id']),
+            'status': row['status'],
+            'user': self.user_url.format(row['user_id']),
+            'created': self.format_created(row['created']),
+        }
+
+    def serialize(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+
+class BulkTopicField(serializers.HyperlinkedRelatedField):
+    """
+    Looks topics up in the ones preloaded by ArticleBulkListSerializer instead of querying per item
+    """
+    def get_object(self, view_name, view_args, view_kwargs):
+        try:
+            return self.context['topics'][int(view_kwargs['pk'])]
+        except KeyError:
+            raise ObjectDoesNotExist
+
+
+class ArticleBulkListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            items = [item for item in data if isinstance(item, dict)]
+            self.preload_topics(items)
+            self.preload_titles(items)
+        return super().to_internal_value(data)
+
+    def preload_topics(self, items):
+        topic_ids = set()
+        for item in items:
+            try:
+                match = resolve(parse.urlparse(str(item.get('topic', ''))).path)
+                # Keys no table can hold are left out, so they fail validation as unknown topics
+                if match.url_name == 'topic-detail' and 0 < int(match.kwargs['pk']) <= MAX_PK:
+                    topic_ids.add(int(match.kwargs['pk']))
+            except (Resolver404, ValueError):
+                pass
+        self._context['topics'] = Topic.objects.in_bulk(topic_ids)
+
+    def preload_titles(self, items):
+        titles = list({item['title'] for item in items if isinstance(item.get('title'), str)})
+        existing = set()
+        for chunk in chunks(titles):
+            existing.update(Article.objects.filter(title__in=chunk).values_list('title', flat=True))
+        self._context['existing_titles'] = existing
+        self._context['seen_titles'] = set()
+
+    def create(self, validated_data):
+        user = self.child.user
+        articles = [Article(user_id=user.pk, **attrs) for attrs in validated_data]
+        with transaction.atomic():
+            Article.objects.bulk_create(articles, batch_size=BATCH_SIZE)
+            if articles and any(article.pk is None for article in articles):
+                self.backfill_primary_keys(articles)
+            index_articles(articles)
+        return articles
+
+    @staticmethod
+    def backfill_primary_keys(articles):
+        """
+        Only some backends return the primary keys of bulk-inserted rows. On SQLite, the transaction
+        holds the write lock from the first INSERT on, and AUTOINCREMENT keys only go up in insertion
+        order, so the rows just inserted have the newest keys, one after the other.
+        """
+        last = Article.objects.aggregate(last=Max('pk'))['last']
+        rows = list(Article.objects.filter(pk__gt=last - len(articles), pk__lte=last).order_by('pk').values_list('pk', 'title'))
+        if [title for pk, title in rows] != [article.title for article in articles]:
+            raise RuntimeError("Could not find the primary keys of the inserted articles.")
+        for article, (pk, title) in zip(articles, rows):
+            article.pk = pk
+
+
+class ArticleBulkSerializer(ArticleSerializer):
+    """
+    ArticleSerializer for creating many articles at once, with set-based title and topic checks
+    """
+    topic = BulkTopicField(view_name='topic-detail', queryset=Topic.objects.all())
+
+    class Meta(ArticleSerializer.Meta):
+        list_serializer_class = ArticleBulkListSerializer
+
+    def validate_title(self, title):
+        if title in self.context['existing_titles'] or title in self.context['seen_titles']:
+            raise serializers.ValidationError("Article with given title already exists!")
+        self.context['seen_titles'].add(title)
+        return title
+
+
+class ArticlePublishSerializer(serializers.Serializer):
+    """
+    Articles to publish at once, or at publish_at when that is in the future
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1, max_value=MAX_PK), allow_empty=False)
+    publish_at = serializers.DateTimeField(required=False, allow_null=True)
+
+    def validate_ids(self, ids):
+        limit = getattr(settings, 'ARTICLE_BULK_PUBLISH_LIMIT', 5000)
+        if len(ids) > limit:
+            raise serializers.ValidationError("At most {} articles can be published at once.".format(limit))
+        return list(OrderedDict.fromkeys(ids))
+
+
+class ArticleBatchSerializer(serializers.Serializer):
+    """
+    Comma-separated ids of the articles to retrieve at once, e.g. ?ids=1,2,3
+    """
+    ids = serializers.CharField()
+
+    def validate_ids(self, value):
+        try:
+            ids = [int(pk) for pk in value.split(',') if pk.strip()]
+        except ValueError:
+            ids = None
+        if not ids or min(ids) < 1 or max(ids) > MAX_PK:
+            raise serializers.ValidationError("Expected a comma-separated list of article ids.")
+        ids = list(OrderedDict.fromkeys(ids))
+        limit = getattr(settings, 'ARTICLE_BATCH_LIMIT', 100)
+        if len(ids) > limit:
+            raise serializers.ValidationError("At most {} articles can be retrieved at once.".format(limit))
+        return ids
+
+
+class AutocompleteSerializer(serializers.Serializer):
+    """
+    Query parameters of the title autocomplete
+    """
+    q = serializers.CharField()
+    type = serializers.ChoiceField(choices=['articles', 'topics'], required=False)
+    limit = serializers.IntegerField(min_value=1, required=False)
+
+    def validate_limit(self, limit):
+        maximum = getattr(settings, 'AUTOCOMPLETE_MAX_LIMIT', 50)
+        if limit > maximum:
+            raise serializers.ValidationError("Ensure this value is less than or equal to {}.".format(maximum))
+        return limit
+
+
 # TOPIC-related Serializers
-class TopicArticleSerializer(serializers.ModelSerializer):
+class TopicArticleSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Article
         fields = ('title', 'text', 'status')
 
 
 class TopicDetailSerializer(serializers.HyperlinkedModelSerializer):
-    articles_count = serializers.SerializerMethodField()
+    articles_count = serializers.IntegerField(read_only=True)
     articles = serializers.SerializerMethodField()
     url = serializers.HyperlinkedIdentityField(view_name='topic-detail', read_only=True)
 
@@ -80,24 +287,29 @@ class TopicDetailSerializer(serializers.HyperlinkedModelSerializer):
         model = Topic
         fields = ('title', 'url', 'articles_count', 'articles')
 
-    def get_articles_count(self, topic):
-        return topic.articles.all().count()
-
     def get_articles(self, topic):
-        return TopicArticleSerializer(topic.articles.all(), many=True).data
+        context = {'fields': self.context.get('article_fields')}
+        return TopicArticleSerializer(topic.articles.all(), many=True, context=context).data
+
+    def to_representation_without_articles(self, topic):
+        """
+        Everything but the articles, which the streaming view renders one by one
+        """
+        data = OrderedDict()
+        for field in self._readable_fields:
+            if field.field_name != 'articles':
+                data[field.field_name] = field.to_representation(field.get_attribute(topic))
+        return data
 
 
 class TopicListSerializer(serializers.HyperlinkedModelSerializer):
-    articles_count = serializers.SerializerMethodField()
+    articles_count = serializers.IntegerField(read_only=True)
     url = serializers.HyperlinkedIdentityField(view_name='topic-detail', read_only=True)
 
     class Meta:
         model = Topic
         fields = ('title', 'url', 'articles_count')
 
-    def get_articles_count(self, topic):
-        return topic.articles.all().count()
-
     def validate_title(self, title):
         exists = Topic.objects.filter(title=title).exists()
         if exists:
@@ -0,0 +1,78 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from backend.models import User, Topic, Article
+from backend.signals import (
+    articles_bulk_created, articles_published, related_articles_rebuilt, related_articles_updated, search_index_rebuilt
+)
+from . import cache
+from .authentication import user_cache
+from .snapshots import mark_pending
+
+
+def invalidate(*tags):
+    """
+    Expires the cached responses and queues the static snapshots that depend on the tags
+    """
+    cache.invalidate(*tags)
+    mark_pending(*tags)
+
+
+def article_tags(article):
+    tags = {'articles', 'topics', 'article:{}'.format(article.pk)}
+    states = [(article.topic_id, article.user_id)]
+    old_state = getattr(article, '_old_counted_state', None)
+    if old_state is not None:
+        states.append(old_state[:2])
+    for topic_id, user_id in states:
+        tags.update(['topic:{}'.format(topic_id), 'user:{}'.format(user_id)])
+    return tags
+
+
+@receiver(post_save, sender=Article)
+@receiver(post_delete, sender=Article)
+def invalidate_article(sender, instance, **kwargs):
+    invalidate(*article_tags(instance))
+
+
+@receiver(articles_bulk_created)
+def invalidate_bulk_created_articles(sender, articles, **kwargs):
+    tags = set()
+    for article in articles:
+        tags.update(article_tags(article))
+    # Articles created in bulk may not have a primary key yet
+    tags.discard('article:None')
+    invalidate(*tags)
+
+
+@receiver(articles_published)
+def invalidate_published_articles(sender, articles, **kwargs):
+    tags = set()
+    for article in articles:
+        tags.update(article_tags(article))
+    invalidate(*tags)
+
+
+@receiver(search_index_rebuilt)
+@receiver(related_articles_rebuilt)
+@receiver(related_articles_updated)
+def invalidate_rebuilt_indexes(sender, **kwargs):
+    cache.invalidate('articles')
+
+
+@receiver(post_save, sender=Topic)
+@receiver(post_delete, sender=Topic)
+def invalidate_topic(sender, instance, **kwargs):
+    tags = {'topics', 'topic:{}'.format(instance.pk)}
+    # The topic title is part of the article list of every user that wrote in it
+    user_ids = Article.objects.filter(topic_id=instance.pk).values_list('user_id', flat=True).distinct()
+    tags.update('user:{}'.format(user_id) for user_id in user_ids)
+    invalidate(*tags)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    cache.invalidate('user:{}'.format(instance.pk))
+    # Other processes catch up within API_AUTH_REVOCATION_WINDOW
+    user_cache.invalidate(instance.pk)
@@ -0,0 +1,247 @@
+import io
+import os
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import transaction
+from rest_framework.request import Request
+from whitenoise.compress import Compressor
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from backend.models import Article, Topic
+from backend.utils import chunks
+from .serializers import CompiledArticleSerializer, TopicArticleSerializer, TopicDetailSerializer, TopicListSerializer
+from .streaming import ITERATOR_CHUNK_SIZE, buffered, dumps, iter_object
+
+# Markers of the snapshots to export again, named after the cache tags of api.signals
+PENDING_DIR = '.pending'
+PENDING_KINDS = ('topic', 'article')
+VARIANT_SUFFIXES = ('.gz', '.br')
+
+
+def get_snapshot_dir():
+    return getattr(settings, 'API_SNAPSHOT_DIR', None)
+
+
+def get_snapshot_url():
+    return getattr(settings, 'API_SNAPSHOT_URL', '/snapshots/')
+
+
+def topic_name(pk):
+    return 'topics/{}.json'.format(pk)
+
+
+def article_name(pk):
+    return 'articles/{}.json'.format(pk)
+
+
+def snapshot_request(base_url=None):
+    """
+    Request of an anonymous client of API_SNAPSHOT_BASE_URL, which the hyperlinks in the snapshots point to
+    """
+    url = urlparse(base_url or getattr(settings, 'API_SNAPSHOT_BASE_URL', 'http://localhost:8000'))
+    return Request(WSGIRequest({
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': '/',
+        'HTTP_HOST': url.netloc,
+        'SERVER_NAME': url.hostname,
+        'SERVER_PORT': str(url.port or (443 if url.scheme == 'https' else 80)),
+        'wsgi.url_scheme': url.scheme,
+        'wsgi.input': io.BytesIO(),
+    }))
+
+
+def add_pending(directory, names):
+    pending = os.path.join(directory, PENDING_DIR)
+    os.makedirs(pending, exist_ok=True)
+    for name in names:
+        open(os.path.join(pending, name), 'a').close()
+
+
+def take_pending(directory):
+    """
+    Removes and returns the pending markers. Saves that happen meanwhile add theirs again.
+    """
+    pending = os.path.join(directory, PENDING_DIR)
+    try:
+        names = os.listdir(pending)
+    except FileNotFoundError:
+        return set()
+    taken = set()
+    for name in names:
+        try:
+            os.remove(os.path.join(pending, name))
+        except FileNotFoundError:
+            # Taken by another export
+            continue
+        taken.add(name)
+    return taken
+
+
+def mark_pending(*tags):
+    """
+    Queues the snapshots that depend on the given cache tags for the next `export_snapshots`,
+    once the current transaction commits
+    """
+    directory = get_snapshot_dir()
+    names = [
+        tag.replace(':', '-') for tag in tags
+        if tag == 'topics' or (tag.split(':', 1)[0] in PENDING_KINDS and not tag.endswith(':None'))
+    ]
+    if directory and names:
+        transaction.on_commit(lambda: add_pending(directory, names))
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class SnapshotWriter:
+    """
+    Renders the anonymous API responses of published articles, topic details and the topic list into
+    files, each next to its gzip and (with the brotli package) Brotli variant. The output is the same
+    as the API's, and files are replaced atomically so that WhiteNoise never serves half of one.
+    """
+    def __init__(self, directory=None, base_url=None):
+        self.directory = directory or get_snapshot_dir()
+        self.request = snapshot_request(base_url)
+        self.compressor = Compressor(quiet=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, *name.split('/'))
+
+    def write(self, name, parts):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary, 'wb') as snapshot_file:
+            for chunk in buffered(parts):
+                snapshot_file.write(chunk)
+        # Variants that don't make the file smaller are not written
+        compressed = set(self.compressor.compress(temporary))
+        for suffix in VARIANT_SUFFIXES:
+            if temporary + suffix in compressed:
+                os.replace(temporary + suffix, path + suffix)
+            else:
+                remove_file(path + suffix)
+        os.replace(temporary, path)
+
+    def remove(self, name):
+        path = self.path(name)
+        remove_file(path)
+        for suffix in VARIANT_SUFFIXES:
+            remove_file(path + suffix)
+
+    def export_topic_list(self):
+        serializer = TopicListSerializer(Topic.objects.all(), many=True, context={'request': self.request})
+        self.write('topics.json', [dumps(serializer.data)])
+
+    def export_topic(self, pk):
+        try:
+            topic = Topic.objects.get(pk=pk)
+        except Topic.DoesNotExist:
+            self.remove(topic_name(pk))
+            return False
+        head = TopicDetailSerializer(topic, context={'request': self.request}).to_representation_without_articles(topic)
+        articles = topic.articles.only('title', 'text', 'status').order_by('pk')
+        self.write(topic_name(pk), iter_object(
+            head, 'articles', articles.iterator(chunk_size=ITERATOR_CHUNK_SIZE), TopicArticleSerializer().to_representation
+        ))
+        return True
+
+    def export_articles(self, pks=None):
+        """
+        Writes the snapshots of the published articles among `pks` (all of them if None) and removes
+        the ones of the others. Returns the ids of the written articles.
+        """
+        serializer = CompiledArticleSerializer(self.request)
+        queryset = Article.objects.filter(status='published').order_by('pk')
+        if pks is not None:
+            queryset = queryset.filter(pk__in=pks)
+        written = set()
+        for row in serializer.values(queryset).iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+            self.write(article_name(row['id']), [dumps(serializer.to_representation(row))])
+            written.add(row['id'])
+        for pk in set(pks or ()) - written:
+            self.remove(article_name(pk))
+        return written
+
+    def remove_stale(self, folder, keep):
+        try:
+            names = os.listdir(self.path(folder))
+        except FileNotFoundError:
+            return
+        for name in names:
+            stem = name[:-len('.json')]
+            if name.endswith('.json') and stem.isdigit() and int(stem) not in keep:
+                self.remove('{}/{}'.format(folder, name))
+
+    def export_all(self):
+        """
+        Exports every snapshot and removes the ones of deleted topics and unpublished articles.
+        Returns the number of exported topics and articles.
+        """
+        # Saves made from here on are exported by the next incremental run
+        take_pending(self.directory)
+        topics = set(Topic.objects.values_list('pk', flat=True))
+        for pk in topics:
+            self.export_topic(pk)
+        self.export_topic_list()
+        articles = self.export_articles()
+        self.remove_stale('topics', topics)
+        self.remove_stale('articles', articles)
+        return len(topics), len(articles)
+
+    def export_pending(self, batch_size=500):
+        """
+        Exports the snapshots touched by saves since the last run. Returns the number of exported files.
+        """
+        names = take_pending(self.directory)
+        try:
+            ids = {kind: set() for kind in PENDING_KINDS}
+            for name in names:
+                kind, _, pk = name.partition('-')
+                if kind in ids and pk.isdigit():
+                    ids[kind].add(int(pk))
+            for pk in sorted(ids['topic']):
+                self.export_topic(pk)
+            if 'topics' in names:
+                self.export_topic_list()
+            articles = sorted(ids['article'])
+            for chunk in chunks(articles, batch_size):
+                self.export_articles(chunk)
+        except Exception:
+            # Try again next time
+            add_pending(self.directory, names)
+            raise
+        return len(names)
+
+
+class SnapshotMiddleware(WhiteNoiseMiddleware):
+    """
+    Serves the snapshots in API_SNAPSHOT_DIR at API_SNAPSHOT_URL, in the compressed variant the client
+    accepts. Files are looked up on every request, as `export_snapshots` keeps replacing them.
+    """
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if get_snapshot_dir():
+            self.add_files(get_snapshot_dir(), prefix=get_snapshot_url())
+
+    def configure_from_settings(self, settings):
+        super().configure_from_settings(settings)
+        # Only the snapshots, the static files are left to STATIC_URL
+        self.autorefresh = True
+        self.use_finders = False
+        self.static_root = None
+        self.root = None
+        self.index_file = None
+
+    def find_file(self, url):
+        # Neither the pending markers nor files being written
+        if not url.endswith('.json'):
+            return None
+        return super().find_file(url)
@@ -0,0 +1,68 @@
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+# Bytes gathered before handing a chunk to the server
+CHUNK_SIZE = 64 * 1024
+# Rows fetched from the database at a time
+ITERATOR_CHUNK_SIZE = 2000
+
+
+def wants_stream(request):
+    """
+    Streaming is opt-in with ?stream=true, and only for compact JSON: the browsable API
+    and indented output render whole documents
+    """
+    return (request.query_params.get('stream', '').lower() in ('1', 'true', 'yes')
+            and request.accepted_renderer.format == 'json'
+            and 'indent' not in (request.accepted_media_type or ''))
+
+
+def dumps(data):
+    """
+    Same output as JSONRenderer.render(), for a part of the document
+    """
+    renderer = JSONRenderer
+    ret = json.dumps(
+        data, cls=renderer.encoder_class, ensure_ascii=renderer.ensure_ascii,
+        allow_nan=not renderer.strict, separators=(',', ':') if renderer.compact else (', ', ': ')
+    )
+    return ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+
+def iter_list(items, to_representation):
+    yield '['
+    for index, item in enumerate(items):
+        if index:
+            yield ','
+        yield dumps(to_representation(item))
+    yield ']'
+
+
+def iter_object(head, list_key, items, to_representation):
+    """
+    Renders `head` with the streamed list added as its last key
+    """
+    rendered_head = dumps(head)
+    yield rendered_head[:-1]
+    yield '{}{}:'.format(',' if head else '', dumps(list_key))
+    yield from iter_list(items, to_representation)
+    yield '}'
+
+
+def buffered(parts):
+    buffer, size = [], 0
+    for part in parts:
+        encoded = part.encode('utf-8')
+        buffer.append(encoded)
+        size += len(encoded)
+        if size >= CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def streaming_response(parts):
+    return StreamingHttpResponse(buffered(parts), content_type='application/json')
@@ -0,0 +1,98 @@
+import os
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext
+from rest_framework import test
+
+from .authentication import user_cache
+from .autocomplete import article_titles, topic_titles
+from .cache import get_cache
+from .coalescing import flights
+from .throttling import store as throttle_store
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin for asserting that a block of code stays within a query budget
+    """
+    @contextmanager
+    def assertQueryBudget(self, budget, using='default'):
+        with CaptureQueriesContext(connections[using]) as context:
+            yield context
+        executed = len(context.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(
+                '{}. {}'.format(number, query['sql'])
+                for number, query in enumerate(context.captured_queries, start=1)
+            )
+            self.fail("{} queries executed, the budget is {}:\n{}".format(executed, budget, queries))
+
+
+class QueryPlanMixin:
+    """
+    TestCase mixin for asserting that the SELECTs of a block of code don't scan whole tables,
+    according to SQLite's EXPLAIN QUERY PLAN. Scans of an index (e.g. ORDER BY ... LIMIT) are fine.
+    """
+    # "SCAN TABLE backend_article" before SQLite 3.36, "SCAN backend_article" since (or the alias
+    # of the table); index scans go on with "USING [COVERING] INDEX ..."
+    TABLE_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+
+    @contextmanager
+    def assertNoTableScans(self, allowed=(), using='default'):
+        """
+        Fails if a query scans a table other than the `allowed` ones
+        """
+        connection = connections[using]
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        scans = []
+        with connection.cursor() as cursor:
+            for query in context.captured_queries:
+                # Lookups of SQLite's own statistics tables, e.g. by estimated_count(), aren't table scans
+                if not query['sql'].startswith('SELECT') or 'sqlite_stat' in query['sql']:
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                for row in cursor.fetchall():
+                    match = self.TABLE_SCAN_RE.match(row[-1])
+                    if match and match.group(1) not in allowed:
+                        scans.append('{}\n    {}'.format(query['sql'], row[-1]))
+        if scans:
+            self.fail("Queries scanning whole tables:\n{}".format('\n'.join(scans)))
+
+
+class APITestCase(test.APITestCase):
+    """
+    APITestCase that starts every test with empty response and user caches, throttle buckets,
+    autocomplete indexes and in-flight responses, since rolling back the database between tests
+    doesn't roll back those
+    """
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        user_cache.clear()
+        throttle_store.clear()
+        article_titles.clear()
+        topic_titles.clear()
+        flights.clear()
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Gives the test run throttle buckets and single-flight locks of its own, instead of the ones of
+    the development server
+    """
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.temp_dir = tempfile.mkdtemp(prefix='bloggyblog-test-')
+        settings.API_THROTTLE_DB = os.path.join(self.temp_dir, 'throttle.sqlite3')
+        settings.API_SINGLE_FLIGHT_LOCK_DIR = os.path.join(self.temp_dir, 'locks')
+
+    def teardown_test_environment(self, **kwargs):
+        super().teardown_test_environment(**kwargs)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
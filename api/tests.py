@@ -1,10 +1,43 @@
+import gzip
+import json
+import re
+import os
+import tempfile
+import threading
+import time
+from base64 import urlsafe_b64encode
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
 from freezegun import freeze_time
 
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
 from rest_framework.reverse import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
 
-from backend.models import User, Article, Topic
+from backend.models import User, Article, ArticleTombstone, RelatedArticle, Topic, SearchTerm
+from backend.related import update_related
+from . import bench, coalescing, metrics, throttling
+from .authentication import LazyUser, user_cache
+from .autocomplete import PrefixIndex, topic_titles
+from .cache import get_cache
+from .fieldsets import make_excerpt
+from .replicas import ReplicaMiddleware, ReplicaRouter, check_shared_cache, state
+from .serializers import ArticleSerializer, CompiledArticleSerializer
+from .testing import APITestCase, QueryBudgetMixin, QueryPlanMixin
+from .views import TopicDetail
 
 
 class TestApiUser(APITestCase):
@@ -190,6 +223,8 @@ class TestApiArticle(APITestCase):
             Article(title="Article title 2", text="Article text 2", user=cls.user, topic=cls.topic1),
             Article(title="Article title 3", text="Donald is programming", user=cls.user, topic=cls.topic2),
         ])
+        # bulk_create() doesn't send post_save, so the search index has to be built by hand
+        call_command('rebuild_search_index', stdout=StringIO())
 
     @staticmethod
     def article_list_endpoint():
@@ -249,13 +284,13 @@ class TestApiArticle(APITestCase):
                 "created": "2020-01-03 19:36"
             }
         ]
-        topics = [dict(item) for item in response.data]
+        topics = [dict(item) for item in response.data['results']]
         self.assertListEqual(expected, topics)
 
     def test_search_for_articles(self):
         response = self.client.get(''.join([self.article_list_endpoint(), "?search=unknown"]))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, [])
+        self.assertEqual(response.data['results'], [])
 
         response = self.client.get(''.join([self.article_list_endpoint(), "?search=donald"]))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -269,7 +304,7 @@ class TestApiArticle(APITestCase):
                 "created": "2020-01-03 19:36"
             }
         ]
-        self.assertEqual(response.data, expected)
+        self.assertEqual(response.data['results'], expected)
 
     def test_post_new_article_with_unauthorized_user(self):
         data = {
@@ -396,6 +431,680 @@ class TestApiArticle(APITestCase):
         self.assertTrue(article2.is_published())
 
 
+class TestApiArticleSearch(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.topic = Topic.objects.create(title="Topic title 1")
+        cls.python = Article.objects.create(
+            title="Python tips", text="Short notes on python and django", user=cls.user, topic=cls.topic
+        )
+        cls.django = Article.objects.create(
+            title="Django tips", text="Django views, django models and python", user=cls.user, topic=cls.topic
+        )
+        cls.cooking = Article.objects.create(
+            title="Cooking", text="Nothing to see here", user=cls.user, topic=cls.topic
+        )
+
+    @staticmethod
+    def search_endpoint(term):
+        return ''.join([reverse('article-list'), '?search=', term])
+
+    def search_titles(self, term):
+        response = self.client.get(self.search_endpoint(term))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['title'] for item in response.data['results']]
+
+    def test_results_are_ranked_by_relevance(self):
+        self.assertEqual(self.search_titles('django'), ["Django tips", "Python tips"])
+        self.assertEqual(self.search_titles('python'), ["Python tips", "Django tips"])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.search_titles('python%20notes'), ["Python tips"])
+        self.assertEqual(self.search_titles('python%20cooking'), [])
+
+    def test_index_follows_article_changes(self):
+        self.cooking.text = "Cooking with python"
+        self.cooking.save()
+        self.assertIn("Cooking", self.search_titles('python'))
+
+        self.cooking.delete()
+        self.assertNotIn("Cooking", self.search_titles('python'))
+        self.assertEqual(self.search_titles('cooking'), [])
+
+    def test_rebuild_command(self):
+        SearchTerm.objects.all().delete()
+        self.assertEqual(self.search_titles('django'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search_titles('django'), ["Django tips", "Python tips"])
+
+
+class TestApiArticlePagination(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.topic = Topic.objects.create(title="Topic title 1")
+        for number in range(1, 8):
+            # Same creation time for all of them, so the id has to break the ties
+            with freeze_time("2020-03-01 19:36"):
+                Article.objects.create(
+                    title="Article title {}".format(number), text="Article text {}".format(number),
+                    user=cls.user, topic=cls.topic
+                )
+
+    def get_page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_walk_forward_and_back(self):
+        page = self.get_page(reverse('article-list') + '?page_size=3')
+        self.assertIsNone(page['previous'])
+        titles = [item['title'] for item in page['results']]
+        while page['next']:
+            page = self.get_page(page['next'])
+            titles.extend(item['title'] for item in page['results'])
+        self.assertEqual(titles, ["Article title {}".format(number) for number in range(1, 8)])
+        self.assertEqual([item['title'] for item in page['results']], ["Article title 7"])
+
+        page = self.get_page(page['previous'])
+        self.assertEqual([item['title'] for item in page['results']],
+                         ["Article title 4", "Article title 5", "Article title 6"])
+
+    def test_deep_pages_do_not_use_offset(self):
+        page = self.get_page(reverse('article-list') + '?page_size=3')
+        with CaptureQueriesContext(connection) as queries:
+            self.get_page(page['next'])
+        self.assertFalse(any('OFFSET' in query['sql'] for query in queries.captured_queries))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('article-list') + '?cursor=garbage')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_edited_cursors(self):
+        def get(position, search=None):
+            params = {'cursor': urlsafe_b64encode(json.dumps({'p': position}).encode()).decode()}
+            if search is not None:
+                params['search'] = search
+            return self.client.get(reverse('article-list'), params)
+
+        for position in ([None, None], ["2020-01-01T00:00:00Z", "xx"], [{}, 1], ["xx", 1],
+                         ["2020-01-01T00:00:00Z", 2 ** 64], ["2020-01-01T00:00:00Z"]):
+            response = get(position)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, position)
+            self.assertEqual(response.data['detail'], "Invalid cursor")
+        self.assertEqual(get(["abc", 1], search='article').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(get([1.5, 1], search='article').status_code, status.HTTP_200_OK)
+        self.assertEqual(get(["2020-01-01T00:00:00Z", 1]).status_code, status.HTTP_200_OK)
+
+    def test_paginated_search_keeps_rank_order(self):
+        Article.objects.create(title="Ranked article", text="article article", user=self.user, topic=self.topic)
+        page = self.get_page(reverse('article-list') + '?search=article&page_size=5')
+        titles = [item['title'] for item in page['results']]
+        page = self.get_page(page['next'])
+        titles.extend(item['title'] for item in page['results'])
+        self.assertIsNone(page['next'])
+        self.assertEqual(len(titles), 8)
+        self.assertEqual(titles[0], "Ranked article")
+
+
+class TestApiQueryBudget(QueryBudgetMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.topics = [Topic.objects.create(title="Topic title {}".format(number)) for number in range(3)]
+
+    def add_articles(self, count):
+        offset = Article.objects.count()
+        Article.objects.bulk_create([
+            Article(title="Article title {}".format(offset + number), text="Article text",
+                    user=self.user, topic=self.topics[number % len(self.topics)])
+            for number in range(count)
+        ])
+
+    def assertEndpointBudget(self, url, budget):
+        for count in (1, 10, 50):
+            self.add_articles(count)
+            with self.assertQueryBudget(budget):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_topic_list(self):
+        self.assertEndpointBudget(reverse('topic-list'), 1)
+
+    def test_topic_detail(self):
+        self.assertEndpointBudget(reverse('topic-detail', kwargs={'pk': self.topics[0].pk}), 2)
+
+    def test_user_detail(self):
+        self.assertEndpointBudget(reverse('user-detail', kwargs={'pk': self.user.pk}), 2)
+
+    def test_article_list(self):
+        self.assertEndpointBudget(reverse('article-list'), 1)
+
+    def test_budget_is_enforced(self):
+        with self.assertRaises(AssertionError):
+            with self.assertQueryBudget(0):
+                Topic.objects.count()
+
+
+class TestApiResponseCache(QueryBudgetMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.topic = Topic.objects.create(title="Topic title 1")
+        cls.article = Article.objects.create(title="Article title 1", text="Article text 1", user=cls.user, topic=cls.topic)
+
+    def test_cached_responses_skip_the_database(self):
+        for url in (reverse('topic-list'), reverse('topic-detail', kwargs={'pk': self.topic.pk}),
+                    reverse('user-detail', kwargs={'pk': self.user.pk}), reverse('article-list'),
+                    reverse('article-detail', kwargs={'pk': self.article.pk})):
+            first = self.client.get(url)
+            with self.assertQueryBudget(0):
+                second = self.client.get(url)
+            self.assertEqual(second.status_code, status.HTTP_200_OK)
+            self.assertEqual(first.content, second.content)
+            self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_article_changes_invalidate(self):
+        url = reverse('topic-detail', kwargs={'pk': self.topic.pk})
+        self.assertEqual(self.client.get(url).json()['articles_count'], 1)
+        Article.objects.create(title="Article title 2", text="Article text 2", user=self.user, topic=self.topic)
+        self.assertEqual(self.client.get(url).json()['articles_count'], 2)
+
+        self.article.text = "Changed text"
+        self.article.save()
+        response = self.client.get(reverse('article-detail', kwargs={'pk': self.article.pk}))
+        self.assertEqual(response.json()['text'], "Changed text")
+
+    def test_topic_rename_invalidates_user_detail(self):
+        url = reverse('user-detail', kwargs={'pk': self.user.pk})
+        self.client.get(url)
+        self.topic.title = "Renamed topic"
+        self.topic.save()
+        self.assertEqual(self.client.get(url).json()['articles'][0]['topic'], "Renamed topic")
+
+    def test_unrelated_changes_keep_the_cache(self):
+        url = reverse('article-detail', kwargs={'pk': self.article.pk})
+        self.client.get(url)
+        Topic.objects.create(title="Topic title 2")
+        with self.assertQueryBudget(0):
+            self.client.get(url)
+
+    def test_not_modified(self):
+        url = reverse('topic-list')
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+        Topic.objects.create(title="Topic title 2")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_auth_context_is_part_of_the_key(self):
+        url = reverse('article-list')
+        self.client.get(url)
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertGreater(len(queries.captured_queries), 0)
+
+    def test_writes_invalidate_again_on_commit(self):
+        url = reverse('topic-list')
+        with mock.patch('django.db.transaction.on_commit') as on_commit:
+            with transaction.atomic():
+                Topic.objects.create(title="Topic title 2")
+                # A concurrent request caching the uncommitted state
+                self.client.get(url)
+        for callback in on_commit.call_args_list:
+            callback[0][0]()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.client.get(url).json()), 2)
+        self.assertGreater(len(queries.captured_queries), 0)
+
+    def test_host_is_part_of_the_key(self):
+        url = reverse('topic-list')
+        self.client.get(url, HTTP_HOST='evil.example')
+        response = self.client.get(url)
+        self.assertEqual(response.json()[0]['url'], 'http://testserver' + reverse('topic-detail', kwargs={'pk': self.topic.pk}))
+        response = self.client.get(url, secure=True)
+        self.assertTrue(response.json()[0]['url'].startswith('https://testserver/'))
+
+    def test_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_cache = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}
+            with self.settings(CACHES={'default': file_cache, 'api': file_cache}):
+                url = reverse('topic-list')
+                self.client.get(url)
+                with self.assertQueryBudget(0):
+                    self.client.get(url)
+                Topic.objects.create(title="Topic title 2")
+                self.assertEqual(len(self.client.get(url).json()), 2)
+
+
+class TestApiMetrics(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.admin = User.objects.create_superuser(username='admin', email='admin@gom.com', password='admins')
+        cls.topic = Topic.objects.create(title="Topic title 1")
+
+    def setUp(self):
+        super().setUp()
+        self.metrics_dir = tempfile.TemporaryDirectory()
+        settings_override = self.settings(METRICS_DIR=self.metrics_dir.name, METRICS_FLUSH_INTERVAL=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(self.metrics_dir.cleanup)
+        metrics.registry.reset()
+
+    def get_metrics(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse('metrics'))
+        self.client.force_authenticate(None)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.content.decode()
+
+    def test_staff_only(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_requests_are_recorded_by_url_name(self):
+        self.client.get(reverse('topic-list'))
+        self.client.get(reverse('topic-list'))
+        self.client.get(reverse('topic-detail', kwargs={'pk': self.topic.pk}))
+
+        output = self.get_metrics()
+        self.assertIn('bloggyblog_request_duration_seconds_count{view="topic-list"} 2', output)
+        self.assertIn('bloggyblog_request_duration_seconds_bucket{view="topic-detail",le="+Inf"} 1', output)
+        self.assertIn('bloggyblog_sql_queries_total{view="topic-list"} 1', output)
+        self.assertIn('bloggyblog_response_bytes_total{view="topic-detail"}', output)
+
+    def test_streamed_responses_are_recorded_once_sent(self):
+        for number in range(3):
+            Article.objects.create(title="Article title {}".format(number), text="Article text", user=self.user,
+                                   topic=self.topic, status='published')
+        response = self.client.get(reverse('topic-detail', kwargs={'pk': self.topic.pk}), {'stream': 'true'})
+        self.assertTrue(response.streaming)
+        with CaptureQueriesContext(connection) as streamed:
+            size = len(b''.join(response.streaming_content))
+        self.assertGreaterEqual(len(streamed), 1)
+
+        output = self.get_metrics()
+        self.assertIn('bloggyblog_request_duration_seconds_count{view="topic-detail"} 1', output)
+        self.assertIn('bloggyblog_response_bytes_total{{view="topic-detail"}} {}'.format(size), output)
+        # The queries run while streaming count too, on top of the ones of the view
+        queries = int(re.search(r'bloggyblog_sql_queries_total\{view="topic-detail"\} (\d+)', output).group(1))
+        self.assertGreater(queries, len(streamed))
+
+    def test_metrics_of_other_workers_are_added_up(self):
+        self.client.get(reverse('topic-list'))
+        metrics.registry.flush()
+        with open(metrics.registry.path(), encoding='utf-8') as metrics_file:
+            own = metrics_file.read()
+        # Pretend another worker process served the same request
+        with open(metrics.registry.path(pid=999999), 'w', encoding='utf-8') as metrics_file:
+            metrics_file.write(own)
+
+        self.assertIn('bloggyblog_request_duration_seconds_count{view="topic-list"} 2', self.get_metrics())
+
+
+class TestApiBenchmark(APITestCase):
+    def test_generate_data_and_benchmark(self):
+        call_command('generate_data', users=3, topics=2, articles=25, batch_size=10, seed=1, stdout=StringIO())
+        self.assertEqual(Article.objects.count(), 25)
+        self.assertEqual(sum(topic.articles_count for topic in Topic.objects.all()), 25)
+        self.assertTrue(User.objects.filter(is_staff=True).exists())
+
+        with tempfile.TemporaryDirectory() as directory:
+            first, second = os.path.join(directory, 'first.json'), os.path.join(directory, 'second.json')
+            call_command('benchmark_api', requests=3, output=first, stdout=StringIO())
+            out = StringIO()
+            call_command('benchmark_api', requests=3, output=second, compare=first, stdout=out)
+
+            results = bench.load_results(second)['results']
+            endpoints = {'user-detail', 'topic-list', 'topic-detail', 'article-list', 'article-detail',
+                         'article-publish', 'article-create', 'token_obtain_pair', 'token_refresh', 'metrics'}
+            self.assertTrue(endpoints <= set(results))
+            for name in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'queries_mean'):
+                self.assertIn(name, results['topic-list'])
+            self.assertEqual(results['token_obtain_pair']['statuses'], {'200': 3})
+            self.assertEqual(results['article-create']['statuses'], {'201': 3})
+            # Every read renders, instead of coming from the response cache
+            self.assertGreaterEqual(results['topic-list']['queries_mean'], 1)
+            self.assertFalse(bench.load_results(second)['meta']['cache'])
+            self.assertIn('Comparing p95_ms', out.getvalue())
+
+            # More attempts than the token throttle allows
+            call_command('benchmark_api', requests=11, endpoints=['token_obtain_pair'], output=first, stdout=StringIO())
+            self.assertEqual(bench.load_results(first)['results']['token_obtain_pair']['statuses'], {'200': 11})
+
+
+class TestApiArticleBulkCreate(QueryBudgetMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.topic1 = Topic.objects.create(title="Topic title 1")
+        cls.topic2 = Topic.objects.create(title="Topic title 2")
+        Article.objects.create(title="Existing title", text="Existing text", user=cls.user, topic=cls.topic1)
+
+    @staticmethod
+    def bulk_endpoint():
+        return reverse('article-bulk')
+
+    def items(self, count, prefix="Bulk title"):
+        return [
+            {
+                "title": "{} {}".format(prefix, number),
+                "text": "Bulk text {}".format(number),
+                "topic": "http://testserver/api/topics/{}/".format(self.topic1.pk if number % 2 else self.topic2.pk),
+            }
+            for number in range(count)
+        ]
+
+    def test_unauthorized_user(self):
+        response = self.client.post(self.bulk_endpoint(), self.items(2), format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_bulk_create(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(self.bulk_endpoint(), self.items(3), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([item['title'] for item in response.data], ["Bulk title 0", "Bulk title 1", "Bulk title 2"])
+        self.assertEqual(response.data[0]['user'], "http://testserver/api/users/{}/".format(self.user.pk))
+
+        self.assertEqual(Article.objects.filter(title__startswith="Bulk title", user=self.user).count(), 3)
+        self.topic2.refresh_from_db()
+        self.assertEqual(self.topic2.articles_count, 2)
+        search = self.client.get(reverse('article-list') + '?search=bulk%20text%202')
+        self.assertEqual([item['title'] for item in search.data['results']], ["Bulk title 2"])
+
+    def test_primary_keys_of_duplicate_titles(self):
+        # Titles are only unique as far as validation goes: a concurrent request may create the same one
+        self.client.force_authenticate(self.user)
+        items = self.items(2)
+        items[1]['title'] = "Existing title"
+        with mock.patch('api.serializers.ArticleBulkSerializer.validate_title', side_effect=lambda title: title):
+            response = self.client.post(self.bulk_endpoint(), items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        existing, created = Article.objects.filter(title="Existing title").order_by('pk')
+        self.assertEqual(set(existing.search_terms.values_list('term', flat=True)), {'existing', 'title', 'text'})
+        self.assertIn('bulk', set(created.search_terms.values_list('term', flat=True)))
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        self.client.force_authenticate(self.user)
+        for count, prefix in ((5, "Small batch"), (200, "Large batch")):
+            with self.assertQueryBudget(20):
+                response = self.client.post(self.bulk_endpoint(), self.items(count, prefix), format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_per_item_errors(self):
+        self.client.force_authenticate(self.user)
+        items = self.items(5)
+        items[1]['title'] = "Existing title"
+        items[2]['title'] = items[0]['title']
+        items[3]['topic'] = "http://testserver/api/topics/9999/"
+        items[4]['topic'] = "http://testserver/api/topics/{}/".format(2 ** 63)
+        response = self.client.post(self.bulk_endpoint(), items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertEqual(response.data[1]['title'], ["Article with given title already exists!"])
+        self.assertEqual(response.data[2]['title'], ["Article with given title already exists!"])
+        self.assertEqual(response.data[3]['topic'], ["Invalid hyperlink - Object does not exist."])
+        self.assertEqual(response.data[4]['topic'], ["Invalid hyperlink - Object does not exist."])
+        self.assertFalse(Article.objects.filter(title__startswith="Bulk title").exists())
+
+    def test_limits(self):
+        self.client.force_authenticate(self.user)
+        with self.settings(ARTICLE_BULK_CREATE_LIMIT=2):
+            response = self.client.post(self.bulk_endpoint(), self.items(3), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.bulk_endpoint(), self.items(1)[0], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@freeze_time("2020-03-01 19:36")
+class TestApiStreaming(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.topic = Topic.objects.create(title="Topic title 1")
+        cls.empty_topic = Topic.objects.create(title="Empty topic")
+        Article.objects.bulk_create([
+            Article(title="Article title {}".format(number), text="Text with unicode \u00eb \u2028 \"quotes\" {}".format(number),
+                    user=cls.user, topic=cls.topic, status='published' if number % 3 else 'draft')
+            for number in range(30)
+        ])
+        call_command('rebuild_search_index', stdout=StringIO())
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def streamed(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_article_list(self):
+        request = APIRequestFactory().get('/')
+        expected = JSONRenderer().render(ArticleSerializer(
+            Article.objects.order_by('created', 'id'), many=True, context={'request': Request(request)}
+        ).data)
+        self.assertEqual(self.streamed(reverse('article-list') + '?stream=true'), expected)
+
+    def test_article_search(self):
+        streamed = json.loads(self.streamed(reverse('article-list') + '?stream=true&search=title%207'))
+        self.assertEqual([item['title'] for item in streamed], ["Article title 7"])
+
+    def test_topic_detail(self):
+        for topic in (self.topic, self.empty_topic):
+            url = reverse('topic-detail', kwargs={'pk': topic.pk})
+            self.assertEqual(self.streamed(url + '?stream=1'), self.client.get(url).content)
+
+    def test_streaming_is_opt_in(self):
+        response = self.client.get(reverse('topic-detail', kwargs={'pk': self.topic.pk}))
+        self.assertFalse(response.streaming)
+        response = self.client.get(reverse('article-list') + '?stream=true', HTTP_ACCEPT='application/json; indent=4')
+        self.assertFalse(response.streaming)
+
+    @override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={
+        'streams_user': '2/hour', 'streams_ip': '10/hour',
+    }))
+    def test_article_list_needs_a_user(self):
+        url = reverse('article-list') + '?stream=true'
+        self.streamed(url)
+        self.streamed(url)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '1800')
+        # Pages aren't throttled
+        self.assertEqual(self.client.get(reverse('article-list')).status_code, status.HTTP_200_OK)
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.client.get(reverse('article-list')).status_code, status.HTTP_200_OK)
+
+
+class TestApiCompiledArticleSerializer(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.topics = [Topic.objects.create(title="Topic title {}".format(number)) for number in range(2)]
+        for number, moment in enumerate(["2020-01-02 03:04:05", "2020-12-31 23:59:59", "2021-06-09 00:00:00"]):
+            with freeze_time(moment):
+                Article.objects.create(title="Article title {}".format(number), text="Sp\u00ebcial {text}",
+                                       user=cls.user, topic=cls.topics[number % 2], status='published')
+
+    def test_same_output_as_article_serializer(self):
+        for path in ('/api/articles/', '/api/articles/?search=title'):
+            request = Request(APIRequestFactory().get(path, HTTP_HOST='example.com:8080'))
+            queryset = Article.objects.order_by('created', 'id')
+            expected = ArticleSerializer(queryset, many=True, context={'request': request}).data
+            compiled = CompiledArticleSerializer(request)
+            self.assertEqual(compiled.serialize(compiled.values(queryset)), expected)
+            self.assertEqual(expected[0]['topic'], "http://example.com:8080/api/topics/{}/".format(self.topics[0].pk))
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_serializers', rows=3, repeat=2, stdout=out)
+        self.assertIn('Speed-up', out.getvalue())
+
+
+class TestApiSparseFieldsets(APITestCase):
+    TEXT_COLUMN = re.compile(r'(?<!SUBSTR\()"backend_article"\."text"')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.topic = Topic.objects.create(title='Topic title 1')
+        cls.article = Article.objects.create(title="Article title 1", text="word " * 100, user=cls.user, topic=cls.topic)
+
+    def get(self, path, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path, params)
+        reads_text = any(self.TEXT_COLUMN.search(query['sql']) for query in context.captured_queries)
+        return response, reads_text
+
+    @override_settings(ARTICLE_EXCERPT_LENGTH=12)
+    def test_make_excerpt(self):
+        self.assertEqual(make_excerpt("Short text"), "Short text")
+        self.assertEqual(make_excerpt("Twelve chars"), "Twelve chars")
+        self.assertEqual(make_excerpt("Some longer text"), "Some longer…")
+        self.assertEqual(make_excerpt("Some long text"), "Some long…")
+        self.assertEqual(make_excerpt("Averyveryverylongword"), "Averyveryver…")
+
+    def test_article_list(self):
+        response, reads_text = self.get(reverse('article-list'), fields='title,created')
+        self.assertEqual(list(response.data['results'][0]), ['title', 'created'])
+        self.assertFalse(reads_text)
+
+        response, reads_text = self.get(reverse('article-list'), omit='text,user')
+        self.assertEqual(list(response.data['results'][0]), ['title', 'topic', 'status', 'created'])
+        self.assertFalse(reads_text)
+
+        self.client.force_authenticate(self.user)
+        response, reads_text = self.get(reverse('article-list'), fields='title,excerpt', stream='true')
+        self.assertEqual(json.loads(b''.join(response.streaming_content).decode()),
+                         [{'title': "Article title 1", 'excerpt': make_excerpt(self.article.text)}])
+        self.assertFalse(reads_text)
+
+        response, reads_text = self.get(reverse('article-list'))
+        self.assertIn('text', response.data['results'][0])
+        self.assertTrue(reads_text)
+
+    def test_article_detail(self):
+        response, reads_text = self.get(reverse('article-detail', kwargs={'pk': self.article.pk}), fields='title,excerpt')
+        self.assertEqual(response.data, {'title': "Article title 1", 'excerpt': ("word " * 40).strip() + '…'})
+        self.assertFalse(reads_text)
+
+        response, reads_text = self.get('/api/articles/{}.json'.format(self.article.pk), fields='title,excerpt')
+        self.assertEqual(response.data, {'title': "Article title 1", 'excerpt': ("word " * 40).strip() + '…'})
+        self.assertFalse(reads_text)
+
+    def test_topic_detail(self):
+        path = reverse('topic-detail', kwargs={'pk': self.topic.pk})
+        response, reads_text = self.get(path, fields='title,excerpt')
+        self.assertEqual(response.data['title'], 'Topic title 1')
+        self.assertEqual(list(response.data['articles'][0]), ['title', 'excerpt'])
+        self.assertFalse(reads_text)
+
+        response, reads_text = self.get(path, omit='text', stream='true')
+        self.assertEqual(json.loads(b''.join(response.streaming_content).decode())['articles'],
+                         [{'title': "Article title 1", 'status': 'draft'}])
+        self.assertFalse(reads_text)
+
+    def test_user_detail(self):
+        response, reads_text = self.get(reverse('user-detail', kwargs={'pk': self.user.pk}), omit='text')
+        self.assertEqual(response.data['articles'], [{'title': "Article title 1", 'topic': 'Topic title 1'}])
+        self.assertFalse(reads_text)
+
+    def test_unknown_fields(self):
+        response = self.client.get(reverse('article-list'), {'fields': 'title,body', 'omit': 'text'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'fields': [
+            "Unknown field(s): body. Choose from: title, text, topic, status, user, created, excerpt."
+        ]})
+
+
+class TestApiBulkPublish(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.staff = User.objects.create_user(username='staff', email='staff@gom.com', password='password', is_staff=True)
+        cls.topic = Topic.objects.create(title='Topic title 1')
+        cls.drafts = [
+            Article.objects.create(title="Article title {}".format(number), text="Article text", user=cls.user, topic=cls.topic)
+            for number in range(3)
+        ]
+        cls.published = Article.objects.create(title="Article title 3", text="Article text", user=cls.user,
+                                               topic=cls.topic, status='published')
+
+    def post(self, data):
+        return self.client.post(reverse('article-bulk-publish'), data, format='json')
+
+    def test_permissions(self):
+        self.assertEqual(self.post({'ids': [self.drafts[0].pk]}).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.post({'ids': [self.drafts[0].pk]}).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(Article.objects.filter(status='published', pk=self.drafts[0].pk).exists())
+
+    def test_publish(self):
+        self.client.force_authenticate(self.staff)
+        detail = reverse('article-detail', kwargs={'pk': self.drafts[0].pk})
+        self.assertEqual(self.client.get(detail).data['status'], 'draft')
+
+        ids = [self.drafts[0].pk, self.drafts[1].pk, self.published.pk, 999999]
+        response = self.post({'ids': ids})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'detail': "2 articles published.",
+            'published': [self.drafts[0].pk, self.drafts[1].pk],
+            'skipped': [self.published.pk, 999999],
+        })
+        self.assertEqual(self.client.get(detail).data['status'], 'published')
+        self.assertEqual(self.client.get(reverse('topic-list')).data[0]['articles_count'], 4)
+        self.topic.refresh_from_db()
+        self.assertEqual((self.topic.draft_articles_count, self.topic.published_articles_count), (1, 3))
+
+    def test_schedule(self):
+        self.client.force_authenticate(self.staff)
+        with freeze_time("2020-01-01 12:00:00"):
+            response = self.post({'ids': [self.drafts[0].pk, self.published.pk], 'publish_at': '2020-01-02T09:00:00Z'})
+        self.assertEqual(response.data, {
+            'detail': "1 articles scheduled for publishing.",
+            'scheduled': [self.drafts[0].pk],
+            'skipped': [self.published.pk],
+        })
+        article = Article.objects.get(pk=self.drafts[0].pk)
+        self.assertEqual((article.status, article.publish_at.isoformat()), ('draft', '2020-01-02T09:00:00+00:00'))
+
+        with freeze_time("2020-01-02 09:00:00"):
+            call_command('publish_scheduled_articles', stdout=StringIO())
+        self.assertTrue(Article.objects.get(pk=self.drafts[0].pk).is_published())
+        self.assertEqual(self.client.get(reverse('article-detail', kwargs={'pk': self.drafts[0].pk})).data['status'],
+                         'published')
+
+    def test_past_publish_at_publishes_now(self):
+        self.client.force_authenticate(self.staff)
+        response = self.post({'ids': [self.drafts[2].pk], 'publish_at': '2000-01-01T00:00:00Z'})
+        self.assertEqual(response.data['published'], [self.drafts[2].pk])
+
+    @override_settings(ARTICLE_BULK_PUBLISH_LIMIT=2)
+    def test_invalid_data(self):
+        self.client.force_authenticate(self.staff)
+        self.assertEqual(self.post({'ids': []}).data, {'ids': ["This list may not be empty."]})
+        self.assertEqual(self.post({'ids': [1, 2, 3]}).data, {'ids': ["At most 2 articles can be published at once."]})
+        response = self.post({'ids': [1, 2 ** 63]})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ids', response.data)
+
+
 class TestApiAuth(APITestCase):
     @classmethod
     def setUpTestData(cls):
@@ -471,3 +1180,840 @@ class TestApiAuth(APITestCase):
         self.assertEqual(refresh_response.status_code, status.HTTP_401_UNAUTHORIZED)
         self.assertTrue("Token is invalid or expired" in refresh_response.data['detail'])
         self.assertTrue("token_not_valid" in refresh_response.data['code'])
+
+
+class TestApiStatelessAuth(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.staff = User.objects.create_user(username='staff', email='staff@gom.com', password='password', is_staff=True)
+        cls.topic = Topic.objects.create(title='Topic title 1')
+        cls.article = Article.objects.create(title="Article title 1", text="Article text 1", user=cls.user, topic=cls.topic)
+
+    def obtain_token(self, user):
+        response = self.client.post(reverse('token_obtain_pair'), data={'username': user.username, 'password': 'password'})
+        return response.data['access']
+
+    def publish(self, token):
+        return self.client.get(reverse('article-publish', kwargs={'pk': self.article.pk}),
+                               HTTP_AUTHORIZATION='Bearer {}'.format(token))
+
+    def test_token_claims(self):
+        token = AccessToken(self.obtain_token(self.staff))
+        self.assertEqual(token['user_id'], self.staff.pk)
+        self.assertTrue(token['is_staff'])
+        self.assertTrue(token['is_active'])
+        self.assertIn('claims_iat', token)
+
+    def test_no_user_query(self):
+        token = self.obtain_token(self.staff)
+        with CaptureQueriesContext(connection) as context:
+            response = self.publish(token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user_selects = [query['sql'] for query in context.captured_queries
+                        if query['sql'].startswith('SELECT') and 'FROM "backend_user"' in query['sql']]
+        self.assertEqual(user_selects, [])
+
+    def test_claims_trusted_within_window(self):
+        token = self.obtain_token(self.staff)
+        User.objects.filter(pk=self.staff.pk).update(is_staff=False)
+        self.assertEqual(self.publish(token).status_code, status.HTTP_200_OK)
+
+    @override_settings(API_AUTH_REVOCATION_WINDOW=-1)
+    def test_claims_checked_after_window(self):
+        token = self.obtain_token(self.staff)
+        User.objects.filter(pk=self.staff.pk).update(is_active=False)
+        response = self.publish(token)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.data['code'], 'user_inactive')
+
+    def test_lazy_user(self):
+        user = LazyUser(self.user.pk, False, True)
+        with self.assertNumQueries(0):
+            self.assertTrue(user and user.is_authenticated)
+            self.assertEqual((user.pk, user.id, user.is_staff), (self.user.pk, self.user.pk, False))
+        with self.assertNumQueries(1):
+            self.assertEqual(user.username, 'username')
+        with self.assertNumQueries(0):
+            self.assertEqual(LazyUser(self.user.pk, False, True).email, 'email@gom.com')
+
+    def test_user_cache_expiry_and_size(self):
+        with mock.patch('api.authentication.time') as clock, override_settings(API_AUTH_USER_CACHE_SIZE=1):
+            clock.monotonic.return_value = 1000
+            with self.assertNumQueries(1):
+                user_cache.get(self.user.pk)
+                user_cache.get(self.user.pk)
+            clock.monotonic.return_value = 1000 + 301
+            with self.assertNumQueries(1):
+                user_cache.get(self.user.pk)
+            with self.assertNumQueries(2):
+                self.assertIsNone(user_cache.get(0))
+                user_cache.get(self.user.pk)
+        self.assertEqual(len(user_cache.entries), 1)
+
+    def test_user_save_clears_cache_entry(self):
+        user_cache.get(self.user.pk)
+        self.user.first_name = 'Changed'
+        self.user.save()
+        self.assertEqual(user_cache.get(self.user.pk).first_name, 'Changed')
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class TestApiReplicaRouting(TransactionTestCase):
+    """
+    Reads inside a transaction go to the primary, so these tests can't run in one
+    """
+    def setUp(self):
+        get_cache().clear()
+        self.router = ReplicaRouter()
+        self.addCleanup(state.reset)
+
+    def handle(self, method, write=False, **headers):
+        """
+        Runs a request through ReplicaMiddleware, returning the response and the database it read from
+        """
+        used = {}
+
+        def get_response(request):
+            if write:
+                Topic.objects.create(title="Topic title 1")
+            used['read'] = self.router.db_for_read(Article)
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), method)('/api/articles/', **headers)
+        response = ReplicaMiddleware(get_response)(request)
+        return response, used['read']
+
+    def test_router(self):
+        self.assertEqual(self.router.db_for_read(Article), 'default')
+        state.reset(use_replica=True)
+        self.assertIn(self.router.db_for_read(Article), ['replica1', 'replica2'])
+        with transaction.atomic():
+            self.assertEqual(self.router.db_for_read(Article), 'default')
+        self.assertEqual(self.router.db_for_write(Article), 'default')
+        state.wrote = True
+        self.assertEqual(self.router.db_for_read(Article), 'default')
+
+    def test_safe_requests_read_from_replicas(self):
+        self.assertIn(self.handle('get')[1], ['replica1', 'replica2'])
+        self.assertEqual(self.handle('post')[1], 'default')
+        self.assertEqual(state.use_replica, False)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        response, used = self.handle('get', write=True)
+        self.assertEqual(used, 'default')
+        self.assertNotIn('use_primary', response.cookies)
+
+    def test_sticky_after_write(self):
+        response, used = self.handle('post', write=True, HTTP_AUTHORIZATION='Bearer one')
+        self.assertEqual(response.cookies['use_primary']['max-age'], 5)
+        self.assertEqual(self.handle('get', HTTP_COOKIE='use_primary=1')[1], 'default')
+        self.assertEqual(self.handle('get', HTTP_AUTHORIZATION='Bearer one')[1], 'default')
+        self.assertIn(self.handle('get', HTTP_AUTHORIZATION='Bearer two')[1], ['replica1', 'replica2'])
+
+    def test_sticky_after_write_in_safe_request(self):
+        response, used = self.handle('get', write=True)
+        self.assertEqual(used, 'default')
+        self.assertIn('use_primary', response.cookies)
+
+    def test_only_writes_make_requests_sticky(self):
+        def get_response(request):
+            # Routed for a write (e.g. a form's unique check), but only reads
+            self.router.db_for_write(Article)
+            with transaction.atomic():
+                Article.objects.exists()
+            used['read'] = self.router.db_for_read(Article)
+            return HttpResponse()
+
+        used = {}
+        response = ReplicaMiddleware(get_response)(RequestFactory().get('/api/articles/'))
+        self.assertIn(used['read'], ['replica1', 'replica2'])
+        self.assertNotIn('use_primary', response.cookies)
+
+    def test_replicas_need_a_shared_cache(self):
+        self.assertEqual([error.id for error in check_shared_cache(None)], ['api.E001'])
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(check_shared_cache(None), [])
+        with tempfile.TemporaryDirectory() as directory, override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'api': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory},
+        }):
+            self.assertEqual(check_shared_cache(None), [])
+
+    @override_settings(DATABASE_REPLICAS=['default'])
+    def test_sticky_clients_skip_cached_responses(self):
+        topic = Topic.objects.create(title='Topic title 1')
+        self.client.get(reverse('topic-list'))
+        # Stands in for a cached response that was filled from a lagging replica
+        Topic.objects.filter(pk=topic.pk).update(title='Topic title 2')
+        self.assertEqual(self.client.get(reverse('topic-list')).json()[0]['title'], 'Topic title 1')
+        self.client.cookies['use_primary'] = '1'  # set by the middleware after a write
+        self.assertEqual(self.client.get(reverse('topic-list')).json()[0]['title'], 'Topic title 2')
+
+
+class TestApiSnapshots(TransactionTestCase):
+    """
+    Snapshots are queued for export when the transaction of a save commits
+    """
+    def setUp(self):
+        get_cache().clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings_override = self.settings(API_SNAPSHOT_DIR=self.directory.name, API_SNAPSHOT_BASE_URL='http://testserver')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        self.topic = Topic.objects.create(title='Topic title 1')
+        self.other_topic = Topic.objects.create(title='Topic title 2')
+        self.article = Article.objects.create(
+            title="Article title 1", text="Article text 1 " * 100, user=self.user, topic=self.topic, status='published'
+        )
+        self.draft = Article.objects.create(title="Article title 2", text="Article text 2", user=self.user, topic=self.topic)
+
+    def read(self, name, suffix=''):
+        with open(os.path.join(self.directory.name, *name.split('/')) + suffix, 'rb') as snapshot_file:
+            return snapshot_file.read()
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.directory.name, *name.split('/')))
+
+    def export(self, *args):
+        call_command('export_snapshots', *args, stdout=StringIO())
+
+    def test_snapshots_have_the_api_output(self):
+        self.export('--all')
+        pages = {
+            'topics.json': reverse('topic-list'),
+            'topics/{}.json'.format(self.topic.pk): reverse('topic-detail', kwargs={'pk': self.topic.pk}),
+            'topics/{}.json'.format(self.other_topic.pk): reverse('topic-detail', kwargs={'pk': self.other_topic.pk}),
+            'articles/{}.json'.format(self.article.pk): reverse('article-detail', kwargs={'pk': self.article.pk}),
+        }
+        for name, url in pages.items():
+            self.assertEqual(self.read(name), self.client.get(url, HTTP_ACCEPT='application/json').content)
+        # Drafts are left out
+        self.assertFalse(self.exists('articles/{}.json'.format(self.draft.pk)))
+
+        name = 'articles/{}.json'.format(self.article.pk)
+        self.assertEqual(gzip.decompress(self.read(name, '.gz')), self.read(name))
+
+    def test_served_by_whitenoise(self):
+        self.export('--all')
+        url = '/snapshots/articles/{}.json'.format(self.article.pk)
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.read(url[len('/snapshots/'):]))
+
+        self.assertEqual(self.client.get('/snapshots/articles/{}.json'.format(self.draft.pk)).status_code, 404)
+        self.assertEqual(self.client.get('/snapshots/.pending/topics').status_code, 404)
+
+    def test_saves_are_exported_incrementally(self):
+        self.export('--all')
+        other_topic = 'topics/{}.json'.format(self.other_topic.pk)
+        # Left alone, as nothing touches it
+        with open(os.path.join(self.directory.name, 'topics', '{}.json'.format(self.other_topic.pk)), 'wb') as snapshot_file:
+            snapshot_file.write(b'untouched')
+
+        self.article.title = "New title"
+        self.article.save()
+        self.draft.publish()
+        self.export()
+
+        article = json.loads(self.read('articles/{}.json'.format(self.article.pk)).decode())
+        self.assertEqual(article['title'], "New title")
+        self.assertTrue(self.exists('articles/{}.json'.format(self.draft.pk)))
+        topic = json.loads(self.read('topics/{}.json'.format(self.topic.pk)).decode())
+        self.assertEqual([item['status'] for item in topic['articles']], ['published', 'published'])
+        self.assertEqual(self.read(other_topic), b'untouched')
+
+        self.article.delete()
+        self.export()
+        self.assertFalse(self.exists('articles/{}.json'.format(self.article.pk)))
+        self.assertFalse(self.exists('articles/{}.json.gz'.format(self.article.pk)))
+        topics = json.loads(self.read('topics.json').decode())
+        self.assertEqual([topic['articles_count'] for topic in topics], [1, 0])
+
+    def test_rolled_back_saves_are_not_exported(self):
+        self.export()
+        with transaction.atomic():
+            Topic.objects.create(title='Topic title 3')
+            transaction.set_rollback(True)
+        self.assertEqual(os.listdir(os.path.join(self.directory.name, '.pending')), [])
+
+    @override_settings(API_SNAPSHOT_DIR=None)
+    def test_disabled(self):
+        with self.assertRaises(CommandError):
+            self.export()
+        self.assertEqual(self.client.get('/snapshots/topics.json').status_code, 404)
+
+
+class TestApiChangesFeed(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.topic = Topic.objects.create(title='Topic title 1')
+        cls.articles = []
+        for minute in range(3):
+            with freeze_time("2020-03-01 10:0{}".format(minute)):
+                cls.articles.append(Article.objects.create(
+                    title="Article title {}".format(minute), text="Article text", user=cls.user, topic=cls.topic
+                ))
+
+    def get_changes(self, url=None, **params):
+        response = self.client.get(url or reverse('article-changes'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    @freeze_time("2020-03-01 10:10")
+    def test_changes_since(self):
+        with self.assertNumQueries(2):
+            data = self.get_changes(modified_since='2020-03-01T10:01:00Z')
+        self.assertEqual([change['id'] for change in data['results']], [article.pk for article in self.articles[1:]])
+        self.assertEqual(data['results'][0]['modified'], '2020-03-01T10:01:00Z')
+        self.assertEqual(data['results'][0]['deleted'], False)
+        self.assertEqual(data['results'][0]['title'], "Article title 1")
+        self.assertFalse(data['has_more'])
+
+        data = self.get_changes(modified_since='2020-03-01T10:01:00Z', fields='title')
+        self.assertEqual(list(data['results'][0]), ['id', 'modified', 'deleted', 'title'])
+
+    def test_pages_and_polling(self):
+        seen, url = [], None
+        with freeze_time("2020-03-01 10:10"):
+            while True:
+                data = self.get_changes(url, page_size=2) if url is None else self.get_changes(url)
+                seen.extend(change['id'] for change in data['results'])
+                url = data['next']
+                if not data['has_more']:
+                    break
+            self.assertEqual(seen, [article.pk for article in self.articles])
+            # Nothing new yet
+            self.assertEqual(self.get_changes(url)['results'], [])
+
+            article = self.articles[0]
+            article.title = "New title"
+            article.save()
+        with freeze_time("2020-03-01 10:20"):
+            data = self.get_changes(url)
+        self.assertEqual([(change['id'], change['title']) for change in data['results']], [(article.pk, "New title")])
+
+    def test_deletes_leave_tombstones(self):
+        with freeze_time("2020-03-01 10:05"):
+            deleted = self.articles[1].pk
+            Article.objects.get(pk=deleted).delete()
+        with freeze_time("2020-03-01 10:10"):
+            data = self.get_changes(modified_since='2020-03-01T10:02:00Z')
+        self.assertEqual(data['results'], [
+            {'id': self.articles[2].pk, 'modified': '2020-03-01T10:02:00Z', 'deleted': False,
+             'title': "Article title 2", 'text': "Article text",
+             'topic': 'http://testserver' + reverse('topic-detail', kwargs={'pk': self.topic.pk}), 'status': 'draft',
+             'user': 'http://testserver' + reverse('user-detail', kwargs={'pk': self.user.pk}), 'created': '2020-01-03 10:02'},
+            {'id': deleted, 'modified': '2020-03-01T10:05:00Z', 'deleted': True},
+        ])
+
+        with freeze_time("2020-03-20"):
+            call_command('purge_article_tombstones', stdout=StringIO())
+        self.assertTrue(ArticleTombstone.objects.filter(pk=deleted).exists())
+        with freeze_time("2020-05-01"):
+            call_command('purge_article_tombstones', stdout=StringIO())
+        self.assertFalse(ArticleTombstone.objects.filter(pk=deleted).exists())
+
+    @freeze_time("2020-03-01 10:02:03")
+    def test_latest_changes_wait_for_the_next_poll(self):
+        data = self.get_changes(modified_since='2020-03-01T10:00:00Z')
+        self.assertEqual([change['id'] for change in data['results']], [article.pk for article in self.articles[:2]])
+
+    @freeze_time("2020-05-01")
+    def test_watermarks_older_than_the_tombstones(self):
+        response = self.client.get(reverse('article-changes'), {'modified_since': '2020-03-01T10:00:00Z'})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        # A full sync begins at the very beginning
+        self.assertEqual(len(self.get_changes()['results']), 3)
+
+    def test_invalid_watermark(self):
+        response = self.client.get(reverse('article-changes'), {'modified_since': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('modified_since', response.data)
+        response = self.client.get(reverse('article-changes'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        now = timezone.now()
+        for position in ([now.isoformat(), "xx"], [now.isoformat(), None], [now.replace(tzinfo=None).isoformat(), 1]):
+            cursor = urlsafe_b64encode(json.dumps({'p': position}).encode()).decode()
+            response = self.client.get(reverse('article-changes'), {'cursor': cursor})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, position)
+
+
+class TestApiQueryPlans(QueryPlanMixin, APITestCase):
+    """
+    Every query of the API views must be served by an index
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.staff = User.objects.create_user(username='staff', email='staff@gom.com', password='password', is_staff=True)
+        cls.topic = Topic.objects.create(title='Topic title 1')
+        cls.articles = [
+            Article.objects.create(title="Article title {}".format(number), text="Article text {}".format(number),
+                                   user=cls.user, topic=cls.topic, status='published' if number % 2 else 'draft')
+            for number in range(5)
+        ]
+
+    def test_user_detail(self):
+        with self.assertNoTableScans():
+            response = self.client.get(reverse('user-detail', kwargs={'pk': self.user.pk}), {'fields': 'title,excerpt'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_topics(self):
+        # The topic list returns every topic
+        with self.assertNoTableScans(allowed=['backend_topic']):
+            self.assertEqual(self.client.get(reverse('topic-list')).status_code, status.HTTP_200_OK)
+        self.client.force_authenticate(self.staff)
+        with self.assertNoTableScans():
+            response = self.client.post(reverse('topic-list'), {'title': 'Topic title 2'})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_topic_detail(self):
+        url = reverse('topic-detail', kwargs={'pk': self.topic.pk})
+        with self.assertNoTableScans():
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+            response = self.client.get(url, {'stream': 'true'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            b''.join(response.streaming_content)
+
+    def test_article_list(self):
+        url = reverse('article-list')
+        with self.assertNoTableScans():
+            response = self.client.get(url, {'page_size': 2})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get(response.data['next']).status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get(url, {'search': 'article text'}).status_code, status.HTTP_200_OK)
+            self.client.force_authenticate(self.user)
+            response = self.client.get(url, {'stream': 'true'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            b''.join(response.streaming_content)
+
+    def test_article_detail(self):
+        url = reverse('article-detail', kwargs={'pk': self.articles[0].pk})
+        with self.assertNoTableScans():
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+            self.client.force_authenticate(self.user)
+            self.assertEqual(self.client.patch(url, {'title': "New title"}).status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_create_articles(self):
+        topic = 'http://testserver' + reverse('topic-detail', kwargs={'pk': self.topic.pk})
+        self.client.force_authenticate(self.user)
+        with self.assertNoTableScans():
+            response = self.client.post(reverse('article-list'), {'title': "Title 1", 'text': "Text", 'topic': topic})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            response = self.client.post(reverse('article-bulk'), [
+                {'title': "Title 2", 'text': "Text", 'topic': topic},
+                {'title': "Title 3", 'text': "Text", 'topic': topic},
+            ], format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_publish(self):
+        self.client.force_authenticate(self.staff)
+        with self.assertNoTableScans():
+            response = self.client.get(reverse('article-publish', kwargs={'pk': self.articles[0].pk}))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.post(reverse('article-bulk-publish'), {'ids': [self.articles[2].pk]}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['published'], [self.articles[2].pk])
+
+    def test_batch(self):
+        with self.assertNoTableScans():
+            response = self.client.get(reverse('article-batch'), {'ids': '{},{}'.format(self.articles[1].pk, self.articles[0].pk)})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_related(self):
+        with self.assertNoTableScans():
+            response = self.client.get(reverse('article-related', kwargs={'pk': self.articles[0].pk}))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_changes(self):
+        # A watermark within the tombstone retention, older ones are answered with a 410 without a query
+        modified_since = (timezone.now() - timedelta(days=1)).isoformat()
+        with self.assertNoTableScans():
+            response = self.client.get(reverse('article-changes'), {'modified_since': modified_since})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_token(self):
+        with self.assertNoTableScans():
+            response = self.client.post(reverse('token_obtain_pair'), {'username': 'username', 'password': 'password'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@freeze_time("2020-03-01 19:36")
+class TestApiThrottling(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.other = User.objects.create_user(username='other', email='other@gom.com', password='password')
+        cls.topic = Topic.objects.create(title='Topic title 1')
+
+    def obtain_token(self, username):
+        return self.client.post(reverse('token_obtain_pair'), {'username': username, 'password': 'wrong'})
+
+    def obtain_token_from(self, username, address):
+        return self.client.post(reverse('token_obtain_pair'), {'username': username, 'password': 'wrong'},
+                                REMOTE_ADDR=address)
+
+    def test_token_attempts_per_address_and_username(self):
+        for _ in range(10):
+            self.assertEqual(self.obtain_token('username').status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.obtain_token('username')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        # One more attempt every 60 / 10 seconds
+        self.assertEqual(response['Retry-After'], '6')
+        self.assertEqual(self.obtain_token('other').status_code, status.HTTP_401_UNAUTHORIZED)
+        # Failed attempts from elsewhere don't lock the user out
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'username', 'password': 'password'},
+                                    REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with freeze_time("2020-03-01 19:36:06"):
+            self.assertEqual(self.obtain_token('username').status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertEqual(self.obtain_token('username').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_spoofed_forwarded_for_headers(self):
+        def obtain_token(forwarded_for):
+            return self.client.post(reverse('token_obtain_pair'), {'username': 'username', 'password': 'wrong'},
+                                    HTTP_X_FORWARDED_FOR=forwarded_for)
+
+        # Without proxies the header is ignored
+        for number in range(10):
+            self.assertEqual(obtain_token('10.1.0.{}'.format(number)).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(obtain_token('10.1.0.10').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        # Behind one, only the address it added counts
+        with override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, NUM_PROXIES=1)):
+            for number in range(10):
+                response = obtain_token('10.1.0.{}, 10.0.0.3'.format(number))
+                self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertEqual(obtain_token('10.1.0.10, 10.0.0.3').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={
+        'token_user': '2/min', 'token_username': '4/min', 'token_ip': '30/min',
+    }))
+    def test_token_attempts_per_username(self):
+        for number in range(4):
+            response = self.obtain_token_from('username', '10.2.0.{}'.format(number))
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.obtain_token_from('username', '10.2.0.4').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.obtain_token_from('other', '10.2.0.4').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={
+        'writes_user': '2/min', 'writes_ip': '3/min',
+    }))
+    def test_writes_per_user_and_ip(self):
+        topic = 'http://testserver' + reverse('topic-detail', kwargs={'pk': self.topic.pk})
+
+        def create(title):
+            return self.client.post(reverse('article-list'), {'title': title, 'text': "Text", 'topic': topic})
+
+        self.client.force_authenticate(self.user)
+        self.assertEqual(create("Title 1").status_code, status.HTTP_201_CREATED)
+        self.assertEqual(create("Title 2").status_code, status.HTTP_201_CREATED)
+        # The address has one request left
+        self.client.force_authenticate(self.other)
+        self.assertEqual(create("Title 3").status_code, status.HTTP_201_CREATED)
+        response = create("Title 4")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '20')
+
+        # The user has no requests left, whatever the address
+        self.client.force_authenticate(self.user)
+        response = self.client.post(reverse('article-list'), {'title': "Title 5", 'text': "Text", 'topic': topic},
+                                    REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '30')
+        # Reads aren't throttled
+        self.assertEqual(self.client.get(reverse('article-list')).status_code, status.HTTP_200_OK)
+
+    def test_workers_share_the_buckets(self):
+        worker, other_worker = throttling.BucketStore(), throttling.BucketStore()
+        self.assertEqual(worker.take('key', 2, 1, now=100), 0)
+        self.assertEqual(other_worker.take('key', 2, 1, now=100), 0)
+        self.assertEqual(worker.take('key', 2, 1, now=100.5), 0.5)
+        self.assertEqual(other_worker.take('key', 2, 1, now=101), 0)
+
+
+class TestApiArticleBatch(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.topic = Topic.objects.create(title='Topic title 1')
+        cls.articles = [
+            Article.objects.create(title="Article title {}".format(number), text="Article text {}".format(number),
+                                   user=cls.user, topic=cls.topic)
+            for number in range(3)
+        ]
+
+    def get_batch(self, ids, **params):
+        return self.client.get(reverse('article-batch'), dict(params, ids=ids))
+
+    def test_batch_keeps_the_requested_order(self):
+        first, _, last = self.articles
+        with self.assertNumQueries(1):
+            response = self.get_batch('{},999999,{},{}'.format(last.pk, first.pk, last.pk))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            self.client.get(reverse('article-detail', kwargs={'pk': pk})).data for pk in (last.pk, first.pk)
+        ])
+        self.assertEqual(response.data['missing'], [999999])
+
+        response = self.get_batch(str(first.pk), fields='title')
+        self.assertEqual(response.data['results'], [{'title': "Article title 0"}])
+
+    @override_settings(ARTICLE_BATCH_LIMIT=2)
+    def test_invalid_ids(self):
+        for ids in ('', 'one,two', '0', '1,2,3', '1,{}'.format(2 ** 63)):
+            response = self.get_batch(ids)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, ids)
+            self.assertIn('ids', response.data)
+        self.assertEqual(self.client.get(reverse('article-batch')).status_code, status.HTTP_400_BAD_REQUEST)
+        # Repeated ids count once
+        self.assertEqual(self.get_batch('1,1,2,2').status_code, status.HTTP_200_OK)
+
+
+@override_settings(TASKS_EAGER=True)
+class TestApiRelatedArticles(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.topic = Topic.objects.create(title='Topic title 1')
+        cls.article, cls.similar, cls.draft = [
+            Article.objects.create(title=title, text=text, status=article_status, user=cls.user, topic=cls.topic)
+            for title, text, article_status in (
+                ("First", "alpha beta", 'published'),
+                ("Second", "beta gamma", 'published'),
+                ("Third", "alpha gamma", 'draft'),
+            )
+        ]
+        Article.objects.create(title="Fourth", text="delta", status='published', user=cls.user, topic=cls.topic)
+
+    def get_related(self, pk, **params):
+        return self.client.get(reverse('article-related', kwargs={'pk': pk}), params)
+
+    def test_related_articles(self):
+        with self.assertNumQueries(1):
+            response = self.get_related(self.article.pk)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Drafts aren't related to anything
+        self.assertEqual([related['id'] for related in response.data['results']], [self.similar.pk])
+        related = dict(response.data['results'][0])
+        self.assertGreater(related.pop('score'), 0)
+        related.pop('id')
+        self.assertEqual(related, self.client.get(reverse('article-detail', kwargs={'pk': self.similar.pk})).data)
+
+        response = self.get_related(self.draft.pk, fields='title')
+        # The id and the score come with any ?fields=
+        self.assertEqual([list(related) for related in response.data['results']], [['id', 'score', 'title']] * 2)
+        self.assertCountEqual([related['title'] for related in response.data['results']], ["First", "Second"])
+
+    def test_articles_without_related_articles(self):
+        response = self.get_related(Article.objects.get(title="Fourth").pk)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(self.get_related(999999).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_updates_by_the_task_worker_expire_the_cached_lists(self):
+        self.assertEqual(len(self.get_related(self.article.pk).data['results']), 1)
+        RelatedArticle.objects.all().delete()
+        update_related([self.draft.pk])
+        self.assertEqual(self.get_related(self.article.pk).data['results'], [])
+
+    def test_publishing_expires_the_cached_lists(self):
+        self.assertEqual(len(self.get_related(self.article.pk).data['results']), 1)
+        Article.objects.get(pk=self.draft.pk).publish()
+        self.assertEqual(len(self.get_related(self.article.pk).data['results']), 2)
+
+
+class TestApiAutocomplete(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.topic = Topic.objects.create(title='Django')
+        Topic.objects.create(title='Python')
+        cls.articles = {
+            title: Article.objects.create(title=title, text="Text", user=cls.user, topic=cls.topic)
+            for title in ("Django tips", "django  Signals", "Deploying Django", "Djangonauts")
+        }
+
+    def autocomplete(self, **params):
+        response = self.client.get(reverse('autocomplete'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def titles(self, data, name='articles'):
+        return [match['title'] for match in data[name]]
+
+    def test_title_prefixes(self):
+        data = self.autocomplete(q='DJANGO ')
+        self.assertEqual(self.titles(data), ["django  Signals", "Django tips", "Djangonauts"])
+        self.assertEqual(data['topics'], [
+            {'id': self.topic.pk, 'title': 'Django', 'url': 'http://testserver' + reverse('topic-detail', kwargs={'pk': self.topic.pk})}
+        ])
+        self.assertEqual(data['articles'][1]['id'], self.articles["Django tips"].pk)
+
+        data = self.autocomplete(q='django s', type='articles', limit=1)
+        self.assertEqual(list(data), ['articles'])
+        self.assertEqual(self.titles(data), ["django  Signals"])
+
+        # Loaded once, then a lookup is a cache read and a query for the titles of each type
+        with self.assertNumQueries(2):
+            self.autocomplete(q='d')
+
+    def test_writes_are_picked_up(self):
+        self.assertEqual(self.titles(self.autocomplete(q='django t')), ["Django tips"])
+        article = self.articles["Django tips"]
+        article.title = "Django tricks"
+        article.save()
+        Article.objects.bulk_create([Article(title="Django testing", text="Text", user=self.user, topic=self.topic)])
+        self.articles["Djangonauts"].delete()
+        self.assertEqual(self.titles(self.autocomplete(q='django t')), ["Django testing", "Django tricks"])
+        self.assertEqual(self.titles(self.autocomplete(q='djangon')), [])
+
+        Topic.objects.create(title='Djinn')
+        self.assertEqual(self.titles(self.autocomplete(q='dj', type='topics'), 'topics'), ['Django', 'Djinn'])
+
+    @override_settings(AUTOCOMPLETE_SYNC_INTERVAL=60)
+    def test_writes_of_other_processes_are_picked_up(self):
+        with freeze_time("2020-03-01 10:00:00") as frozen:
+            self.assertEqual(self.titles(self.autocomplete(q='django t')), ["Django tips"])
+            # Neither sends signals, as if another process with a cache of its own had made them
+            Article.objects.filter(pk=self.articles["Django tips"].pk).update(title="Django tricks", modified=timezone.now())
+            Topic.objects.filter(pk=self.topic.pk).update(title='Djinn')
+            frozen.tick(timedelta(seconds=30))
+            self.assertEqual(self.autocomplete(q='django tr'), {'articles': [], 'topics': []})
+            frozen.tick(timedelta(seconds=30))
+            self.assertEqual(self.titles(self.autocomplete(q='django tr')), ["Django tricks"])
+            self.assertEqual(self.titles(self.autocomplete(q='dji'), 'topics'), ['Djinn'])
+
+    def test_lookups_do_not_wait_for_a_sync(self):
+        self.assertEqual(self.titles(self.autocomplete(q='dj', type='topics'), 'topics'), ['Django'])
+        Topic.objects.create(title='Djinn')
+        # Another thread is syncing
+        with topic_titles.sync_lock:
+            self.assertEqual(self.titles(self.autocomplete(q='dj', type='topics'), 'topics'), ['Django'])
+        self.assertEqual(self.titles(self.autocomplete(q='dj', type='topics'), 'topics'), ['Django', 'Djinn'])
+
+    @override_settings(AUTOCOMPLETE_MAX_LIMIT=5)
+    def test_invalid_parameters(self):
+        for params in ({}, {'q': ''}, {'q': 'dj', 'type': 'users'}, {'q': 'dj', 'limit': 0}, {'q': 'dj', 'limit': 6}):
+            response = self.client.get(reverse('autocomplete'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_prefix_index(self):
+        index = PrefixIndex()
+        index.load([(1, 'b'), (2, 'a'), (3, 'ab')])
+        index.add(4, 'Ab')
+        index.add(2, 'c')
+        index.remove(3)
+        index.remove(99)
+        self.assertEqual(index.search('a', 10), [4])
+        self.assertEqual(index.search('', 2), [4, 1])
+        self.assertEqual(len(index), 3)
+
+
+class TestApiSingleFlight(TransactionTestCase):
+    """
+    Concurrent requests run on threads of their own, which only see committed data
+    """
+    def setUp(self):
+        get_cache().clear()
+        coalescing.flights.clear()
+        self.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        self.topic = Topic.objects.create(title='Topic title 1')
+        Article.objects.create(title="Article title 1", text="Article text 1", user=self.user, topic=self.topic)
+
+    def get_concurrently(self, url, count=5):
+        """
+        Sends `count` identical requests at once, while TopicDetail takes long enough for all of them to
+        arrive. Returns the responses and how many times a topic was loaded.
+        """
+        get_object = TopicDetail.get_object
+
+        def slow_get_object(view, *args, **kwargs):
+            time.sleep(0.3)
+            return get_object(view, *args, **kwargs)
+
+        responses = [None] * count
+
+        def get(index):
+            try:
+                responses[index] = APIClient().get(url)
+            finally:
+                connections.close_all()
+
+        with mock.patch.object(TopicDetail, 'get_object', autospec=True, side_effect=slow_get_object) as loads:
+            threads = [threading.Thread(target=get, args=(index,)) for index in range(count)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return responses, loads.call_count
+
+    def test_concurrent_requests_share_one_response(self):
+        responses, loads = self.get_concurrently(reverse('topic-detail', kwargs={'pk': self.topic.pk}))
+        self.assertEqual(loads, 1)
+        self.assertEqual({response.status_code for response in responses}, {status.HTTP_200_OK})
+        self.assertEqual(len({response.content for response in responses}), 1)
+        self.assertEqual(len({response['ETag'] for response in responses}), 1)
+
+    def test_responses_that_are_not_cached_are_not_shared(self):
+        responses, loads = self.get_concurrently(reverse('topic-detail', kwargs={'pk': 999999}), count=3)
+        self.assertEqual(loads, 3)
+        self.assertEqual({response.status_code for response in responses}, {status.HTTP_404_NOT_FOUND})
+
+    @override_settings(API_SINGLE_FLIGHT=False)
+    def test_disabled(self):
+        responses, loads = self.get_concurrently(reverse('topic-detail', kwargs={'pk': self.topic.pk}), count=3)
+        self.assertEqual(loads, 3)
+
+    @override_settings(API_SINGLE_FLIGHT_SHARED=True)
+    def test_processes_take_turns(self):
+        url = reverse('topic-detail', kwargs={'pk': self.topic.pk})
+        started = time.monotonic()
+        # Every request leads a flight of its own, as if it came to another process
+        with mock.patch.object(coalescing.flights, 'join', side_effect=lambda key: (coalescing.Flight(), True)):
+            self.assertEqual(self.get_concurrently(url)[1], 1)
+            Article.objects.create(title="Article title 2", text="Article text 2", user=self.user, topic=self.topic)
+            # The turn of the first rendering is over
+            responses, loads = self.get_concurrently(url)
+        self.assertEqual(loads, 1)
+        self.assertEqual({response.json()['articles_count'] for response in responses}, {2})
+        self.assertLess(time.monotonic() - started, coalescing.get_wait_timeout())
+        self.assertEqual(os.listdir(coalescing.get_lock_dir()), [])
+
+    def test_take_turn(self):
+        # Another process has the turn, and caches its result after a while
+        result, other = coalescing.take_turn('turn', lambda: None)
+        results = []
+
+        def finish():
+            results.append('rendered')
+            coalescing.release(other)
+
+        timer = threading.Timer(0.1, finish)
+        timer.start()
+        self.assertEqual(coalescing.take_turn('turn', lambda: results[0] if results else None), ('rendered', None))
+        timer.join()
+
+        result, lock = coalescing.take_turn('turn', lambda: None)
+        self.assertIsNone(result)
+        with override_settings(API_SINGLE_FLIGHT_TIMEOUT=0.1):
+            self.assertEqual(coalescing.take_turn('turn', lambda: None), (None, None))
+        # The next turn starts with a new lock file
+        timer = threading.Timer(0.1, coalescing.release, [lock])
+        timer.start()
+        result, lock = coalescing.take_turn('turn', lambda: None)
+        timer.join()
+        self.assertIsNone(result)
+        coalescing.release(lock)
+        self.assertEqual(os.listdir(coalescing.get_lock_dir()), [])
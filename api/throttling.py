@@ -0,0 +1,151 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+# Seconds between removing the buckets that filled up again
+PURGE_INTERVAL = 60
+
+
+def get_throttle_db():
+    return getattr(settings, 'API_THROTTLE_DB', None) or os.path.join(tempfile.gettempdir(), 'bloggyblog-throttle.sqlite3')
+
+
+class BucketStore:
+    """
+    Token buckets kept in a SQLite file, so that all the worker processes of a host share them.
+    Every take runs in an IMMEDIATE transaction, which makes concurrent takes wait for each other.
+    """
+    def __init__(self):
+        self.local = threading.local()
+        self.last_purge = 0
+
+    def connection(self):
+        # One connection per thread, and new ones in forked workers
+        key = (os.getpid(), get_throttle_db())
+        if getattr(self.local, 'key', None) != key:
+            connection = sqlite3.connect(key[1], timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS buckets '
+                '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)'
+            )
+            self.local.connection, self.local.key = connection, key
+        return self.local.connection
+
+    def take(self, key, capacity, rate, now=None):
+        """
+        Takes a token from the bucket of `key`, which holds up to `capacity` tokens and gains `rate`
+        of them per second. Returns 0 if there was one, otherwise the seconds until there is.
+        """
+        now = time.time() if now is None else now
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + max(now - row[1], 0) * rate)
+            if tokens >= 1:
+                tokens, wait = tokens - 1, 0
+            else:
+                wait = (1 - tokens) / rate
+            connection.execute(
+                'INSERT OR REPLACE INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)',
+                (key, tokens, now, now + (capacity - tokens) / rate)
+            )
+            if now - self.last_purge >= PURGE_INTERVAL:
+                # A full bucket is the same as none at all
+                connection.execute('DELETE FROM buckets WHERE full_at <= ?', (now,))
+                self.last_purge = now
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return wait
+
+    def clear(self):
+        self.connection().execute('DELETE FROM buckets')
+
+
+store = BucketStore()
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Token bucket throttle for the views with a `throttle_scope`. A rate of 'N/period' lets a
+    client make a burst of N requests, then one more every period / N. The rates are looked up
+    in DEFAULT_THROTTLE_RATES as '<scope>_<rate_suffix>'; scopes without one aren't throttled.
+    """
+    rate_suffix = None
+
+    def __init__(self):
+        # The rate depends on the view, see allow_request()
+        self.wait_seconds = None
+
+    def get_ident_for(self, request, view):
+        raise NotImplementedError('.get_ident_for() must be overridden')
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if not scope:
+            return True
+        self.scope = '{}_{}'.format(scope, self.rate_suffix)
+        self.rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        ident = self.get_ident_for(request, view)
+        if self.rate is None or ident is None:
+            return True
+
+        num_requests, duration = self.parse_rate(self.rate)
+        key = '{}:{}'.format(self.scope, ident)
+        self.wait_seconds = store.take(key, num_requests, num_requests / duration)
+        return self.wait_seconds == 0
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class UserThrottle(TokenBucketThrottle):
+    """
+    Per user. Views that authenticate users (like the token view) can name the user that
+    anonymous requests are for with a `get_throttle_user(request)` method; those requests are
+    throttled per client address and user, so that nobody can use up the attempts of someone else.
+    """
+    rate_suffix = 'user'
+
+    def get_ident_for(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return request.user.pk
+        get_throttle_user = getattr(view, 'get_throttle_user', None)
+        user = get_throttle_user(request) if get_throttle_user is not None else None
+        return None if user is None else '{}:{}'.format(self.get_ident(request), user)
+
+
+class UsernameThrottle(TokenBucketThrottle):
+    """
+    Per user named by an anonymous request (see UserThrottle), whatever its address: caps the
+    attempts on an account spread over many addresses. Its rate is meant to be looser than the
+    per-address one, so that nobody gets locked out by a few attempts of someone else.
+    """
+    rate_suffix = 'username'
+
+    def get_ident_for(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        get_throttle_user = getattr(view, 'get_throttle_user', None)
+        return get_throttle_user(request) if get_throttle_user is not None else None
+
+
+class IPThrottle(TokenBucketThrottle):
+    """
+    Per client IP address, as found by DRF: the address of the connection, or the one the
+    NUM_PROXIES proxies in front of the server put in X-Forwarded-For (the rest of that header
+    comes from the client)
+    """
+    rate_suffix = 'ip'
+
+    def get_ident_for(self, request, view):
+        return self.get_ident(request)
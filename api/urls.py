@@ -1,8 +1,9 @@
 from django.urls import path, include
-from .views import UserDetailView, TopicList, TopicDetail, ArticleViewSet
+from .views import UserDetailView, TopicList, TopicDetail, ArticleViewSet, AutocompleteView, ClaimsTokenObtainPairView
+from .metrics import MetricsView
 
 from rest_framework.routers import DefaultRouter
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.views import TokenRefreshView
 
 
 router = DefaultRouter()
@@ -16,6 +17,10 @@ urlpatterns = [
 
     path('articles/', include(router.urls)),
 
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('autocomplete/', AutocompleteView.as_view(), name='autocomplete'),
+
+    path('token/', ClaimsTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
\ No newline at end of file
@@ -1,15 +1,35 @@
 import json
-from django.db.models import Q
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.utils import timezone
 from django.http import Http404
 from rest_framework.decorators import action
 from rest_framework.generics import get_object_or_404
+from rest_framework.reverse import reverse
 
 from rest_framework.response import Response
 from rest_framework import status, views, generics, viewsets, permissions, serializers
+from rest_framework_simplejwt.views import TokenObtainPairView
 
-from backend.models import User, Topic, Article
-from .serializers import UserSerializer, TopicListSerializer, TopicDetailSerializer, ArticleSerializer
+from backend.models import User, Topic, Article, ArticleTombstone
+from backend.search import search_articles
+from backend.utils import chunks
+from .serializers import (
+    UserSerializer, UserArticleSerializer, TopicListSerializer, TopicDetailSerializer, TopicArticleSerializer,
+    ArticleSerializer, ArticleBulkSerializer, ArticlePublishSerializer, ArticleBatchSerializer, CompiledArticleSerializer,
+    AutocompleteSerializer
+)
+from .fieldsets import get_article_fields, trim_article_queryset
+from .pagination import ChangesFeedPagination
 from .permissions import IsOwnerOrAdmin
+from .authentication import ClaimsTokenObtainPairSerializer
+from .autocomplete import article_titles, topic_titles
+from .cache import cache_response
+from .streaming import ITERATOR_CHUNK_SIZE, iter_list, iter_object, streaming_response, wants_stream
 
 # Below you can find different approaches on creating the views for the API`
 
@@ -18,15 +38,19 @@ class UserDetailView(views.APIView):
     """
     Retrieves a User and his Articles
     """
-    def get_object(self, pk):
+    def get_object(self, pk, article_fields=None):
+        articles = Article.objects.select_related('topic').only('title', 'text', 'user', 'topic__title').order_by('pk')
+        articles = trim_article_queryset(articles, article_fields)
         try:
-            return User.objects.get(pk=pk)
+            return User.objects.prefetch_related(Prefetch('articles', queryset=articles)).get(pk=pk)
         except User.DoesNotExist:
             raise Http404
 
+    @cache_response('user:{pk}')
     def get(self, request, pk):
-        user = self.get_object(pk)
-        serializer = UserSerializer(user)
+        article_fields = get_article_fields(request, UserArticleSerializer.Meta.fields)
+        user = self.get_object(pk, article_fields)
+        serializer = UserSerializer(user, context={'article_fields': article_fields})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
@@ -36,7 +60,14 @@ class TopicList(generics.ListCreateAPIView):
     """
     queryset = Topic.objects.all()
     serializer_class = TopicListSerializer
+    throttle_scope = 'writes'
+
+    def get_throttles(self):
+        if self.request.method in permissions.SAFE_METHODS:
+            return []
+        return super().get_throttles()
 
+    @cache_response('topics')
     def get(self, request, *args, **kwargs):
         context = {'request': request}
         serializer = TopicListSerializer(self.get_queryset(), many=True, context=context)
@@ -61,18 +92,38 @@ class TopicDetail(generics.RetrieveAPIView):
     queryset = Topic.objects.all()
     serializer_class = TopicDetailSerializer
 
-    def get_object(self, pk):
+    def get_object(self, pk, article_fields=None):
+        articles = Article.objects.only('title', 'text', 'status', 'topic').order_by('pk')
+        articles = trim_article_queryset(articles, article_fields)
         try:
-            return Topic.objects.get(pk=pk)
+            return Topic.objects.prefetch_related(Prefetch('articles', queryset=articles)).get(pk=pk)
         except Topic.DoesNotExist:
             raise Http404
 
+    @cache_response('topic:{pk}')
     def get(self, request, pk):
-        context = {'request': request}
-        topic = self.get_object(pk)
+        article_fields = get_article_fields(request, TopicArticleSerializer.Meta.fields)
+        context = {'request': request, 'article_fields': article_fields}
+        if wants_stream(request):
+            return self.stream(pk, context)
+        topic = self.get_object(pk, article_fields)
         serializer = TopicDetailSerializer(topic, context=context)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    def stream(self, pk, context):
+        try:
+            topic = Topic.objects.get(pk=pk)
+        except Topic.DoesNotExist:
+            raise Http404
+        serializer = TopicDetailSerializer(topic, context=context)
+        head = serializer.to_representation_without_articles(topic)
+        articles = topic.articles.only('title', 'text', 'status').order_by('pk')
+        articles = trim_article_queryset(articles, context['article_fields'])
+        article_serializer = TopicArticleSerializer(context={'fields': context['article_fields']})
+        return streaming_response(iter_object(
+            head, 'articles', articles.iterator(chunk_size=ITERATOR_CHUNK_SIZE), article_serializer.to_representation
+        ))
+
 
 class ArticleViewSet(viewsets.ModelViewSet):
     """
@@ -80,19 +131,34 @@ class ArticleViewSet(viewsets.ModelViewSet):
     """
     serializer_class = ArticleSerializer
     lookup_field = 'pk'
+    throttle_scope = 'writes'
 
     def get_queryset(self):
         queryset = Article.objects.all()
         search = self.request.GET.get('search')
         if search is not None:
-            queryset = queryset.filter(
-                Q(title__icontains=search) |
-                Q(text__icontains=search)
-            ).distinct()
+            queryset = search_articles(queryset, search)
+        if self.action in ('list', 'retrieve') and self.format_kwarg:
+            queryset = trim_article_queryset(queryset, self.get_article_fields())
         return queryset
 
+    def get_article_fields(self):
+        return get_article_fields(self.request, ArticleSerializer.Meta.fields)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ('list', 'retrieve', 'batch_retrieve_articles', 'related_articles'):
+            context['fields'] = self.get_article_fields()
+        return context
+
+    def streams_list(self):
+        # The whole list at once, see list()
+        return self.action == 'list' and not self.format_kwarg and wants_stream(self.request)
+
     def get_permissions(self):
-        if self.action == 'list' or self.action == 'retrieve':
+        if self.streams_list():
+            permission_classes = [permissions.IsAuthenticated]
+        elif self.action in ('list', 'retrieve', 'batch_retrieve_articles', 'related_articles', 'changes'):
             permission_classes = [permissions.AllowAny]
         elif self.action == 'update' or self.action == 'partial_update' or self.action == 'destroy':
             permission_classes = [IsOwnerOrAdmin]
@@ -100,9 +166,164 @@ class ArticleViewSet(viewsets.ModelViewSet):
             permission_classes = [permissions.IsAuthenticated]
         return [permission() for permission in permission_classes]
 
+    def get_throttles(self):
+        if self.streams_list():
+            self.throttle_scope = 'streams'
+            return super().get_throttles()
+        if self.action in ('list', 'retrieve', 'batch_retrieve_articles', 'related_articles', 'changes'):
+            return []
+        return super().get_throttles()
+
+    @cache_response('articles')
+    def list(self, request, *args, **kwargs):
+        if self.format_kwarg:
+            # Format suffixes end up in the hyperlinks, leave those to ArticleSerializer
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = CompiledArticleSerializer(request, self.get_article_fields())
+        if wants_stream(request):
+            # The whole list, unpaginated, without holding it in memory
+            if not queryset.query.order_by:
+                queryset = queryset.order_by(*self.paginator.ordering)
+            rows = serializer.values(queryset).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+            return streaming_response(iter_list(rows, serializer.to_representation))
+
+        page = self.paginate_queryset(serializer.values(queryset))
+        if page is not None:
+            return self.get_paginated_response(serializer.serialize(page))
+        return Response(serializer.serialize(serializer.values(queryset)))
+
+    @cache_response('article:{pk}')
+    def retrieve(self, request, *args, **kwargs):
+        if self.format_kwarg:
+            return super().retrieve(request, *args, **kwargs)
+        # Anyone may read an article, so there are no object permissions to check
+        serializer = CompiledArticleSerializer(request, self.get_article_fields())
+        row = get_object_or_404(serializer.values(self.get_queryset()), pk=kwargs[self.lookup_field])
+        return Response(serializer.to_representation(row))
+
+    @action(methods=['get'], detail=False, url_path='batch', url_name='batch')
+    @cache_response('articles')
+    def batch_retrieve_articles(self, request, *args, **kwargs):
+        """
+        The articles of ?ids=1,2,3 in that order, loaded with a single query, and the ids that don't exist
+        """
+        serializer = ArticleBatchSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        fields = self.get_article_fields()
+        queryset = Article.objects.filter(pk__in=ids)
+        if self.format_kwarg:
+            # Format suffixes end up in the hyperlinks, leave those to ArticleSerializer
+            articles = {article.pk: article for article in trim_article_queryset(queryset, fields)}
+            to_representation = ArticleSerializer(context=self.get_serializer_context()).to_representation
+        else:
+            compiled = CompiledArticleSerializer(request, fields)
+            articles = {row['id']: row for row in compiled.values(queryset)}
+            to_representation = compiled.to_representation
+        return Response({
+            'results': [to_representation(articles[pk]) for pk in ids if pk in articles],
+            'missing': [pk for pk in ids if pk not in articles],
+        })
+
+    @action(methods=['get'], detail=True, url_path='related', url_name='related')
+    @cache_response('articles')
+    def related_articles(self, request, *args, **kwargs):
+        """
+        The published articles most similar to this one, most similar first, as stored by build_related_articles
+        """
+        pk = kwargs[self.lookup_field]
+        serializer = CompiledArticleSerializer(request, self.get_article_fields())
+        queryset = Article.objects.filter(related_to__article_id=pk, status='published').annotate(
+            related_score=F('related_to__score')
+        ).order_by('-related_score', 'pk')
+        rows = list(serializer.values(queryset, 'related_score'))
+        if not rows:
+            get_object_or_404(Article.objects.only('pk'), pk=pk)
+
+        results = []
+        for row in rows:
+            related = OrderedDict([('id', row['id']), ('score', round(row['related_score'], 4))])
+            related.update(serializer.to_representation(row))
+            results.append(related)
+        return Response({'results': results})
+
+    @action(methods=['get'], detail=False, url_path='changes', url_name='changes')
+    def changes(self, request):
+        """
+        Articles created, updated or deleted since ?modified_since= (inclusive), oldest change first.
+        Deleted articles come as tombstones: their id, when they were deleted and `deleted: true`.
+        """
+        start = None
+        if 'modified_since' in request.query_params:
+            try:
+                start = serializers.DateTimeField().to_internal_value(request.query_params['modified_since'])
+            except serializers.ValidationError as error:
+                raise serializers.ValidationError({'modified_since': error.detail})
+        # Leave the latest changes to the next poll, their transactions may not have committed yet
+        until = timezone.now() - timedelta(seconds=getattr(settings, 'ARTICLE_CHANGES_DELAY', 5))
+
+        serializer = CompiledArticleSerializer(request, self.get_article_fields())
+        articles = serializer.values(Article.objects.filter(modified__lte=until), 'pk', 'modified')
+        tombstones = ArticleTombstone.objects.filter(modified__lte=until).values('pk', 'modified')
+        paginator = ChangesFeedPagination()
+        page = paginator.paginate_changes([articles, tombstones], request, start=start, horizon=ArticleTombstone.horizon())
+
+        modified = serializers.DateTimeField()
+        results = []
+        for index, row in page:
+            change = OrderedDict([('id', row['pk']), ('modified', modified.to_representation(row['modified'])), ('deleted', index == 1)])
+            if index == 0:
+                change.update(serializer.to_representation(row))
+            results.append(change)
+        return paginator.get_paginated_response(results)
+
+    @action(methods=['post'], detail=False, url_path='bulk', url_name='bulk')
+    def bulk_create_articles(self, request):
+        if not isinstance(request.data, list):
+            raise serializers.ValidationError({"detail": "Expected a list of articles."})
+        limit = getattr(settings, 'ARTICLE_BULK_CREATE_LIMIT', 5000)
+        if len(request.data) > limit:
+            raise serializers.ValidationError({"detail": "At most {} articles can be created at once.".format(limit)})
+
+        serializer = ArticleBulkSerializer(data=request.data, many=True, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(methods=['post'], detail=False, url_path='publish', url_name='bulk-publish')
+    def bulk_publish_articles(self, request):
+        if not request.user.is_staff:
+            return Response(data={"detail": "You do not have permission to perform this action."}, status=status.HTTP_403_FORBIDDEN)
+
+        serializer = ArticlePublishSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids, publish_at = serializer.validated_data['ids'], serializer.validated_data.get('publish_at')
+        scheduling = publish_at is not None and publish_at > timezone.now()
+        done = set()
+        with transaction.atomic():
+            if scheduling:
+                for chunk in chunks(ids):
+                    drafts = list(Article.objects.filter(pk__in=chunk, status='draft').values_list('pk', flat=True))
+                    Article.objects.filter(pk__in=drafts).schedule(publish_at)
+                    done.update(drafts)
+            else:
+                done.update(article.pk for article in Article.objects.publish(ids))
+        if scheduling:
+            key, message = 'scheduled', "{} articles scheduled for publishing.".format(len(done))
+        else:
+            key, message = 'published', "{} articles published.".format(len(done))
+        return Response(data={
+            "detail": message,
+            key: [pk for pk in ids if pk in done],
+            "skipped": [pk for pk in ids if pk not in done],
+        }, status=status.HTTP_200_OK)
+
     @action(methods=['get'], detail=True, url_path='publish', url_name='publish')
     def publish_article(self, request, pk=None):
-        article = get_object_or_404(Article, pk=pk)
+        # The status, and the title for the message, is all that publishing needs
+        article = get_object_or_404(Article.objects.only('title', 'status', 'topic_id', 'user_id'), pk=pk)
         if not request.user.is_staff:
             return Response(data={"detail": "You do not have permission to perform this action."}, status=status.HTTP_403_FORBIDDEN)
 
@@ -111,3 +332,41 @@ class ArticleViewSet(viewsets.ModelViewSet):
 
         article.publish()
         return Response(data={"detail": "Article '{}' has been successfully published!".format(article)}, status=status.HTTP_200_OK)
+
+
+class AutocompleteView(views.APIView):
+    """
+    Article and topic titles starting with ?q=, served from per-process prefix indexes
+    """
+    indexes = (('articles', Article, article_titles, 'article-detail'), ('topics', Topic, topic_titles, 'topic-detail'))
+
+    def get(self, request):
+        serializer = AutocompleteSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        limit = params.get('limit', getattr(settings, 'AUTOCOMPLETE_LIMIT', 10))
+
+        data = OrderedDict()
+        for name, model, titles, view_name in self.indexes:
+            if params.get('type', name) != name:
+                continue
+            ids = titles.search(params['q'], limit)
+            found = dict(model.objects.filter(pk__in=ids).values_list('pk', 'title')) if ids else {}
+            data[name] = [
+                {'id': pk, 'title': found[pk], 'url': reverse(view_name, kwargs={'pk': pk}, request=request)}
+                for pk in ids if pk in found
+            ]
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class ClaimsTokenObtainPairView(TokenObtainPairView):
+    """
+    Issues tokens carrying the claims that StatelessJWTAuthentication needs
+    """
+    serializer_class = ClaimsTokenObtainPairSerializer
+    # Every attempt hashes a password
+    throttle_scope = 'token'
+
+    def get_throttle_user(self, request):
+        username = request.data.get(User.USERNAME_FIELD)
+        return str(username) if username else None
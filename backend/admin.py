@@ -1,7 +1,37 @@
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth.admin import UserAdmin
+from django.core.paginator import Paginator
+from django.db.models import Q, QuerySet
+from django.db.models.functions import Substr
+from django.utils.functional import cached_property
+from django.utils.text import Truncator
 
-from backend.models import User, Topic, Article
+from backend.models import User, Topic, Article, Task
+from backend.search import matching_article_ids
+from backend.utils import estimated_count
+
+# Characters of the article text shown in the changelist
+TEXT_PREVIEW_LENGTH = 100
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that takes the size of a whole table from estimated_count() instead of a COUNT(*)
+    once it has more than ADMIN_ESTIMATED_COUNT_THRESHOLD rows. Filtered lists are counted exactly.
+    """
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return super().count
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate >= getattr(settings, 'ADMIN_ESTIMATED_COUNT_THRESHOLD', 100000):
+                return estimate
+        # Counts the primary keys only, leaving the annotations and joins of the listing out
+        return queryset.values('pk').order_by().count()
 
 
 class CustomUserAdmin(UserAdmin):
@@ -15,13 +45,58 @@ class TopicAdmin(admin.ModelAdmin):
     search_fields = ['title']
 
 
+class ArticleChangeList(ChangeList):
+    def get_queryset(self, request):
+        # Only the start of the text is shown, so don't load all of it
+        queryset = super().get_queryset(request).defer('text')
+        return queryset.annotate(text_start=Substr('text', 1, TEXT_PREVIEW_LENGTH + 1))
+
+
 class ArticleAdmin(admin.ModelAdmin):
-    list_display = ['title', 'topic', 'text', 'user', 'status']
+    list_display = ['title', 'topic', 'text_preview', 'user', 'status']
     list_filter = ['status']
-    search_fields = ['title', 'text', 'user']
+    list_select_related = ['topic', 'user']
+    # Searched by get_search_results() through the search index and the indexes on the user columns
+    search_fields = ['title', 'text', 'user__username', 'user__email', 'user__first_name', 'user__last_name']
+    paginator = EstimatedCountPaginator
+    # Saves a COUNT(*) of the whole table on every filtered page
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return ArticleChangeList
+
+    def text_preview(self, article):
+        return Truncator(article.text_start).chars(TEXT_PREVIEW_LENGTH)
+    text_preview.short_description = 'text'
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Articles with every word of the search term in their title or text, and articles of the
+        users whose username, email, first or last name starts with it
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+
+        users = Q()
+        # Prefix matches are case sensitive, to use the indexes
+        for value in {search_term, search_term.lower(), search_term.capitalize()}:
+            users |= (Q(username__startswith=value) | Q(email__startswith=value)
+                      | Q(first_name__startswith=value) | Q(last_name__startswith=value))
+        matches = Q(user_id__in=User.objects.filter(users).values('pk'))
+        article_ids = matching_article_ids(search_term)
+        if article_ids is not None:
+            matches |= Q(pk__in=article_ids)
+        return queryset.filter(matches), False
+
+
+class TaskAdmin(admin.ModelAdmin):
+    # Mostly for the error of the failed tasks
+    list_display = ['name', 'args', 'attempts', 'run_after', 'failed_at']
+    search_fields = ['name']
 
 
 admin.site.register(User, CustomUserAdmin)
 admin.site.register(Topic, TopicAdmin)
 admin.site.register(Article, ArticleAdmin)
-
+admin.site.register(Task, TaskAdmin)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class BackendConfig(AppConfig):
     name = 'backend'
+
+    def ready(self):
+        from . import signals  # noqa: F401
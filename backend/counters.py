@@ -0,0 +1,81 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+
+from .models import Article, Topic, User
+
+COUNTER_FIELDS = {
+    'draft': 'draft_articles_count',
+    'published': 'published_articles_count',
+}
+
+
+def state_deltas(state, change):
+    """
+    Returns the counter deltas for adding (change=1) or removing (change=-1)
+    an article counted under the given (topic_id, user_id, status) state
+    """
+    topic_id, user_id, article_status = state
+    field = COUNTER_FIELDS[article_status]
+    return Counter({
+        (Topic, topic_id, field): change,
+        (User, user_id, field): change,
+    })
+
+
+def created_deltas(articles):
+    deltas = Counter()
+    for article in articles:
+        deltas.update(state_deltas((article.topic_id, article.user_id, article.status), 1))
+    return deltas
+
+
+def changed_deltas(old_state, new_state):
+    deltas = Counter()
+    if old_state == new_state:
+        return deltas
+    if old_state is not None:
+        deltas.update(state_deltas(old_state, -1))
+    if new_state is not None:
+        deltas.update(state_deltas(new_state, 1))
+    return deltas
+
+
+def apply_deltas(deltas):
+    """
+    Applies {(model, pk, field): delta} with one UPDATE ... SET field = field + delta per row.
+    Decrements stop at 0: a counter that drifted (see reconcile()) must not make the write fail.
+    """
+    rows = defaultdict(dict)
+    for (model, pk, field), delta in deltas.items():
+        if delta > 0:
+            rows[model, pk][field] = F(field) + delta
+        elif delta < 0:
+            rows[model, pk][field] = Greatest(F(field) + delta, Value(0))
+    with transaction.atomic():
+        for (model, pk), updates in rows.items():
+            model.objects.filter(pk=pk).update(**updates)
+
+
+def reconcile():
+    """
+    Recomputes every counter from the articles table and fixes the ones that drifted.
+    Returns the number of topics and users that had to be repaired.
+    """
+    repaired = 0
+    for model, related_field in ((Topic, 'topic'), (User, 'user')):
+        expected = defaultdict(dict)
+        counts = Article.objects.values_list(related_field, 'status').annotate(total=Count('id')).order_by()
+        for pk, article_status, total in counts:
+            expected[pk][COUNTER_FIELDS[article_status]] = total
+
+        fields = list(COUNTER_FIELDS.values())
+        with transaction.atomic():
+            for row in model.objects.values('pk', *fields).iterator():
+                wanted = {field: expected[row['pk']].get(field, 0) for field in fields}
+                if any(row[field] != wanted[field] for field in fields):
+                    model.objects.filter(pk=row['pk']).update(**wanted)
+                    repaired += 1
+    return repaired
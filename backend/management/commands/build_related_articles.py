@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from backend.related import rebuild_related
+
+
+class Command(BaseCommand):
+    help = "Recomputes the related articles of all articles from the full-text search index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        articles = rebuild_related(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS("Found the related articles of {} articles.".format(articles)))
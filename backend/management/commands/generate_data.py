@@ -0,0 +1,96 @@
+import random
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from backend.models import User, Topic, Article
+from backend.search import rebuild_index
+
+WORDS = (
+    "python django api article topic blog data query index cache server client request response "
+    "database table column performance latency throughput worker process thread memory network "
+    "design pattern model view template form field migration signal middleware router token user "
+    "search rank page cursor stream json render serialize validate publish draft review editor "
+    "release version feature bug test benchmark profile optimize scale replica primary write read "
+    "amsterdam rotterdam utrecht office team product customer market price report summary weekly"
+).split()
+
+
+class Command(BaseCommand):
+    help = "Generates users, topics and articles with bulk inserts, for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--topics', type=int, default=50)
+        parser.add_argument('--articles', type=int, default=10000)
+        parser.add_argument('--published-ratio', type=float, default=0.7)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--password', default='password', help="Password of every generated user")
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--skip-search-index', action='store_true',
+                            help="Don't rebuild the search index afterwards")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        # Makes the generated usernames, emails and titles unique across runs
+        run = uuid.uuid4().hex[:8]
+
+        users = self.create_users(options['users'], run, make_password(options['password']), batch_size)
+        topics = self.create_topics(options['topics'], run, batch_size)
+        if not users or not topics:
+            self.stdout.write("Nothing to attach articles to, skipping them.")
+        else:
+            self.create_articles(options['articles'], run, users, topics, options['published_ratio'], batch_size)
+
+        if not options['skip_search_index']:
+            self.stdout.write("Rebuilding the search index...")
+            rebuild_index()
+        self.stdout.write(self.style.SUCCESS("Done."))
+
+    def sentence(self, low, high):
+        return ' '.join(self.random.choice(WORDS) for _ in range(self.random.randint(low, high)))
+
+    def text(self):
+        paragraphs = [self.sentence(40, 120).capitalize() + '.' for _ in range(self.random.randint(1, 6))]
+        return '\n\n'.join(paragraphs)
+
+    def create_users(self, count, run, password, batch_size):
+        User.objects.bulk_create([
+            User(
+                username='gen-{}-{}'.format(run, number), email='gen-{}-{}@example.com'.format(run, number),
+                first_name=self.random.choice(WORDS).capitalize(), last_name=self.random.choice(WORDS).capitalize(),
+                password=password, is_staff=number == 0,
+            )
+            for number in range(count)
+        ], batch_size=batch_size)
+        self.stdout.write("Created {} users.".format(count))
+        return list(User.objects.filter(username__startswith='gen-{}-'.format(run)).values_list('pk', flat=True))
+
+    def create_topics(self, count, run, batch_size):
+        Topic.objects.bulk_create([
+            Topic(title='{} {} ({}-{})'.format(self.random.choice(WORDS), self.random.choice(WORDS), run, number).capitalize())
+            for number in range(count)
+        ], batch_size=batch_size)
+        self.stdout.write("Created {} topics.".format(count))
+        return list(Topic.objects.filter(title__contains='({}-'.format(run)).values_list('pk', flat=True))
+
+    def create_articles(self, count, run, users, topics, published_ratio, batch_size):
+        created = 0
+        while created < count:
+            size = min(batch_size, count - created)
+            with transaction.atomic():
+                Article.objects.bulk_create([
+                    Article(
+                        title='{} ({}-{})'.format(self.sentence(3, 8).capitalize(), run, created + number),
+                        text=self.text(),
+                        status='published' if self.random.random() < published_ratio else 'draft',
+                        user_id=self.random.choice(users),
+                        topic_id=self.random.choice(topics),
+                    )
+                    for number in range(size)
+                ])
+            created += size
+            self.stdout.write("Created {}/{} articles.".format(created, count))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from backend.models import Article
+
+
+class Command(BaseCommand):
+    help = "Publishes the drafts whose publish_at has come, in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help="Keep running, checking for due drafts every --interval")
+        parser.add_argument('--interval', type=float, default=60, help="Seconds between checks with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            published = self.publish_due(options['batch_size'])
+            self.stdout.write("Published {} scheduled articles.".format(published))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    @staticmethod
+    def publish_due(batch_size):
+        published = 0
+        while True:
+            # Served by the (status, publish_at) index
+            ids = list(Article.objects.due().order_by('publish_at').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return published
+            published += len(Article.objects.publish(ids))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import ArticleTombstone
+
+
+class Command(BaseCommand):
+    help = "Deletes the tombstones of articles deleted more than ARTICLE_TOMBSTONE_RETENTION_DAYS ago"
+
+    def handle(self, *args, **options):
+        deleted, _ = ArticleTombstone.objects.filter(modified__lt=ArticleTombstone.horizon()).delete()
+        self.stdout.write("Purged {} article tombstones.".format(deleted))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from backend.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = "Recomputes the draft/published article counters of topics and users and repairs any drift"
+
+    def handle(self, *args, **options):
+        repaired = reconcile()
+        self.stdout.write(self.style.SUCCESS("Repaired counters of {} topics/users.".format(repaired)))
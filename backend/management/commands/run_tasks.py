@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from backend.tasks import run_pending
+
+
+class Command(BaseCommand):
+    help = "Runs the tasks queued after writes (see backend.tasks), in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help="Keep running, checking for new tasks every --interval")
+        parser.add_argument('--interval', type=float, default=1, help="Seconds between checks with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            done, failed = run_pending(options['batch_size'])
+            if done or failed or not options['loop']:
+                self.stdout.write("Ran {} tasks, {} failed.".format(done + failed, failed))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
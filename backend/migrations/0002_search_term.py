@@ -0,0 +1,59 @@
+# Generated by Django 2.2.10 on 2026-10-18 07:51
+
+import re
+from collections import Counter
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# A copy of backend.search as of this migration, so later changes to it don't change what this migration does
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TERM_LENGTH = 64
+TITLE_WEIGHT = 3
+
+
+def article_terms(article):
+    weights = Counter()
+    for weight, value in ((TITLE_WEIGHT, article.title), (1, article.text)):
+        for term in TOKEN_RE.findall(value.lower()):
+            if len(term) <= MAX_TERM_LENGTH:
+                weights[term] += weight
+    return weights
+
+
+def build_search_index(apps, schema_editor, batch_size=500):
+    Article = apps.get_model('backend', 'Article')
+    SearchTerm = apps.get_model('backend', 'SearchTerm')
+    entries = []
+    for article in Article.objects.only('id', 'title', 'text').iterator(chunk_size=batch_size):
+        entries.extend(
+            SearchTerm(term=term, article_id=article.pk, weight=weight)
+            for term, weight in article_terms(article).items()
+        )
+        if len(entries) >= batch_size:
+            SearchTerm.objects.bulk_create(entries, batch_size=batch_size)
+            entries = []
+    SearchTerm.objects.bulk_create(entries, batch_size=batch_size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField()),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='backend.Article')),
+            ],
+            options={
+                'unique_together': {('term', 'article')},
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
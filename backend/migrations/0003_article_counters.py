@@ -0,0 +1,44 @@
+# Generated by Django 2.2.10 on 2026-10-18 07:53
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_articles(apps, schema_editor):
+    Article = apps.get_model('backend', 'Article')
+    for model_name, related_field in (('Topic', 'topic'), ('User', 'user')):
+        model = apps.get_model('backend', model_name)
+        counts = Article.objects.values_list(related_field, 'status').annotate(total=Count('id')).order_by()
+        for pk, status, total in counts:
+            model.objects.filter(pk=pk).update(**{'{}_articles_count'.format(status): total})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0002_search_term'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='topic',
+            name='draft_articles_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='published_articles_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='draft_articles_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='published_articles_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_articles, migrations.RunPython.noop),
+    ]
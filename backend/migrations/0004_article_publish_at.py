@@ -0,0 +1,22 @@
+# Generated by Django 2.2.10 on 2026-10-18 08:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0003_article_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='publish_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['status', 'publish_at'], name='article_status_publish_at'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.10 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0005_user_name_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArticleTombstone',
+            fields=[
+                ('article_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['modified', 'id'], name='article_modified_id'),
+        ),
+        migrations.AddIndex(
+            model_name='articletombstone',
+            index=models.Index(fields=['modified', 'article_id'], name='tombstone_modified_id'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.10 on 2026-10-18 08:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0006_article_changes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='article',
+            name='title',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='topic',
+            name='title',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['created', 'id'], name='article_created_id'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['topic', 'status'], name='article_topic_status'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.10 on 2026-10-18 08:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0007_article_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArticleNorm',
+            fields=[
+                ('article', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='tfidf_norm', serialize=False, to='backend.Article')),
+                ('norm', models.FloatField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RelatedArticle',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_articles', to='backend.Article')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_to', to='backend.Article')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='relatedarticle',
+            index=models.Index(fields=['article', '-score'], name='related_article_score'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='relatedarticle',
+            unique_together={('article', 'related')},
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.10 on 2026-10-18 08:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0009_task_queue'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='searchterm',
+            index=models.Index(fields=['term', '-weight'], name='search_term_weight'),
+        ),
+    ]
@@ -1,42 +1,256 @@
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
-from .utils import ARTICLE_STATUS_CHOICES
+from .utils import ARTICLE_STATUS_CHOICES, chunks
 
 
 class User(AbstractUser):
-    first_name = models.CharField(max_length=255, blank=False)
-    last_name = models.CharField(max_length=255, blank=False)
+    # Indexed for the author search of the article admin
+    first_name = models.CharField(max_length=255, blank=False, db_index=True)
+    last_name = models.CharField(max_length=255, blank=False, db_index=True)
     email = models.EmailField(unique=True, blank=False)
+    # Denormalized article counters, maintained by backend.counters
+    draft_articles_count = models.PositiveIntegerField(default=0, editable=False)
+    published_articles_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.get_full_name()
 
+    @property
+    def articles_count(self):
+        return self.draft_articles_count + self.published_articles_count
+
 
 class Topic(models.Model):
-    title = models.CharField(max_length=255)
+    # Indexed for the exact-title lookup of TopicListSerializer.validate_title()
+    title = models.CharField(max_length=255, db_index=True)
+    # Denormalized article counters, maintained by backend.counters
+    draft_articles_count = models.PositiveIntegerField(default=0, editable=False)
+    published_articles_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.title
 
+    @property
+    def articles_count(self):
+        return self.draft_articles_count + self.published_articles_count
+
+
+class ArticleQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        from .signals import articles_bulk_created
+
+        objs = super().bulk_create(objs, *args, **kwargs)
+        articles_bulk_created.send(sender=self.model, articles=objs)
+        return objs
+
+    def due(self, now=None):
+        """
+        Drafts whose publish_at has come
+        """
+        return self.filter(status='draft', publish_at__lte=now or timezone.now())
+
+    def publish(self, ids=None):
+        """
+        Publishes the drafts among these articles (only the ones with the given ids, if any) with a
+        single UPDATE per chunk of them, instead of a save() per article, and clears their publish_at.
+        Returns the articles this call published, with only their id, topic, user and status loaded.
+        """
+        from .signals import articles_published
+
+        with transaction.atomic(using=self.db):
+            if ids is None:
+                ids = self.filter(status='draft').values_list('pk', flat=True)
+            now = timezone.now()
+            articles = []
+            for chunk in chunks(ids):
+                drafts = self.filter(pk__in=chunk)
+                # Drafts published meanwhile by someone else are left out of the UPDATE, which holds
+                # the changed rows until the commit. The modification time tells the ones it changed.
+                if drafts.filter(status='draft').update(status='published', modified=now, publish_at=None):
+                    articles.extend(drafts.filter(status='published', modified=now).only('id', 'topic_id', 'user_id', 'status'))
+            for article in articles:
+                article._old_counted_state = (article.topic_id, article.user_id, 'draft')
+                article._counted_state = article.counted_state()
+            articles_published.send(sender=self.model, articles=articles)
+        return articles
+
+    def schedule(self, publish_at):
+        """
+        Makes the drafts among these articles due at publish_at, returns how many there were
+        """
+        return self.filter(status='draft').update(publish_at=publish_at)
+
 
 # Replaced the suggested name of Post with Article due to possible confusion
 # for readers on Post with HTTP request of POST
 class Article(models.Model):
-    title = models.CharField(max_length=255)
+    # Indexed for the exact-title lookups that keep titles unique
+    title = models.CharField(max_length=255, db_index=True)
     text = models.TextField()
     status = models.CharField(max_length=255, choices=ARTICLE_STATUS_CHOICES, default='draft')
     topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name='articles')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='articles')
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
+    # Drafts get published by `./manage.py publish_scheduled_articles` once this time has come
+    publish_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ArticleQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Finds the due drafts without scanning the published articles
+            models.Index(fields=['status', 'publish_at'], name='article_status_publish_at'),
+            # Pages of the changes feed
+            models.Index(fields=['modified', 'id'], name='article_modified_id'),
+            # Pages of the article list, in the (created, id) order of KeysetCursorPagination
+            models.Index(fields=['created', 'id'], name='article_created_id'),
+            # Drafts/published articles of a topic, and the counters of reconcile_article_counters
+            models.Index(fields=['topic', 'status'], name='article_topic_status'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the counters were computed from, so that a later save() knows what changed
+        instance._counted_state = instance.counted_state()
+        return instance
+
+    def counted_state(self):
+        """
+        The (topic, user, status) an article is counted under, None if some of it wasn't loaded
+        """
+        loaded = self.__dict__
+        if any(name not in loaded for name in ('topic_id', 'user_id', 'status')):
+            return None
+        return self.topic_id, self.user_id, self.status
+
     def is_published(self):
         return self.status == 'published'
 
     def publish(self):
         self.status = 'published'
-        self.save()
\ No newline at end of file
+        self.publish_at = None
+        self.save(update_fields=['status', 'modified', 'publish_at'])
+
+
+class ArticleTombstone(models.Model):
+    """
+    Marks a deleted article in the changes feed until ARTICLE_TOMBSTONE_RETENTION_DAYS have passed
+    """
+    # The primary key of the deleted article, so that tombstones and articles share the (modified, pk) ordering
+    article_id = models.IntegerField(primary_key=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['modified', 'article_id'], name='tombstone_modified_id'),
+        ]
+
+    def __str__(self):
+        return 'Article {}'.format(self.article_id)
+
+    @staticmethod
+    def horizon(now=None):
+        """
+        Deletions before this time may have been forgotten
+        """
+        return (now or timezone.now()) - timedelta(days=getattr(settings, 'ARTICLE_TOMBSTONE_RETENTION_DAYS', 30))
+
+
+class SearchTerm(models.Model):
+    """
+    Inverted index entry: how much weight a term carries in a single article
+    """
+    term = models.CharField(max_length=64)
+    article = models.ForeignKey(Article, on_delete=models.CASCADE, related_name='search_terms')
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('term', 'article')
+        indexes = [
+            models.Index(fields=['term', '-weight'], name='search_term_weight'),
+        ]
+
+    def __str__(self):
+        return self.term
+
+
+class ArticleNorm(models.Model):
+    """
+    Length of an article's TF-IDF vector, see backend.related
+    """
+    article = models.OneToOneField(Article, on_delete=models.CASCADE, primary_key=True, related_name='tfidf_norm')
+    norm = models.FloatField()
+
+
+class RelatedArticle(models.Model):
+    """
+    One of the published articles most similar to an article, see backend.related
+    """
+    article = models.ForeignKey(Article, on_delete=models.CASCADE, related_name='related_articles')
+    related = models.ForeignKey(Article, on_delete=models.CASCADE, related_name='related_to')
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('article', 'related')
+        indexes = [
+            models.Index(fields=['article', '-score'], name='related_article_score'),
+        ]
+
+    def __str__(self):
+        return '{} -> {}'.format(self.article_id, self.related_id)
+
+
+class TaskQuerySet(models.QuerySet):
+    def due(self, now=None):
+        """
+        Tasks that a worker may take: queued ones whose time has come, and the ones of workers that
+        didn't finish them before their lock expired
+        """
+        now = now or timezone.now()
+        return self.filter(run_after__lte=now, failed_at__isnull=True).filter(
+            models.Q(locked_until__isnull=True) | models.Q(locked_until__lt=now)
+        )
+
+
+class Task(models.Model):
+    """
+    A job of the local task queue, see backend.tasks
+    """
+    name = models.CharField(max_length=255)
+    # JSON list of the arguments
+    args = models.TextField(default='[]')
+    # Hash of the name and arguments: the same job is only queued once until a worker takes it
+    key = models.CharField(max_length=40)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=32, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    # Set once TASK_MAX_ATTEMPTS attempts have failed, the task then stays for inspection
+    failed_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    objects = TaskQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run_after', 'id'], name='task_run_after_id'),
+            models.Index(fields=['locked_by'], name='task_locked_by'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['key'], condition=models.Q(locked_until__isnull=True, failed_at__isnull=True), name='task_queued_key'
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
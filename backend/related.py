@@ -0,0 +1,291 @@
+import heapq
+import math
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Article, ArticleNorm, RelatedArticle, SearchTerm
+from .tasks import task
+from .utils import chunks
+
+
+def get_related_count():
+    return getattr(settings, 'RELATED_ARTICLES_COUNT', 5)
+
+
+def get_terms_per_article():
+    return getattr(settings, 'RELATED_ARTICLES_TERMS', 25)
+
+
+def get_candidates_per_term():
+    return getattr(settings, 'RELATED_ARTICLES_CANDIDATES', 1000)
+
+
+def get_max_df(total):
+    # A term that only two articles have is never too common
+    return max(2, getattr(settings, 'RELATED_ARTICLES_MAX_DF', 0.5) * total)
+
+
+def document_frequencies(terms=None):
+    """
+    Returns a {term: number of articles} mapping for the given terms (all of them if None)
+    """
+    if terms is None:
+        return dict(SearchTerm.objects.values_list('term').annotate(df=Count('id')).order_by())
+    frequencies = {}
+    for chunk in chunks(terms):
+        frequencies.update(
+            SearchTerm.objects.filter(term__in=chunk).values_list('term').annotate(df=Count('id')).order_by()
+        )
+    return frequencies
+
+
+def tfidf(weights, frequencies, total):
+    """
+    Turns the {term: weight} index entries of an article into its TF-IDF vector, with the
+    same IDF as search_articles()
+    """
+    return {term: weight * math.log(1 + total / frequencies[term]) for term, weight in weights.items()}
+
+
+def norm(vector):
+    return math.sqrt(sum(weight * weight for weight in vector.values()))
+
+
+def linking_terms(vector, frequencies, max_df):
+    """
+    The [(term, weight)] of a vector that articles are compared on: the heaviest ones that other
+    articles have too, leaving out the ones most articles have
+    """
+    terms = [(term, weight) for term, weight in vector.items() if 1 < frequencies[term] <= max_df]
+    return heapq.nlargest(get_terms_per_article(), terms, key=itemgetter(1))
+
+
+def similarities(pk, terms, length, postings, norms):
+    """
+    Cosine similarity of an article to the articles in the {term: [(article id, weight)]} postings of its terms
+    """
+    scores = defaultdict(float)
+    for term, weight in terms:
+        for other, other_weight in postings.get(term, ()):
+            scores[other] += weight * other_weight
+    scores.pop(pk, None)
+    return {other: score / (length * norms[other]) for other, score in scores.items() if other in norms}
+
+
+def most_similar(scores, count):
+    # Ties go to the older article
+    return heapq.nlargest(count, scores.items(), key=lambda item: (item[1], -item[0]))
+
+
+def iter_vectors(frequencies, total, batch_size):
+    entries = SearchTerm.objects.order_by('article_id').values_list('article_id', 'term', 'weight')
+    for pk, group in groupby(entries.iterator(chunk_size=batch_size), key=itemgetter(0)):
+        yield pk, tfidf({term: weight for _, term, weight in group}, frequencies, total)
+
+
+def keep_heaviest(heap, pk, weight, limit):
+    """
+    Adds a posting of a term to the min-heap of the `limit` postings it weighs most in (ties go to
+    the older article), the ones articles are compared on, so that a common term doesn't compare an
+    article with most of the others
+    """
+    if len(heap) < limit:
+        heapq.heappush(heap, (weight, -pk))
+    else:
+        heapq.heappushpop(heap, (weight, -pk))
+
+
+def rebuild_related(batch_size=500):
+    """
+    Recomputes the related articles of every article from the search index, along with the vector
+    lengths that update_related() relies on. Returns the number of articles.
+    The lists are replaced `batch_size` articles at a time, each batch in a transaction of its own,
+    so the API keeps serving the old lists of the others (and writers aren't locked out) meanwhile.
+    """
+    from .signals import related_articles_rebuilt
+
+    count = get_related_count()
+    total = Article.objects.count()
+    max_df = get_max_df(total)
+    frequencies = document_frequencies()
+    published = set(Article.objects.filter(status='published').values_list('pk', flat=True))
+
+    # First pass: the lengths of all the vectors, and the term postings of the published articles
+    norms = {}
+    postings = defaultdict(list)
+    limit = get_candidates_per_term()
+    for pk, vector in iter_vectors(frequencies, total, batch_size):
+        norms[pk] = norm(vector)
+        if pk in published:
+            for term, weight in vector.items():
+                if 1 < frequencies[term] <= max_df:
+                    keep_heaviest(postings[term], pk, weight, limit)
+    postings = {term: [(-pk, weight) for weight, pk in heap] for term, heap in postings.items()}
+
+    for batch in chunks(norms.items(), batch_size):
+        with transaction.atomic():
+            for chunk in chunks(pk for pk, _ in batch):
+                ArticleNorm.objects.filter(article_id__in=chunk).delete()
+            ArticleNorm.objects.bulk_create([ArticleNorm(article_id=pk, norm=length) for pk, length in batch])
+
+    # Second pass: every article against the postings of its linking terms
+    batch, related = [], []
+    for pk, vector in iter_vectors(frequencies, total, batch_size):
+        scores = similarities(pk, linking_terms(vector, frequencies, max_df), norms[pk], postings, norms)
+        batch.append(pk)
+        related.extend(
+            RelatedArticle(article_id=pk, related_id=other, score=score)
+            for other, score in most_similar(scores, count)
+        )
+        if len(batch) >= batch_size:
+            replace_related(batch, related)
+            batch, related = [], []
+    replace_related(batch, related)
+
+    # Articles without any terms (left) have no related articles
+    with transaction.atomic():
+        indexed = SearchTerm.objects.values('article_id')
+        ArticleNorm.objects.exclude(article_id__in=indexed).delete()
+        RelatedArticle.objects.exclude(article_id__in=indexed).delete()
+    related_articles_rebuilt.send(sender=RelatedArticle)
+    return len(norms)
+
+
+def replace_related(pks, related):
+    with transaction.atomic():
+        for chunk in chunks(pks):
+            RelatedArticle.objects.filter(article_id__in=chunk).delete()
+        RelatedArticle.objects.bulk_create(related)
+
+
+def load_vectors(pks, total):
+    """
+    Returns the {article id: TF-IDF vector} of the given articles, and the {term: number of articles}
+    of their terms
+    """
+    entries = defaultdict(dict)
+    for chunk in chunks(pks):
+        for pk, term, weight in SearchTerm.objects.filter(article_id__in=chunk).values_list('article_id', 'term', 'weight'):
+            entries[pk][term] = weight
+    frequencies = document_frequencies({term for weights in entries.values() for term in weights})
+    return {pk: tfidf(weights, frequencies, total) for pk, weights in entries.items()}, frequencies
+
+
+def find_related(pk, vector, frequencies, total, max_df):
+    """
+    The {article id: similarity} of the published articles that share a linking term with article `pk`
+    """
+    terms = linking_terms(vector, frequencies, max_df)
+    postings = {}
+    for term, _ in terms:
+        candidates = SearchTerm.objects.filter(term=term, article__status='published').order_by('-weight', 'article_id')
+        idf = math.log(1 + total / frequencies[term])
+        postings[term] = [
+            (other, weight * idf)
+            for other, weight in candidates.values_list('article_id', 'weight')[:get_candidates_per_term()]
+        ]
+    others = {other for term in postings.values() for other, _ in term}
+    norms = {}
+    for chunk in chunks(others):
+        norms.update(ArticleNorm.objects.filter(article_id__in=chunk).values_list('article_id', 'norm'))
+    return similarities(pk, terms, norm(vector), postings, norms)
+
+
+@task
+def update_related(pks):
+    """
+    Recomputes the related articles of the given articles after their text or status changed, and
+    moves them in or out of the related articles of the others. The lists they leave are refilled
+    with the next most similar articles. The vectors of the other articles keep the document
+    frequencies of the last rebuild_related().
+    """
+    from .signals import related_articles_updated
+
+    pks = set(pks)
+    count = get_related_count()
+    with transaction.atomic():
+        total = Article.objects.count()
+        max_df = get_max_df(total)
+        published = set()
+        refilled = set()
+        for chunk in chunks(pks):
+            published.update(Article.objects.filter(pk__in=chunk, status='published').values_list('pk', flat=True))
+            refilled.update(RelatedArticle.objects.filter(related_id__in=chunk).values_list('article_id', flat=True))
+        refilled -= pks
+        vectors, frequencies = load_vectors(pks, total)
+
+        # The articles leave every list, and get back into the ones they are still close enough to
+        for chunk in chunks(pks):
+            ArticleNorm.objects.filter(article_id__in=chunk).delete()
+            RelatedArticle.objects.filter(article_id__in=chunk).delete()
+            RelatedArticle.objects.filter(related_id__in=chunk).delete()
+        ArticleNorm.objects.bulk_create([ArticleNorm(article_id=pk, norm=norm(vector)) for pk, vector in vectors.items()])
+
+        for pk, vector in vectors.items():
+            scores = find_related(pk, vector, frequencies, total, max_df)
+            RelatedArticle.objects.bulk_create([
+                RelatedArticle(article_id=pk, related_id=other, score=score)
+                for other, score in most_similar(scores, count)
+            ])
+            if pk in published:
+                # The lists of the other updated articles already take this one into account, and
+                # the refilled ones will
+                join_related({other: score for other, score in scores.items() if other not in pks | refilled}, pk, count)
+        fill_related(refilled, total, max_df, count)
+    # Runs in the task worker, after the save that queued it has expired the cached responses
+    related_articles_updated.send(sender=RelatedArticle, articles=sorted(pks | refilled))
+
+
+@task
+def refill_related(pks):
+    """
+    Recomputes the related articles of the given articles (after one of them was deleted), leaving
+    the lists of the others as they are
+    """
+    from .signals import related_articles_updated
+
+    count = get_related_count()
+    with transaction.atomic():
+        total = Article.objects.count()
+        fill_related(set(pks), total, get_max_df(total), count)
+    related_articles_updated.send(sender=RelatedArticle, articles=sorted(pks))
+
+
+def fill_related(pks, total, max_df, count):
+    vectors, frequencies = load_vectors(pks, total)
+    related = [
+        RelatedArticle(article_id=pk, related_id=other, score=score)
+        for pk, vector in vectors.items()
+        for other, score in most_similar(find_related(pk, vector, frequencies, total, max_df), count)
+    ]
+    replace_related(pks, related)
+
+
+def join_related(scores, pk, count):
+    """
+    Adds article `pk` to the related articles of the {article id: similarity} it beats one of, or
+    that have fewer than `count`
+    """
+    for chunk in chunks(scores):
+        lists = defaultdict(list)
+        for article_id, related_id, score in RelatedArticle.objects.filter(article_id__in=chunk).values_list(
+            'article_id', 'related_id', 'score'
+        ):
+            lists[article_id].append((score, -related_id))
+        joined, dropped = [], []
+        for other in chunk:
+            if len(lists[other]) < count:
+                joined.append(RelatedArticle(article_id=other, related_id=pk, score=scores[other]))
+            else:
+                weakest = min(lists[other])
+                if (scores[other], -pk) > weakest:
+                    joined.append(RelatedArticle(article_id=other, related_id=pk, score=scores[other]))
+                    dropped.append((other, -weakest[1]))
+        for article_id, related_id in dropped:
+            RelatedArticle.objects.filter(article_id=article_id, related_id=related_id).delete()
+        RelatedArticle.objects.bulk_create(joined)
@@ -0,0 +1,125 @@
+import math
+import re
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, Count, ExpressionWrapper, F, FloatField, Sum, Value, When
+
+from .models import Article, SearchTerm
+from .utils import BATCH_SIZE, chunks, estimated_count
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TERM_LENGTH = 64
+# A word in the title says more about an article than the same word in its body
+TITLE_WEIGHT = 3
+
+
+def tokenize(value):
+    """
+    Splits a text into lowercase terms, dropping ones too long to be indexed
+    """
+    return [term for term in TOKEN_RE.findall(value.lower()) if len(term) <= MAX_TERM_LENGTH]
+
+
+def article_terms(article):
+    """
+    Returns a {term: weight} mapping for an article's title and text
+    """
+    weights = Counter()
+    for term in tokenize(article.title):
+        weights[term] += TITLE_WEIGHT
+    for term in tokenize(article.text):
+        weights[term] += 1
+    return weights
+
+
+def index_article(article):
+    """
+    Replaces the index entries of a single article
+    """
+    index_articles([article])
+
+
+def index_articles(articles, batch_size=BATCH_SIZE):
+    """
+    Replaces the index entries of the given (saved) articles
+    """
+    with transaction.atomic():
+        for chunk in chunks(article.pk for article in articles):
+            SearchTerm.objects.filter(article_id__in=chunk).delete()
+        SearchTerm.objects.bulk_create([
+            SearchTerm(term=term, article_id=article.pk, weight=weight)
+            for article in articles
+            for term, weight in article_terms(article).items()
+        ], batch_size=batch_size)
+
+
+def rebuild_index(batch_size=BATCH_SIZE):
+    """
+    Drops and re-creates the whole index. Returns the number of indexed articles.
+    """
+    from .signals import search_index_rebuilt
+
+    indexed = 0
+    with transaction.atomic():
+        SearchTerm.objects.all().delete()
+        entries = []
+        for article in Article.objects.only('id', 'title', 'text').iterator(chunk_size=batch_size):
+            entries.extend(
+                SearchTerm(term=term, article_id=article.pk, weight=weight)
+                for term, weight in article_terms(article).items()
+            )
+            indexed += 1
+            if len(entries) >= batch_size:
+                SearchTerm.objects.bulk_create(entries, batch_size=batch_size)
+                entries = []
+        SearchTerm.objects.bulk_create(entries, batch_size=batch_size)
+    search_index_rebuilt.send(sender=SearchTerm)
+    return indexed
+
+
+def matching_article_ids(query):
+    """
+    Subquery of the ids of the articles containing every term of the query, None if the query has no terms
+    """
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return None
+    return SearchTerm.objects.filter(term__in=terms).values('article_id').annotate(
+        search_matches=Count('id')
+    ).filter(search_matches=len(terms)).values('article_id')
+
+
+def search_articles(queryset, query):
+    """
+    Narrows an Article queryset down to the articles containing every term of the query,
+    annotated with a TF-IDF `search_rank` and ordered by it (best match first).
+    """
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return queryset
+
+    # The IDF only needs the order of magnitude of the table size, not a COUNT(*) over all of it
+    total = estimated_count(Article)
+    frequencies = dict(
+        SearchTerm.objects.filter(term__in=terms).values_list('term').annotate(df=Count('id'))
+    )
+    if len(frequencies) < len(terms):
+        # At least one of the terms is not in any article
+        return queryset.none()
+
+    rank = Sum(Case(
+        *[
+            When(search_terms__term=term, then=ExpressionWrapper(
+                F('search_terms__weight') * Value(math.log(1 + total / frequencies[term])),
+                output_field=FloatField()
+            ))
+            for term in terms
+        ],
+        default=Value(0.0),
+        output_field=FloatField()
+    ))
+    return queryset.filter(search_terms__term__in=terms).annotate(
+        search_matches=Count('search_terms'),
+        search_rank=rank,
+    ).filter(search_matches=len(terms)).order_by('-search_rank', 'id')
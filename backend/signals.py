@@ -0,0 +1,103 @@
+from collections import Counter
+
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+
+from .models import Article, ArticleTombstone, RelatedArticle
+from . import counters, related, search, tasks
+
+# Sent by Article.objects.bulk_create(), which doesn't send post_save for the new rows
+articles_bulk_created = Signal(providing_args=['articles'])
+# Sent by Article.objects.publish(), which updates the drafts without save(). The articles
+# come with their previous state in _old_counted_state.
+articles_published = Signal(providing_args=['articles'])
+# Sent after the whole search index has been rebuilt
+search_index_rebuilt = Signal()
+# Sent after the related articles of all articles have been recomputed
+related_articles_rebuilt = Signal()
+# Sent after the related articles of some articles (and of the ones they are related to) have been recomputed
+related_articles_updated = Signal(providing_args=['articles'])
+
+COUNTED_FIELDS = {'topic', 'topic_id', 'user', 'user_id', 'status'}
+
+
+@receiver(post_save, sender=Article)
+def update_search_index(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not {'title', 'text'} & set(update_fields):
+        return
+    search.index_article(instance)
+
+
+@receiver(post_save, sender=Article)
+def update_related_articles(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Reads the search index, which update_search_index() has brought up to date
+    if raw:
+        return
+    if update_fields is not None and not {'title', 'text', 'status'} & set(update_fields):
+        return
+    tasks.enqueue(related.update_related, [instance.pk])
+
+
+@receiver(pre_save, sender=Article)
+def remember_counted_state(sender, instance, update_fields=None, raw=False, **kwargs):
+    instance.__dict__.pop('_old_counted_state', None)
+    if update_fields is not None and not COUNTED_FIELDS & set(update_fields):
+        return
+    old_state = getattr(instance, '_counted_state', None)
+    if old_state is None and instance.pk is not None and (raw or not instance._state.adding):
+        old_state = Article.objects.filter(pk=instance.pk).values_list('topic_id', 'user_id', 'status').first()
+    instance._old_counted_state = old_state
+
+
+@receiver(post_save, sender=Article)
+def update_article_counters(sender, instance, update_fields=None, **kwargs):
+    if not hasattr(instance, '_old_counted_state'):
+        return
+    new_state = (instance.topic_id, instance.user_id, instance.status)
+    counters.apply_deltas(counters.changed_deltas(instance._old_counted_state, new_state))
+    instance._counted_state = new_state
+
+
+@receiver(articles_bulk_created)
+def increase_article_counters(sender, articles, **kwargs):
+    counters.apply_deltas(counters.created_deltas(articles))
+
+
+@receiver(articles_published)
+def move_published_article_counters(sender, articles, **kwargs):
+    deltas = Counter()
+    for article in articles:
+        deltas.update(counters.changed_deltas(article._old_counted_state, article.counted_state()))
+    counters.apply_deltas(deltas)
+
+
+@receiver(articles_published)
+def add_published_related_articles(sender, articles, **kwargs):
+    tasks.enqueue(related.update_related, [article.pk for article in articles])
+
+
+@receiver(post_delete, sender=Article)
+def decrease_article_counters(sender, instance, **kwargs):
+    state = (instance.topic_id, instance.user_id, instance.status)
+    counters.apply_deltas(counters.changed_deltas(state, None))
+
+
+@receiver(pre_delete, sender=Article)
+def remember_related_lists(sender, instance, **kwargs):
+    # The rows go with the article, before post_delete
+    instance._related_to = list(RelatedArticle.objects.filter(related=instance).values_list('article_id', flat=True))
+
+
+@receiver(post_delete, sender=Article)
+def refill_related_articles(sender, instance, **kwargs):
+    # The articles the deleted one was related to get their next most similar article instead
+    if getattr(instance, '_related_to', None):
+        tasks.enqueue(related.refill_related, instance._related_to)
+
+
+@receiver(post_delete, sender=Article)
+def leave_tombstone(sender, instance, **kwargs):
+    # Tells the clients of the changes feed about the deletion
+    ArticleTombstone(article_id=instance.pk).save()
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import logging
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# Functions that may be queued, by name
+registry = {}
+
+
+def get_max_attempts():
+    return getattr(settings, 'TASK_MAX_ATTEMPTS', 5)
+
+
+def task(function):
+    """
+    Registers a function with the task queue, see enqueue()
+    """
+    registry['{}.{}'.format(function.__module__, function.__name__)] = function
+    return function
+
+
+def task_name(function):
+    name = '{}.{}'.format(function.__module__, function.__name__)
+    if registry.get(name) is not function:
+        raise ValueError("{} is not a registered task.".format(name))
+    return name
+
+
+def enqueue(function, *args):
+    """
+    Queues a call of a @task function for the `run_tasks` worker, once the current transaction
+    commits (and not at all if it rolls back). A call that is already queued isn't queued again.
+    The arguments must be JSON serializable. With TASKS_EAGER the function runs right away.
+    """
+    name, args = task_name(function), json.dumps(args)
+    if getattr(settings, 'TASKS_EAGER', False):
+        function(*json.loads(args))
+        return
+    transaction.on_commit(lambda: add_task(name, args))
+
+
+def add_task(name, args):
+    key = hashlib.sha1('{}:{}'.format(name, args).encode()).hexdigest()
+    try:
+        with transaction.atomic():
+            Task.objects.create(name=name, args=args, key=key)
+    except IntegrityError:
+        # Already queued
+        pass
+
+
+def claim(batch_size, now=None):
+    """
+    Locks up to `batch_size` due tasks for this worker, oldest first, and returns them
+    """
+    now = now or timezone.now()
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        ids = list(Task.objects.due(now).order_by('run_after', 'id').values_list('pk', flat=True)[:batch_size])
+        # Another worker may have taken some of them meanwhile
+        Task.objects.due(now).filter(pk__in=ids).update(
+            locked_by=token, locked_until=now + timedelta(seconds=getattr(settings, 'TASK_LOCK_TIMEOUT', 300))
+        )
+    return list(Task.objects.filter(locked_by=token).order_by('run_after', 'id'))
+
+
+def run_task(job):
+    """
+    Runs a claimed task in a transaction of its own. Returns whether it succeeded; failed tasks are
+    retried after TASK_RETRY_DELAY seconds, twice that the next time, and so on.
+    """
+    try:
+        function = registry[job.name]
+        with transaction.atomic():
+            function(*json.loads(job.args))
+    except Exception:
+        logger.exception("Task %s failed", job.name)
+        retry(job, traceback.format_exc())
+        return False
+    Task.objects.filter(pk=job.pk, locked_by=job.locked_by).delete()
+    return True
+
+
+def retry(job, error):
+    now = timezone.now()
+    attempts = job.attempts + 1
+    changes = {'attempts': attempts, 'error': error, 'locked_by': '', 'locked_until': None}
+    if attempts >= get_max_attempts():
+        changes['failed_at'] = now
+    else:
+        changes['run_after'] = now + timedelta(seconds=getattr(settings, 'TASK_RETRY_DELAY', 10) * 2 ** (attempts - 1))
+    try:
+        with transaction.atomic():
+            Task.objects.filter(pk=job.pk, locked_by=job.locked_by).update(**changes)
+    except IntegrityError:
+        # The same call was queued again meanwhile, and runs with the latest data
+        Task.objects.filter(pk=job.pk, locked_by=job.locked_by).delete()
+
+
+def run_pending(batch_size=100):
+    """
+    Runs the due tasks, `batch_size` at a time, until there are none left. Returns the number of
+    tasks that succeeded and failed.
+    """
+    done = failed = 0
+    while True:
+        jobs = claim(batch_size)
+        if not jobs:
+            return done, failed
+        for job in jobs:
+            if run_task(job):
+                done += 1
+            else:
+                failed += 1
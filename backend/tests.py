@@ -0,0 +1,407 @@
+import re
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from freezegun import freeze_time
+
+from backend.admin import EstimatedCountPaginator
+from backend import tasks
+from backend.models import User, Article, ArticleQuerySet, RelatedArticle, Task, Topic
+from backend.related import rebuild_related, update_related
+from backend.search import rebuild_index
+from backend.utils import estimated_count
+
+task_calls = []
+
+
+@tasks.task
+def record_task_call(value):
+    task_calls.append(value)
+    if value == 'fail':
+        raise ValueError(value)
+
+
+class TestArticleCounters(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.topic1 = Topic.objects.create(title="Topic title 1")
+        cls.topic2 = Topic.objects.create(title="Topic title 2")
+
+    def assertCounters(self, obj, draft, published):
+        obj.refresh_from_db()
+        self.assertEqual((obj.draft_articles_count, obj.published_articles_count), (draft, published))
+
+    def create_article(self, **kwargs):
+        data = {'title': "Article title", 'text': "Article text", 'user': self.user, 'topic': self.topic1}
+        data.update(kwargs)
+        return Article.objects.create(**data)
+
+    def test_create_and_delete(self):
+        article = self.create_article()
+        self.create_article(status='published')
+        self.assertCounters(self.topic1, 1, 1)
+        self.assertCounters(self.user, 1, 1)
+
+        article.delete()
+        self.assertCounters(self.topic1, 0, 1)
+        self.assertCounters(self.user, 0, 1)
+
+    def test_topic_change(self):
+        article = self.create_article()
+        article.topic = self.topic2
+        article.save()
+        self.assertCounters(self.topic1, 0, 0)
+        self.assertCounters(self.topic2, 1, 0)
+
+        # An instance that was loaded from the database knows its previous state as well
+        article = Article.objects.get(pk=article.pk)
+        article.topic = self.topic1
+        article.save()
+        self.assertCounters(self.topic1, 1, 0)
+        self.assertCounters(self.topic2, 0, 0)
+
+    def test_publish(self):
+        article = self.create_article()
+        article.publish()
+        self.assertCounters(self.topic1, 0, 1)
+        self.assertCounters(self.user, 0, 1)
+
+    def test_bulk_create(self):
+        Article.objects.bulk_create([
+            Article(title="Article title 1", text="Article text 1", user=self.user, topic=self.topic1),
+            Article(title="Article title 2", text="Article text 2", user=self.user, topic=self.topic2, status='published'),
+        ])
+        self.assertCounters(self.topic1, 1, 0)
+        self.assertCounters(self.topic2, 0, 1)
+        self.assertCounters(self.user, 1, 1)
+
+    def test_queryset_publish(self):
+        drafts = [self.create_article(title="Article title 1"), self.create_article(title="Article title 2", topic=self.topic2)]
+        published = self.create_article(title="Article title 3", status='published')
+        with CaptureQueriesContext(connection) as context:
+            articles = Article.objects.filter(pk__in=[draft.pk for draft in drafts] + [published.pk]).publish()
+        self.assertEqual(sorted(article.pk for article in articles), sorted(draft.pk for draft in drafts))
+        self.assertEqual(len([query for query in context.captured_queries
+                              if query['sql'].startswith('UPDATE "backend_article"')]), 1)
+        self.assertEqual(Article.objects.filter(status='published').count(), 3)
+        self.assertCounters(self.topic1, 0, 2)
+        self.assertCounters(self.topic2, 0, 1)
+        self.assertCounters(self.user, 0, 3)
+
+    def test_cascading_delete(self):
+        topic = Topic.objects.create(title="Topic title 3")
+        self.create_article()
+        self.create_article(topic=topic)
+        topic.delete()
+        self.assertCounters(self.user, 1, 0)
+
+    def test_drifted_counters_stop_at_zero(self):
+        article = self.create_article()
+        Topic.objects.filter(pk=self.topic1.pk).update(draft_articles_count=0)
+        article.delete()
+        self.assertCounters(self.topic1, 0, 0)
+        self.assertCounters(self.user, 0, 0)
+
+    def test_reconcile_command(self):
+        self.create_article()
+        self.create_article(status='published')
+        Topic.objects.filter(pk=self.topic1.pk).update(draft_articles_count=10, published_articles_count=0)
+
+        out = StringIO()
+        call_command('reconcile_article_counters', stdout=out)
+        self.assertIn("Repaired counters of 1 topics/users.", out.getvalue())
+        self.assertCounters(self.topic1, 1, 1)
+        self.assertCounters(self.user, 1, 1)
+
+
+class TestScheduledPublishing(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.topic = Topic.objects.create(title="Topic title 1")
+
+    def test_publish_scheduled_articles_command(self):
+        with freeze_time("2020-01-01 12:00:00"):
+            now = timezone.now()
+            due = [
+                Article.objects.create(title="Article title {}".format(number), text="Article text", user=self.user,
+                                       topic=self.topic, publish_at=now - timedelta(minutes=number))
+                for number in range(3)
+            ]
+            later = Article.objects.create(title="Article title later", text="Article text", user=self.user,
+                                           topic=self.topic, publish_at=now + timedelta(hours=1))
+            unscheduled = Article.objects.create(title="Article title draft", text="Article text", user=self.user,
+                                                 topic=self.topic)
+
+            out = StringIO()
+            call_command('publish_scheduled_articles', batch_size=2, stdout=out)
+        self.assertIn("Published 3 scheduled articles.", out.getvalue())
+        self.assertEqual(set(Article.objects.filter(status='published')), set(due))
+        self.assertEqual(set(Article.objects.filter(status='draft')), {later, unscheduled})
+        self.topic.refresh_from_db()
+        self.assertEqual((self.topic.draft_articles_count, self.topic.published_articles_count), (2, 3))
+
+    def test_concurrent_publishing_counts_once(self):
+        drafts = [
+            Article.objects.create(title="Article title {}".format(number), text="Article text", user=self.user,
+                                   topic=self.topic, publish_at=timezone.now())
+            for number in range(3)
+        ]
+        update = ArticleQuerySet.update
+
+        def publish_first_elsewhere(queryset, **kwargs):
+            if kwargs.get('status') == 'published':
+                # Another process publishes a draft between the read and the UPDATE
+                with connection.cursor() as cursor:
+                    cursor.execute("UPDATE backend_article SET status = 'published' WHERE id = %s", [drafts[0].pk])
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(ArticleQuerySet, 'update', autospec=True, side_effect=publish_first_elsewhere):
+            published = Article.objects.filter(pk__in=[draft.pk for draft in drafts]).publish()
+        self.assertEqual({article.pk for article in published}, {drafts[1].pk, drafts[2].pk})
+        # The other process's UPDATE bypassed the counters
+        self.topic.refresh_from_db()
+        self.assertEqual((self.topic.draft_articles_count, self.topic.published_articles_count), (1, 2))
+        self.assertFalse(Article.objects.due().exists())
+        self.assertFalse(Article.objects.filter(pk__in=[drafts[1].pk, drafts[2].pk], publish_at__isnull=False).exists())
+
+
+@override_settings(TASKS_EAGER=True)
+class TestRelatedArticles(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        cls.topic = Topic.objects.create(title="Topic title 1")
+        texts = {
+            'signals': ("Django signals", "django signals receivers connect"),
+            'tips': ("Django signals tips", "signals receivers in django"),
+            'bread': ("Baking bread", "flour water yeast bread"),
+            'sourdough': ("Sourdough bread", "flour starter bread"),
+            'garden': ("Gardening", "tomatoes soil"),
+        }
+        cls.articles = {
+            name: Article.objects.create(title=title, text=text, status='published', user=cls.user, topic=cls.topic)
+            for name, (title, text) in texts.items()
+        }
+
+    def related(self, name):
+        pks = RelatedArticle.objects.filter(article=self.articles[name]).order_by('-score').values_list('related_id', flat=True)
+        names = {article.pk: name for name, article in self.articles.items()}
+        return [names[pk] for pk in pks]
+
+    def test_saves_keep_the_related_articles_up_to_date(self):
+        self.assertEqual(self.related('signals'), ['tips'])
+        self.assertEqual(self.related('bread'), ['sourdough'])
+        self.assertEqual(self.related('garden'), [])
+
+        # Drafts have related articles but aren't one
+        tips = self.articles['tips']
+        tips.status = 'draft'
+        tips.save()
+        self.assertEqual(self.related('signals'), [])
+        self.assertEqual(self.related('tips'), ['signals'])
+        Article.objects.get(pk=tips.pk).publish()
+        self.assertEqual(self.related('signals'), ['tips'])
+
+        garden = self.articles['garden']
+        garden.text = "yeast and starter from the garden"
+        garden.save()
+        self.assertCountEqual(self.related('garden'), ['bread', 'sourdough'])
+        self.assertCountEqual(self.related('sourdough'), ['bread', 'garden'])
+
+        Article.objects.filter(pk=self.articles['bread'].pk).delete()
+        self.assertEqual(self.related('sourdough'), ['garden'])
+
+    @override_settings(RELATED_ARTICLES_COUNT=1)
+    def test_bulk_publishing_adds_the_articles(self):
+        sourdough = self.articles['sourdough']
+        draft = Article.objects.create(title="Sourdough starter", text="flour starter", user=self.user, topic=self.topic)
+        self.assertEqual(self.related('sourdough'), ['bread'])
+        Article.objects.filter(pk=draft.pk).publish()
+        # More similar than the one it replaces
+        self.assertEqual(list(sourdough.related_articles.values_list('related_id', flat=True)), [draft.pk])
+
+    @override_settings(RELATED_ARTICLES_COUNT=1)
+    def test_lists_are_refilled(self):
+        sourdough = self.articles['sourdough']
+        starter = Article.objects.create(
+            title="Starter", text="flour starter", status='published', user=self.user, topic=self.topic
+        )
+        closest = sourdough.related_articles.get().related
+        # The next most similar article takes the place of one that is no longer published, or deleted
+        Article.objects.filter(pk=closest.pk).update(status='draft')
+        update_related([closest.pk])
+        following = sourdough.related_articles.get().related
+        self.assertIn(following.pk, {starter.pk, self.articles['bread'].pk} - {closest.pk})
+        following.delete()
+        self.assertEqual(list(sourdough.related_articles.all()), [])
+        Article.objects.filter(pk=closest.pk).update(status='published')
+        update_related([closest.pk])
+        self.assertEqual(sourdough.related_articles.get().related, closest)
+
+    @override_settings(RELATED_ARTICLES_CANDIDATES=1)
+    def test_articles_are_compared_with_the_heaviest_postings_of_a_term(self):
+        bread = self.articles['bread']
+        heavy = Article.objects.create(
+            title="Bread bread bread", text="bread flour bread", status='published', user=self.user, topic=self.topic
+        )
+        # Only the article the shared terms weigh most in is a candidate, not the sourdough one
+        update_related([bread.pk])
+        self.assertEqual(list(bread.related_articles.values_list('related_id', flat=True)), [heavy.pk])
+        RelatedArticle.objects.all().delete()
+        rebuild_related()
+        self.assertEqual(list(bread.related_articles.values_list('related_id', flat=True)), [heavy.pk])
+
+    @override_settings(RELATED_ARTICLES_COUNT=1)
+    def test_rebuild_matches_the_incremental_updates(self):
+        incremental = set(RelatedArticle.objects.values_list('article_id', 'related_id'))
+        RelatedArticle.objects.all().delete()
+        self.assertEqual(rebuild_related(batch_size=2), 5)
+        self.assertEqual(set(RelatedArticle.objects.values_list('article_id', 'related_id')), incremental)
+
+        out = StringIO()
+        call_command('build_related_articles', stdout=out)
+        self.assertIn("Found the related articles of 5 articles.", out.getvalue())
+        self.assertEqual(self.related('signals'), ['tips'])
+
+
+class TestTaskQueue(TransactionTestCase):
+    def setUp(self):
+        task_calls.clear()
+
+    def test_tasks_are_queued_on_commit(self):
+        with transaction.atomic():
+            tasks.enqueue(record_task_call, 'a')
+            tasks.enqueue(record_task_call, 'a')
+            tasks.enqueue(record_task_call, 'b')
+            self.assertFalse(Task.objects.exists())
+        with self.assertRaises(ValueError), transaction.atomic():
+            tasks.enqueue(record_task_call, 'c')
+            raise ValueError
+        # Calls that are already queued aren't queued again
+        tasks.enqueue(record_task_call, 'a')
+        self.assertEqual(Task.objects.count(), 2)
+
+        self.assertEqual(tasks.run_pending(batch_size=1), (2, 0))
+        self.assertEqual(task_calls, ['a', 'b'])
+        self.assertFalse(Task.objects.exists())
+        with self.assertRaises(ValueError):
+            tasks.enqueue(len, 'a')
+
+    @override_settings(TASK_MAX_ATTEMPTS=2, TASK_RETRY_DELAY=10)
+    def test_failed_tasks_are_retried(self):
+        with freeze_time("2020-03-01 10:00:00") as frozen:
+            tasks.enqueue(record_task_call, 'fail')
+            with self.assertLogs('backend.tasks', 'ERROR'):
+                self.assertEqual(tasks.run_pending(), (0, 1))
+            task = Task.objects.get()
+            self.assertEqual((task.attempts, task.failed_at), (1, None))
+            self.assertIn('ValueError: fail', task.error)
+            self.assertEqual(tasks.run_pending(), (0, 0))
+
+            frozen.tick(timedelta(seconds=10))
+            with self.assertLogs('backend.tasks', 'ERROR'):
+                self.assertEqual(tasks.run_pending(), (0, 1))
+            self.assertEqual(Task.objects.get().failed_at, timezone.now())
+            frozen.tick(timedelta(hours=1))
+            self.assertEqual(tasks.run_pending(), (0, 0))
+            # A failed task doesn't keep the call from being queued again
+            tasks.enqueue(record_task_call, 'fail')
+            self.assertEqual(Task.objects.count(), 2)
+        self.assertEqual(task_calls, ['fail', 'fail'])
+
+    @override_settings(TASK_LOCK_TIMEOUT=300)
+    def test_tasks_of_stuck_workers_are_taken_over(self):
+        with freeze_time("2020-03-01 10:00:00") as frozen:
+            tasks.enqueue(record_task_call, 'a')
+            self.assertEqual(len(tasks.claim(10)), 1)
+            self.assertEqual(tasks.claim(10), [])
+            # Queued again while running
+            tasks.enqueue(record_task_call, 'a')
+            self.assertEqual(Task.objects.count(), 2)
+            frozen.tick(timedelta(seconds=301))
+            self.assertEqual(len(tasks.claim(10)), 2)
+
+    def test_saves_queue_the_related_article_updates(self):
+        user = User.objects.create_user(username='username', email='email@gom.com', password='password')
+        topic = Topic.objects.create(title="Topic title 1")
+        first, second = [
+            Article.objects.create(title=title, text="flour starter", status='published', user=user, topic=topic)
+            for title in ("Sourdough", "Bread")
+        ]
+        self.assertFalse(RelatedArticle.objects.exists())
+        out = StringIO()
+        call_command('run_tasks', stdout=out)
+        self.assertIn("Ran 2 tasks, 0 failed.", out.getvalue())
+        self.assertEqual(list(first.related_articles.values_list('related_id', flat=True)), [second.pk])
+        self.assertEqual(list(second.related_articles.values_list('related_id', flat=True)), [first.pk])
+
+
+class TestArticleAdmin(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', email='admin@gom.com', password='password')
+        cls.users = [
+            User.objects.create_user(username='writer{}'.format(number), email='writer{}@gom.com'.format(number),
+                                     password='password', first_name='First{}'.format(number), last_name='Last{}'.format(number))
+            for number in range(3)
+        ]
+        cls.topics = [Topic.objects.create(title="Topic title {}".format(number)) for number in range(3)]
+        for number in range(6):
+            Article.objects.create(title="Article title {}".format(number), text="Some long text " * 20 + str(number),
+                                   user=cls.users[number % 3], topic=cls.topics[number % 3])
+        rebuild_index()
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def changelist(self, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('admin:backend_article_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, context.captured_queries
+
+    def test_changelist(self):
+        response, queries = self.changelist()
+        self.assertEqual(response.context['cl'].result_count, 6)
+        self.assertContains(response, "Some long text Some long text")
+        self.assertNotContains(response, "Some long text 0")
+        article_queries = [query['sql'] for query in queries if 'FROM "backend_article"' in query['sql']]
+        # The size estimate, the count and the page, without a query per row for the topics and users
+        self.assertEqual(len(article_queries), 3)
+        self.assertFalse(any('SUBSTR' in sql for sql in article_queries if 'COUNT(*)' in sql))
+        self.assertFalse(any(re.search(r'(?<!SUBSTR\()"backend_article"\."text"', sql) for sql in article_queries))
+
+    def test_search(self):
+        response, queries = self.changelist(q='writer1')
+        self.assertEqual({article.title for article in response.context['cl'].result_list},
+                         {"Article title 1", "Article title 4"})
+        response, queries = self.changelist(q='last2')
+        self.assertEqual({article.title for article in response.context['cl'].result_list},
+                         {"Article title 2", "Article title 5"})
+        response, queries = self.changelist(q='title 3')
+        self.assertEqual([article.title for article in response.context['cl'].result_list], ["Article title 3"])
+        self.assertFalse(any(re.search(r'"backend_article"\."(title|text)" LIKE', query['sql']) for query in queries))
+
+    def test_estimated_count(self):
+        self.assertGreaterEqual(estimated_count(Article), Article.objects.count())
+        with mock.patch('backend.admin.estimated_count', return_value=5000000) as estimate:
+            with override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=1000000):
+                self.assertEqual(EstimatedCountPaginator(Article.objects.order_by('pk'), 100).count, 5000000)
+                self.assertEqual(EstimatedCountPaginator(Article.objects.filter(status='draft').order_by('pk'), 100).count, 6)
+            self.assertEqual(EstimatedCountPaginator(Article.objects.order_by('pk'), 100).count, 5000000)
+            estimate.return_value = 10
+            self.assertEqual(EstimatedCountPaginator(Article.objects.order_by('pk'), 100).count, 6)
+
+    def test_estimated_count_from_statistics(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(estimated_count(Article), 6)
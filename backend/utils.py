@@ -1,4 +1,47 @@
+from django.db import DatabaseError, connections
+from django.db.models import Max
+
 ARTICLE_STATUS_CHOICES = [
     ('draft', 'DRAFT'),
     ('published', 'PUBLISHED'),
-]
\ No newline at end of file
+]
+
+# Values per IN (...) clause, below the SQLite limit of query parameters
+BATCH_SIZE = 500
+# Largest primary key any of the supported databases stores (a signed 64-bit integer)
+MAX_PK = 2 ** 63 - 1
+
+
+def estimated_count(model, using='default'):
+    """
+    Number of rows in a model's table without scanning it: from the planner statistics where
+    there are any, otherwise the highest primary key (never less than the real count for
+    auto-incremented keys)
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+            row = cursor.fetchone()
+            if row and row[0] > 0:
+                return row[0]
+        elif connection.vendor == 'sqlite':
+            try:
+                # Filled in by ANALYZE; the first number is the row count
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+                row = cursor.fetchone()
+            except DatabaseError:
+                row = None
+            if row:
+                return int(row[0].split()[0])
+    return model._default_manager.using(using).aggregate(highest=Max('pk'))['highest'] or 0
+
+
+def chunks(values, size=BATCH_SIZE):
+    """
+    Splits values into lists of at most `size` of them
+    """
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
@@ -35,7 +35,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.StatelessJWTAuthentication',  # JWTAuthentication without a user query per request
         'rest_framework.authentication.SessionAuthentication',  # enable this if you want session auth
         'rest_framework.authentication.BasicAuthentication',  # enable this if you want to auth with user+pass
     ),
@@ -43,13 +43,93 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',  # enable this if you need Browsable API
     ),
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetCursorPagination',
+    'PAGE_SIZE': 20,  # clients can ask for up to KeysetCursorPagination.max_page_size with ?page_size=
+    # Token buckets shared by all the workers of a host (see API_THROTTLE_DB), for the views with a throttle_scope
+    'DEFAULT_THROTTLE_CLASSES': (
+        'api.throttling.UserThrottle',
+        'api.throttling.UsernameThrottle',
+        'api.throttling.IPThrottle',
+    ),
+    # '<throttle_scope>_user', '<throttle_scope>_username' and '<throttle_scope>_ip': bursts of N requests, refilled
+    # over the period
+    'DEFAULT_THROTTLE_RATES': {
+        'token_user': '10/min',  # per client address and username tried
+        'token_username': '30/min',  # per username tried, from any address
+        'token_ip': '30/min',
+        'writes_user': '120/min',  # article and topic writes
+        'writes_ip': '600/min',
+        'streams_user': '30/hour',  # GET /api/articles/?stream=true, the whole list at once
+        'streams_ip': '60/hour',
+    },
+    # Proxies in front of the server that append the client address to X-Forwarded-For (1 for the Heroku router,
+    # see Procfile). With 0 the header is ignored, as anyone can send one
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
 }
 
+# SQLite file of the throttle buckets, defaults to one in the system temp dir
+API_THROTTLE_DB = os.environ.get('API_THROTTLE_DB')
+
+# Runs the tests with throttle buckets and single-flight locks of their own (see API_THROTTLE_DB)
+TEST_RUNNER = 'api.testing.TestRunner'
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),  # Token expiration
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),  # Refresh token expiration
 }
 
+# Deactivating a user or changing is_staff reaches tokens that were already issued within this many seconds
+API_AUTH_REVOCATION_WINDOW = 300
+# Most users kept in the per-process cache of StatelessJWTAuthentication
+API_AUTH_USER_CACHE_SIZE = 10000
+
+# Most articles accepted by a single POST /api/articles/publish/ request
+ARTICLE_BULK_PUBLISH_LIMIT = 5000
+
+# Most articles accepted by a single GET /api/articles/batch/?ids= request
+ARTICLE_BATCH_LIMIT = 100
+
+# Characters of the article text in the excerpt field (?fields=excerpt)
+ARTICLE_EXCERPT_LENGTH = 200
+
+# GET /api/articles/changes/ only lists changes made at least this many seconds ago, so that a poll
+# doesn't skip the ones of transactions that were still in flight
+ARTICLE_CHANGES_DELAY = 5
+# Deleted articles stay in the changes feed for this many days (see purge_article_tombstones)
+ARTICLE_TOMBSTONE_RETENTION_DAYS = 30
+
+# Titles returned by GET /api/autocomplete/ by default, and at most with ?limit=
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+# Load the autocomplete indexes in the background when a server process starts, instead of on first use
+AUTOCOMPLETE_WARM_UP = True
+# Seconds after which the indexes sync with the database even if no write changed the API cache of their process
+AUTOCOMPLETE_SYNC_INTERVAL = 60
+
+# Articles listed by GET /api/articles/<pk>/related/ (see build_related_articles)
+RELATED_ARTICLES_COUNT = 5
+# Terms of an article compared with the other articles, the ones with the highest TF-IDF weight
+RELATED_ARTICLES_TERMS = 25
+# Terms found in more than this share of the articles don't make two articles related
+RELATED_ARTICLES_MAX_DF = 0.5
+# Articles a term is compared on at most, the ones it weighs most in
+RELATED_ARTICLES_CANDIDATES = 1000
+
+# Work queued after writes (see backend.tasks) is done by `./manage.py run_tasks`. With TASKS_EAGER it's done right
+# away instead, inside the request
+TASKS_EAGER = False
+# Failed tasks are tried again after TASK_RETRY_DELAY seconds, twice as long every time, up to TASK_MAX_ATTEMPTS times
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_DELAY = 10
+# Tasks of a worker that hasn't finished them after this many seconds go to the other workers
+TASK_LOCK_TIMEOUT = 300
+
+# Admin changelists of bigger tables show an estimated number of rows instead of running a COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
+# Most articles accepted by a single POST /api/articles/bulk/ request
+ARTICLE_BULK_CREATE_LIMIT = 5000
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -71,7 +151,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'api.snapshots.SnapshotMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -113,6 +196,77 @@ DATABASES = {
     }
 }
 
+# Read replicas of the default (primary) database. Locally, REPLICA_DATABASES="replica1.db,replica2.db"
+# adds SQLite files as stand-ins; other engines are added to DATABASES and DATABASE_REPLICAS directly.
+# Needs an API cache that all the server processes share (see API_CACHE_DIR), which tells them the clients that
+# just wrote.
+DATABASE_REPLICAS = []
+for number, name in enumerate(filter(None, os.environ.get('REPLICA_DATABASES', '').split(',')), start=1):
+    alias = 'replica{}'.format(number)
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, name),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+REPLICA_STICKY_WINDOW = 5  # seconds a client reads from the primary after writing
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# The local-memory cache is per process: writes made by another process (another gunicorn worker, or a
+# management command such as publish_scheduled_articles, run_tasks or generate_data) don't invalidate its
+# responses, which stay stale for up to API_CACHE_TIMEOUT. Deployments with more than one process must point
+# API_CACHE_DIR at a directory they all share, so that they share cached responses and their invalidations.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api-responses',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+if os.environ.get('API_CACHE_DIR'):
+    CACHES['api'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ['API_CACHE_DIR'],
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+
+API_CACHE_ALIAS = 'api'
+API_CACHE_TIMEOUT = 300  # seconds; writes invalidate cached responses straight away
+# Concurrent requests for the same uncached response wait for the first one to render it instead of all running
+# the same queries. With API_SINGLE_FLIGHT_SHARED, the processes sharing the API cache (see API_CACHE_DIR) also
+# take turns: one renders, the others pick its response up from the cache
+API_SINGLE_FLIGHT = True
+API_SINGLE_FLIGHT_SHARED = os.environ.get('API_SINGLE_FLIGHT_SHARED') == '1'
+# Seconds a request waits for another one to render a response before it renders it itself
+API_SINGLE_FLIGHT_TIMEOUT = 10
+# Where the processes take turns, with a lock file per response being rendered. They must all see the same
+# directory, on a local file system; defaults to one in the system temp dir
+API_SINGLE_FLIGHT_LOCK_DIR = os.environ.get('API_SINGLE_FLIGHT_LOCK_DIR')
+
+
+# Request metrics, served at /api/metrics/ to staff users. Every gunicorn worker
+# writes its numbers to a file in METRICS_DIR, so all the workers of a host must share it.
+
+METRICS_DIR = os.environ.get('METRICS_DIR')  # defaults to a directory in the system temp dir
+METRICS_FLUSH_INTERVAL = 1.0  # seconds
+
+
+# Static snapshots of the public API, written by `./manage.py export_snapshots` and served by WhiteNoise
+# at API_SNAPSHOT_URL without touching the database. Leave API_SNAPSHOT_DIR unset to turn them off.
+
+API_SNAPSHOT_DIR = os.environ.get('API_SNAPSHOT_DIR')
+API_SNAPSHOT_URL = '/snapshots/'
+API_SNAPSHOT_BASE_URL = os.environ.get('API_SNAPSHOT_BASE_URL', 'http://localhost:8000')  # origin of the hyperlinks
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
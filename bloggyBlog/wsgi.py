@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bloggyBlog.settings')
 
 application = get_wsgi_application()
+
+from api.autocomplete import warm_up  # noqa: E402 (needs the apps loaded)
+
+warm_up()